@@ -1,42 +1,51 @@
 # HashTable.py
-import logging
+import itertools
+import math
 
+# Bucket markers, compared by identity. A tombstone marks a deleted entry so probe chains through it stay intact.
+_EMPTY = object()
+_TOMBSTONE = object()
 
-class HashItem:
-    """
-    Represents a key-value pair within a hash table.
+_MASK_64 = (1 << 64) - 1
+_SALTS = itertools.count(1)  # each table gets the next salt, so runs stay reproducible
 
-    :arg
-        key (object): Unique identifier for data
-        value (object): Data associated with the key
 
+def _hash(key, salt):
     """
+    Returns the hash of a key salted and with its bits mixed (the splitmix64 finalizer).
 
-    def __init__(self, key, value):
-        """
-        Initializes a hash item
-
-        :arg
-            key (object): Unique identifier for data
-            value (object): Data associated with key
-        """
-        self.key = key
-        self.value = value
-        logging.debug(f'Created HashItem: key={key}, value={value}')
+    Small integers hash to themselves, so sequential IDs would fill one contiguous run of buckets and every miss would
+    probe to the end of it. Mixing spreads them over the table. The salt differs per table, so copying one table into
+    another in bucket order does not crowd the keys into part of the new table while it grows. Salting and mixing are
+    both bijections, so equal mixed hashes still mean equal hashes.
+    """
+    h = (hash(key) ^ salt) & _MASK_64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return h ^ (h >> 31)
 
 
 class HashTable:
     """
     A hash table implementation for efficient key-value lookup.
 
-    This class uses hash functions with empty buckets to store key-value pairs. This class provides a method for
-    inserting, searching and deleting.
+    This class uses open addressing with linear probing to store key-value pairs. Keys, their cached hashes and values
+    are kept in three parallel lists instead of one object per entry, hashes are mixed before they pick a bucket so
+    sequential keys do not cluster, and deleted entries are replaced by tombstones
+    so later keys in the same probe chain can still be found. This class provides a method for inserting, searching
+    and deleting.
 
     :arg
         m_capacity (int): Indicates number of buckets
-        m_buckets (List[HashItem]): A list containing a hashtable where each entry can be a HashItem.
+        m_bucket_keys (List[object]): The key stored in each bucket, or the _EMPTY / _TOMBSTONE markers
+        m_bucket_hashes (List[int]): The cached mixed hash of the key in each bucket
+        m_bucket_values (List[object]): The value stored in each bucket
         m_counter (int): The number of elements present within the hash table
+        m_tombstones (int): The number of buckets holding a tombstone
+        m_salt (int): The salt mixed into every hash of this table
     """
+    M_MAX_LOAD_FACTOR = 0.75
+
     def __init__(self, capacity=80):
         """
         Initializes a HashTable object.
@@ -54,8 +63,118 @@ class HashTable:
             raise ValueError('Hash table capacity must be a positive integer.')
 
         self.m_capacity = capacity
-        self.m_buckets = [None for i in range(capacity)]
+        self.m_bucket_keys = [_EMPTY] * capacity
+        self.m_bucket_hashes = [0] * capacity
+        self.m_bucket_values = [None] * capacity
         self.m_counter = 0
+        self.m_tombstones = 0
+        self.m_salt = (next(_SALTS) * 0x9E3779B97F4A7C15) & _MASK_64
+
+    @classmethod
+    def m_from_items(cls, items, size_hint=None):
+        """
+        Builds a hash table from (key, value) pairs, sized once for all of them.
+
+        :arg
+            items (Iterable[Tuple[object, object]]): The key-value pairs, later pairs replace earlier ones with the
+                same key
+            size_hint (int, optional): The expected number of pairs, used instead of materializing 'items' when it has
+                no length
+
+        :returns
+            HashTable: The filled hash table
+        """
+        if size_hint is None:
+            if not hasattr(items, '__len__'):
+                items = list(items)
+            size_hint = len(items)
+        table = cls(cls._capacity_for(max(size_hint, 1)))
+        table.m_bulk_insert(items, size_hint)
+        return table
+
+    @classmethod
+    def _capacity_for(cls, count):
+        """Returns the smallest capacity holding 'count' entries within the maximum load factor."""
+        return math.floor(count / cls.M_MAX_LOAD_FACTOR) + 1
+
+    def __len__(self):
+        """Returns the number of elements present within the hash table."""
+        return self.m_counter
+
+    def m_reserve(self, count):
+        """
+        Grows the table once so it can hold 'count' entries without resizing.
+
+        :arg
+            count (int): The number of entries the table should hold
+        """
+        capacity = self._capacity_for(count + self.m_tombstones)
+        if capacity > self.m_capacity:
+            self.m_resize(capacity)
+
+    def m_bulk_insert(self, items, size_hint=None):
+        """
+        Inserts many (key, value) pairs, sizing the table once instead of resizing while inserting.
+
+        :arg
+            items (Iterable[Tuple[object, object]]): The key-value pairs to insert
+            size_hint (int, optional): The expected number of pairs, used instead of materializing 'items' when it has
+                no length
+        """
+        if size_hint is None:
+            if not hasattr(items, '__len__'):
+                items = list(items)
+            size_hint = len(items)
+        self.m_reserve(self.m_counter + size_hint)
+
+        for key, item in items:
+            if (self.m_counter + self.m_tombstones + 1) / self.m_capacity > self.M_MAX_LOAD_FACTOR:
+                self.m_resize()  # only reached when the size hint was too small
+            self._insert_hashed(key, _hash(key, self.m_salt), item)
+
+    def __iter__(self):
+        """Iterates over the keys in the hash table in bucket order."""
+        return self.m_keys()
+
+    def __contains__(self, key):
+        """Returns True if the key is in the hash table."""
+        return self._find_bucket(key, _hash(key, self.m_salt)) >= 0
+
+    def m_keys(self, ordered=False):
+        """Iterates over the keys in the hash table, visiting only live buckets.
+
+        :arg
+            ordered (bool, optional): Yield the keys in sorted order instead of bucket order
+
+        :returns
+            Iterator[object]: The keys"""
+        keys = (key for key in self.m_bucket_keys if key is not _EMPTY and key is not _TOMBSTONE)
+        return iter(sorted(keys)) if ordered else keys
+
+    def m_items(self, ordered=False):
+        """Iterates over the (key, value) pairs in the hash table, visiting only live buckets.
+
+        :arg
+            ordered (bool, optional): Yield the pairs sorted by key instead of in bucket order
+
+        :returns
+            Iterator[Tuple[object, object]]: The key-value pairs"""
+        items = ((key, value) for key, value in zip(self.m_bucket_keys, self.m_bucket_values)
+                 if key is not _EMPTY and key is not _TOMBSTONE)
+        return iter(sorted(items, key=lambda item: item[0])) if ordered else items
+
+    def m_probe_lengths(self):
+        """Counts how many probes a successful lookup of each key takes, read from where the keys sit in the table.
+
+        :returns
+            Dict[int, int]: The number of keys found after each probe length, 1 meaning the key is in its home bucket"""
+        histogram = {}
+        capacity = self.m_capacity
+        for index, (key, h) in enumerate(zip(self.m_bucket_keys, self.m_bucket_hashes)):
+            if key is not _EMPTY and key is not _TOMBSTONE:
+                length = (index - h % capacity) % capacity + 1
+                histogram[length] = histogram.get(length, 0) + 1
+        return histogram
 
     def m_load_factor(self):
         """Calculate the current load factor of the hash table.
@@ -63,87 +182,138 @@ class HashTable:
         :returns: The load factor of the table"""
         return self.m_counter / self.m_capacity
 
-    def m_resize(self):
+    def m_resize(self, capacity=None):
         """
-        Resize the hash table when the load factor exceeds the 0.75.
-        This method will double the capacity and rehashes all existing items.
+        Resize the hash table when the buckets in use (entries and tombstones) exceed the 0.75 load factor.
+        This method will double the capacity, or keep it when most of the used buckets are tombstones, and rehashes
+        all existing items using their cached hashes. Tombstones are dropped.
+
+        :arg
+            capacity (int, optional): The new capacity, by default it is chosen from the number of entries
         """
-        old_buckets = self.m_buckets
-        self.m_capacity *= 2
-        self.m_buckets = [None for _ in range(self.m_capacity)]
-        self.m_counter = 0
+        if capacity is None:
+            capacity = self.m_capacity * 2 if self.m_counter >= self.m_capacity // 2 else self.m_capacity
+        old_keys, old_hashes, old_values = self.m_bucket_keys, self.m_bucket_hashes, self.m_bucket_values
+        self.m_capacity = capacity
+        self.m_bucket_keys = [_EMPTY] * capacity
+        self.m_bucket_hashes = [0] * capacity
+        self.m_bucket_values = [None] * capacity
+        self.m_tombstones = 0
+
+        keys, hashes, values = self.m_bucket_keys, self.m_bucket_hashes, self.m_bucket_values
+        for key, h, value in zip(old_keys, old_hashes, old_values):
+            if key is _EMPTY or key is _TOMBSTONE:
+                continue
+            index = h % capacity
+            while keys[index] is not _EMPTY:  # no duplicates or tombstones in a fresh table
+                index = (index + 1) % capacity
+            keys[index] = key
+            hashes[index] = h
+            values[index] = value
+
+    def _find_bucket(self, key, h):
+        """
+        Finds the bucket holding a key.
 
-        for item in old_buckets:
-            if isinstance(item, HashItem):
-                self.m_insert(item.key, item.value)
+        :arg
+            key (object): The key to find
+            h (int): The hash of the key
+
+        :returns
+            int: The bucket of the key, or -1 if it is not in the table
+        """
+        keys, hashes, capacity = self.m_bucket_keys, self.m_bucket_hashes, self.m_capacity
+        index = h % capacity
+        for _ in range(capacity):
+            bucket_key = keys[index]
+            if bucket_key is _EMPTY:
+                return -1
+            if bucket_key is not _TOMBSTONE and hashes[index] == h and (bucket_key is key or bucket_key == key):
+                return index
+            index = (index + 1) % capacity
+        return -1
 
     def m_insert(self, key, item):
         """
         Inserts a key-value pair into the hash table.
 
-        This method will create a HashItem object then it will calculate a hash for the key value to place into the
-        hash table's bucket. If the bucket it hashes, then it will use linear probing to find an empty bucket to insert
-        the HashItem object into.
+        This method will calculate a hash for the key value to place into the hash table's bucket. If the bucket is
+        taken, then it will use linear probing to find the key or an empty bucket. An existing key has its value
+        replaced, and a new key reuses the first tombstone passed on the way.
 
         :arg
             key (object): The unique identifier for the data
             item (object): Data associated with the key.
 
         Raises:
-            RuntimeError:
-                - If the hash table is full (load factor exceeds a threshold)
+            TypeError:
+                - If the key is not hashable
         """
 
-        if self.m_load_factor() >= 0.75:  # if the load factor > 0.75, then resize hash table
-            self.m_resize()
+        if (self.m_counter + self.m_tombstones + 1) / self.m_capacity > self.M_MAX_LOAD_FACTOR:
+            self.m_resize()  # if the used buckets would exceed the load factor, then resize hash table
 
-        item = HashItem(key, item)
-        h = hash(key) % self.m_capacity
+        self._insert_hashed(key, _hash(key, self.m_salt), item)
 
-        while self.m_buckets[h] is not None:
-            if self.m_buckets[h].key is key:  # Do not allow duplicate values
-                break
-            h = (h + 1) % self.m_capacity  # probe through the table
+    def _insert_hashed(self, key, h, item):
+        """
+        Inserts a key-value pair whose hash is already known, assuming the table has room for it.
 
-        # This means we found an open bucket that has not been assigned a value
-        if self.m_buckets[h] is None:
-            self.m_counter += 1
-        self.m_buckets[h] = item  # insert hash item after incrementing the counter
+        :arg
+            key (object): The unique identifier for the data
+            h (int): The hash of the key
+            item (object): Data associated with the key.
+        """
+        keys, hashes, capacity = self.m_bucket_keys, self.m_bucket_hashes, self.m_capacity
+        index = h % capacity
+        first_tombstone = -1
+
+        while keys[index] is not _EMPTY:
+            bucket_key = keys[index]
+            if bucket_key is _TOMBSTONE:
+                if first_tombstone < 0:
+                    first_tombstone = index
+            elif hashes[index] == h and (bucket_key is key or bucket_key == key):  # Do not allow duplicate values
+                self.m_bucket_values[index] = item
+                return
+            index = (index + 1) % capacity  # probe through the table
+
+        # This means the key is new, reuse a tombstone if one was passed
+        if first_tombstone >= 0:
+            index = first_tombstone
+            self.m_tombstones -= 1
+        keys[index] = key
+        hashes[index] = h
+        self.m_bucket_values[index] = item
+        self.m_counter += 1
 
     def m_look_up(self, key):
         """Looks up a value associated with a given key in the hashtable.
 
-        This method calculates a hash value of the key to return the value or will opt to use linear probing to find
-        the bucket with the key to return the corresponding value in the HashItem object.
+        This method calculates a hash value of the key and uses linear probing to find the bucket holding an equal key,
+        skipping over tombstones, to return the corresponding value.
 
         :arg
-            key (object): The unique identifier in the hashtable stored in a HashItem.
+            key (object): The unique identifier in the hashtable.
 
         :returns
             object: The value associated with the key, or None if the key is not found."""
-        h = hash(key) % self.m_capacity
-        while self.m_buckets[h] is not None:
-            try:
-                if self.m_buckets[h].key is key:  # we found our value
-                    return self.m_buckets[h].value  # return our value
-            except AttributeError:  # ignore if bucket is empty
-                pass
-            h = (h + 1) % self.m_capacity
-        return None  # if not found return none
+        index = self._find_bucket(key, _hash(key, self.m_salt))
+        return self.m_bucket_values[index] if index >= 0 else None  # if not found return none
 
     def m_delete(self, key):
         """Deletes a key-value pair from the hash table.
 
         This method calculates the hash value then will use linear probing if the bucket with the same key is not found
-        initially, then once the proper bucket is found, it will be marked empty and the counter will decrement by 1.
+        initially, then once the proper bucket is found, it will be marked with a tombstone and the counter will
+        decrement by 1.
 
         :arg
             key (object): The unique identifier for the data to be deleted"""
-        h = hash(key) % self.m_capacity  # Find hash value
-        while self.m_buckets[h] is not None:  # Run if it is not empty
-            if self.m_buckets[h].key is key:  # When key is found
-                self.m_buckets[h] = None  # Mark the bucket as empty
-                self.m_counter -= 1  # Decrement the counter
-                break  # Break out of function
-            h = (h + 1) % self.m_capacity  # probe through list if needed
-        # loop will exit if not found
+        index = self._find_bucket(key, _hash(key, self.m_salt))
+        if index < 0:
+            return  # not found
+        self.m_bucket_keys[index] = _TOMBSTONE  # Keep the probe chain intact
+        self.m_bucket_values[index] = None
+        self.m_counter -= 1
+        self.m_tombstones += 1
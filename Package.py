@@ -1,7 +1,10 @@
 # Package.py
+import bisect
 import logging
 import datetime
 
+m_logger = logging.getLogger('delivery.package')
+
 
 class Package:
     """
@@ -14,13 +17,20 @@ class Package:
             m_state (str): The state where the package will be delivered.
             m_zip (str): The zip code of the delivery location.
             m_deadline (str): The deadline for delivery.
+            m_deadline_time (datetime.timedelta): The deadline as a time of day, None for an EOD deadline. (Optional)
             m_weight (str): The weight of the package.
             m_status (str): The current status of the package (e.g., "En route", "Delivered").
             m_departure_time (datetime.datetime): The time the package departed from the hub. (Optional)
             m_delivery_time (datetime.datetime): The time the package was delivered. (Optional)
+            m_vertex (int): The cached vertex ID of the delivery address, None if it has not been resolved. (Optional)
+            m_notes (str): The special notes for the package, e.g. 'Can only be on truck 2'. (Optional)
+            m_timeline (tuple): The package's states as (start time, state) pairs, built once the delivery simulation
+                has finished, where each state is (status, address, city, state, zip, departure time, delivery time).
+                None until it is built. (Optional)
         """
 
-    def __init__(self, ID, address, city, state, zip, deadline, weight, status):
+    def __init__(self, ID, address, city, state, zip, deadline, weight, status, vertex=None, notes='',
+                 deadline_time=None):
         """
         Initializes a Package object.
 
@@ -35,6 +45,9 @@ class Package:
             m_status (str): The current status of the package (e.g., "En route", "Delivered").
             m_departure_time (datetime.datetime): The time the package departed from the hub. (Optional)
             m_delivery_time (datetime.datetime): The time the package was delivered. (Optional)
+            m_vertex (int): The cached vertex ID of the delivery address. (Optional)
+            m_notes (str): The special notes for the package. (Optional)
+            m_deadline_time (datetime.timedelta): The deadline parsed as a time of day. (Optional)
     """
         self.m_ID = ID
         self.m_address = address
@@ -42,10 +55,13 @@ class Package:
         self.m_state = state
         self.m_zip = zip
         self.m_deadline = deadline
+        self.m_deadline_time = deadline_time
         self.m_weight = weight
         self.m_status = status
         self.m_departure_time = None
         self.m_delivery_time = None
+        self.m_vertex = vertex
+        self.m_notes = notes
 
         # in preparation for package 9
         self.m_original_address = address
@@ -56,6 +72,16 @@ class Package:
         self.m_original_departure_time = None
         self.m_original_delivery_time = None
         self.m_truck = None  # Keep track of which truck it is on
+        self.m_timeline = None
+        self.m_timeline_times = ()  # start time of each timeline entry, searched with bisect
+
+    def m_is_late(self):
+        """Returns True if the package was delivered after its deadline.
+
+        :returns
+            bool: False if the package has no deadline or has not been delivered yet"""
+        return (self.m_deadline_time is not None and self.m_delivery_time is not None and
+                self.m_delivery_time > self.m_deadline_time)
 
     def __str__(self):
         """Returns a string representation of the package's details
@@ -95,18 +121,42 @@ class Package:
                 delivery_time = self.m_original_delivery_time
                 departure_time = self.m_original_departure_time
 
+        return self.m_format_state((self.m_status, address, city, state, intermediate_zip, departure_time,
+                                   delivery_time))
+
+    def m_get_status_string_at(self, time: datetime.timedelta):
+        """
+        Generate the formatted status string of the package at the given time without changing the package.
+
+        :arg
+            time (datetime.timedelta): The time of day to show the package at
+
+        :return: (str) A formatted string containing all relevant package information and status at that time.
+        """
+        return self.m_format_state(self.m_status_at(time))
+
+    def m_format_state(self, package_state):
+        """
+        Formats a package state as a fixed width row.
+
+        :arg
+            package_state (tuple): (status, address, city, state, zip, departure time, delivery time)
+
+        :return: (str) A formatted string containing all relevant package information and status.
+        """
+        status, address, city, state, intermediate_zip, departure_time, delivery_time = package_state
         truck_info = f'on Truck #{self.m_truck}' if self.m_truck else 'not assigned'
 
         # Adjust departure and delivery time display based on status
         delivery_time_str = ''
         departure_time_str = ''
-        if self.m_status == 'En route':
+        if status == 'En route':
             delivery_time_str = 'None'
             departure_time_str = str(departure_time)
-        elif self.m_status == 'At hub':
+        elif status == 'At hub':
             delivery_time_str = 'None'
             departure_time_str = 'None'
-        elif self.m_status == 'Delivered':
+        elif status == 'Delivered':
             delivery_time_str = str(delivery_time)
             departure_time_str = str(departure_time)
         else:
@@ -135,9 +185,38 @@ class Package:
                 f"{self.m_weight:<{weight_width}} "
                 f"Delivery time: {delivery_time_str:<{delivery_time_width}} "
                 f"Departure time: {departure_time_str:<{departure_time_width}} "
-                f"{self.m_status:<{status_width}} "
+                f"{status:<{status_width}} "
                 f"{truck_info:<{truck_width}}")
 
+    def m_state_to_dict(self, package_state):
+        """
+        Converts a package state into a JSON serializable dictionary, showing the same times as the status string.
+
+        :arg
+            package_state (tuple): (status, address, city, state, zip, departure time, delivery time)
+
+        :returns
+            dict: The package's details and status, times are 'H:MM:SS' strings or None
+        """
+        status, address, city, state, intermediate_zip, departure_time, delivery_time = package_state
+        if status not in ('En route', 'Delivered'):
+            departure_time = None
+        if status != 'Delivered':
+            delivery_time = None
+        return {
+            'package_id': self.m_ID,
+            'address': address,
+            'city': city,
+            'state': state,
+            'zip': intermediate_zip,
+            'deadline': self.m_deadline,
+            'weight': self.m_weight,
+            'status': status,
+            'departure_time': str(departure_time) if departure_time is not None else None,
+            'delivery_time': str(delivery_time) if delivery_time is not None else None,
+            'truck': self.m_truck,
+        }
+
     def m_update_status(self, time):
         """
         Updates the package status based on the current time with respect to the delivery time or departure time,
@@ -146,28 +225,75 @@ class Package:
         :arg
             time (datetime.timedelta): The current time for comparison
         """
+        self.m_status = self._state_at(time)[0]
+        m_logger.info('Package %s status updated to %s.', self.m_ID, self.m_status)
 
-        if self.m_ID == 9 and self.m_address_update_time:
-            if self.m_address_update_time <= time < self.m_departure_time:
-                self.m_status = 'En route'  # Say it's in route when it's on its way to pick up the package
-                return  # exit function
+    def _state_at(self, time):
+        """
+        Works out the package's state at the given time from its departure, delivery and address update times.
 
-        delivery_time = self.m_original_delivery_time if (
-                self.m_address_update_time and time < self.m_address_update_time) else self.m_delivery_time
-        departure_time = self.m_original_departure_time if (
-                self.m_address_update_time and time < self.m_address_update_time) else self.m_departure_time
+        :arg
+            time (datetime.timedelta): The time of day
 
-        if delivery_time and time >= delivery_time:
-            self.m_status = "Delivered"
-            logging.info(f'Package {self.m_ID} status updated to Delivered.')
+        :returns
+            tuple: (status, address, city, state, zip, departure time, delivery time) at that time
+        """
+        if self.m_address_update_time and time < self.m_address_update_time:
+            departure_time = self.m_original_departure_time
+            delivery_time = self.m_original_delivery_time
+            address = (self.m_original_address, self.m_original_city, self.m_original_state, self.m_original_zip)
+        else:
+            departure_time = self.m_departure_time
+            delivery_time = self.m_delivery_time
+            address = (self.m_address, self.m_city, self.m_state, self.m_zip)
+
+        if (self.m_address_update_time and self.m_departure_time and
+                self.m_address_update_time <= time < self.m_departure_time):
+            status = 'En route'  # Say it's in route when it's on its way to pick up the redelivery
+        elif delivery_time and time >= delivery_time:
+            status = 'Delivered'
         elif departure_time and time >= departure_time:
-            self.m_status = "En route"
-            logging.info(f'Package {self.m_ID} status updated to En route.')
+            status = 'En route'
         else:
-            self.m_status = "At Hub"
-            logging.info(f'Package {self.m_ID} status updated to At hub .')
+            status = 'At Hub'
+        return (status,) + address + (departure_time, delivery_time)
+
+    def m_build_timeline(self):
+        """
+        Precomputes the package's states over the day once its departure, delivery and address update times are final.
+
+        The state only changes at those times, so it is worked out once at each of them and consecutive equal states
+        are merged. The timeline is immutable, status queries search it with bisect and never change the package.
+        """
+        changes = {self.m_original_departure_time, self.m_original_delivery_time, self.m_address_update_time,
+                   self.m_departure_time, self.m_delivery_time}
+        changes.discard(None)
+
+        timeline = [(datetime.timedelta.min, self._state_at(datetime.timedelta.min))]
+        for time in sorted(changes):
+            package_state = self._state_at(time)
+            if package_state != timeline[-1][1]:
+                timeline.append((time, package_state))
+
+        self.m_timeline = tuple(timeline)
+        self.m_timeline_times = tuple(time for time, _ in timeline)
+
+    def m_status_at(self, time):
+        """
+        Returns the package's state at the given time without changing the package.
+
+        :arg
+            time (datetime.timedelta): The time of day
+
+        :returns
+            tuple: (status, address, city, state, zip, departure time, delivery time) at that time, looked up in the
+                timeline when it has been built
+        """
+        if self.m_timeline is None:
+            return self._state_at(time)
+        return self.m_timeline[bisect.bisect_right(self.m_timeline_times, time) - 1][1]
 
-    def update_address(self, new_address, new_city, new_state, new_zip, update_time):
+    def update_address(self, new_address, new_city, new_state, new_zip, update_time, new_vertex=None):
         """
             Update the status of the package based on the given time.
 
@@ -181,6 +307,8 @@ class Package:
                 new_state (str): new state as a string
                 new_zip (str): new zip as a string
                 update_time (datetime.timedelta): the updated time to be assigned
+                new_vertex (int, optional): vertex ID of the new address, if omitted the cached vertex is cleared so it
+                    is resolved again before routing
 
             :raises AttributeError: If required attributes are missing from the package object.
             """
@@ -189,3 +317,4 @@ class Package:
         self.m_state = new_state
         self.m_zip = new_zip
         self.m_address_update_time = update_time
+        self.m_vertex = new_vertex
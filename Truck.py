@@ -9,12 +9,18 @@ class Truck:
         m_packages (list[Package]): A list of Package objects assigned to the truck.
         m_mileage (float): The total mileage accumulated by the truck.
         m_address (str): The starting address of the truck.
+        m_vertex (int): The vertex ID of the truck's current address, resolved once and used for routing.
+        m_depends_on (list[int]): Numbers of the trucks that must be routed first, this truck departs when the first
+            of them returns.
+        m_itinerary (list[tuple]): Every place the truck reached as (time, mileage, vertex, address, package IDs,
+            is route stop), starting with its starting point. Used to re-route the truck from any point in its day.
         m_departure_time (str): The scheduled departure time for the truck.
         m_time (str): The current time of the truck (used for tracking deliveries).
         m_load (object): Keeps track if the truck is loaded or not, will be utilized in future iteration.
 
     """
-    def __init__(self, capacity, speed, packages, mileage, address, depart_time, load, truck_number):
+    def __init__(self, capacity, speed, packages, mileage, address, depart_time, load, truck_number, vertex=None,
+                 depends_on=None):
         """
         Initializes the Truck class for you
 
@@ -27,6 +33,8 @@ class Truck:
             departure_time (str): The scheduled departure time for the truck.
             time (str): The current time of the truck (used for tracking deliveries).
             load (object): Keeps track if the truck is loaded or not, will be utilized in future iteration.
+            vertex (int, optional): The vertex ID of the starting address, resolved by DeliveryService if omitted.
+            depends_on (list[int], optional): Numbers of the trucks that must be routed before this one.
         """
         self.m_capacity = capacity
         self.m_speed = speed
@@ -37,6 +45,9 @@ class Truck:
         self.m_time = depart_time
         self.m_load = load
         self.m_truck_number = truck_number
+        self.m_vertex = vertex
+        self.m_depends_on = depends_on or []
+        self.m_itinerary = []
 
     def __str__(self):
         """Returns a string representation of the truck object.
@@ -0,0 +1,321 @@
+# assignment.py
+import datetime
+import logging
+import math
+import re
+from array import array
+from typing import Dict, List, Optional, Set
+
+from Package import Package
+from Truck import Truck
+
+m_logger = logging.getLogger('delivery.assignment')
+
+M_TRUCK_ONLY_NOTE = re.compile(r'can only be on truck (\d+)', re.IGNORECASE)
+M_DELAYED_NOTE = re.compile(r'until (\d{1,2}:\d{2}\s*[ap]m)', re.IGNORECASE)
+M_GROUPED_NOTE = re.compile(r'must be delivered with ([\d,\s]+)', re.IGNORECASE)
+M_WRONG_ADDRESS_NOTE = re.compile(r'wrong address', re.IGNORECASE)
+
+
+def m_parse_available_time(notes: str) -> Optional[datetime.timedelta]:
+    """
+    Reads the time a delayed package arrives at the hub from its special notes.
+
+    :arg
+        notes (str): The package's special notes, e.g. 'Delayed on flight---will not arrive to depot until 9:05 am'
+
+    :returns
+        datetime.timedelta: The arrival time, or None if the package is not delayed
+    """
+    match = M_DELAYED_NOTE.search(notes)
+    if not match:
+        return None
+    parsed = datetime.datetime.strptime(match.group(1).replace(' ', '').upper(), '%I:%M%p')
+    return datetime.timedelta(hours=parsed.hour, minutes=parsed.minute)
+
+
+class PackageGroup:
+    """
+    A set of packages that must travel on the same truck, together with the constraints parsed from their notes.
+
+    Attributes:
+        m_packages (List[Package]): The packages in the group
+        m_truck_number (int): The only truck the group may be loaded on, None if any truck is allowed
+        m_available_time (datetime.timedelta): The time the last package of the group arrives at the hub, None if all
+            of them are already there
+        m_needs_late_truck (bool): True if the group has to wait for the hub (e.g. an address correction)
+        m_has_deadline (bool): True if any package of the group has a deadline other than EOD
+    """
+
+    def __init__(self, packages: List[Package]) -> None:
+        """
+        Initializes the group and parses the constraints out of the packages' special notes.
+
+        :arg
+            packages (List[Package]): The packages in the group
+
+        :raises
+            ValueError: If the packages require different trucks
+        """
+        self.m_packages = packages
+        self.m_truck_number: Optional[int] = None
+        self.m_available_time: Optional[datetime.timedelta] = None
+        self.m_needs_late_truck = False
+        self.m_has_deadline = any(package.m_deadline_time is not None for package in packages)
+
+        for package in packages:
+            match = M_TRUCK_ONLY_NOTE.search(package.m_notes)
+            if match:
+                number = int(match.group(1))
+                if self.m_truck_number not in (None, number):
+                    raise ValueError(f'Package {package.m_ID} must be on truck {number} but its group requires '
+                                     f'truck {self.m_truck_number}')
+                self.m_truck_number = number
+
+            available = m_parse_available_time(package.m_notes)
+            if available is not None:
+                self.m_available_time = max(self.m_available_time or available, available)
+
+            if M_WRONG_ADDRESS_NOTE.search(package.m_notes):
+                self.m_needs_late_truck = True
+
+
+class PackageAssigner:
+    """
+    Assigns packages to trucks automatically instead of using hand-maintained lists.
+
+    Packages are first grouped by their 'Must be delivered with' notes. The groups are then clustered with a
+    k-medoids approach over the distance matrix, one cluster per truck, while respecting each truck's capacity, the
+    'Can only be on truck' notes and the arrival time of delayed packages. Loads are kept balanced by filling each
+    truck up to an even share of the packages first, and only using its full capacity when a group does not fit
+    anywhere else.
+
+    Attributes:
+        m_distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+        m_hub_vertex (int): The vertex of the hub the trucks start from
+        m_max_iterations (int): The largest number of assign / update medoid rounds
+    """
+
+    def __init__(self, distance_matrix: List[array], hub_vertex: int, max_iterations: int = 10) -> None:
+        """
+        Initializes the package assigner.
+
+        :arg
+            distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+            hub_vertex (int): The vertex of the hub the trucks start from
+            max_iterations (int, optional): The largest number of assign / update medoid rounds
+        """
+        self.m_distance_matrix = distance_matrix
+        self.m_hub_vertex = hub_vertex
+        self.m_max_iterations = max_iterations
+
+    def m_assign(self, packages: List[Package], trucks: List[Truck]) -> None:
+        """
+        Assigns every package to a truck, replacing the package IDs in each truck's 'm_packages' list.
+
+        :arg
+            packages (List[Package]): The packages to assign, with their vertex IDs resolved
+            trucks (List[Truck]): The trucks available for delivery
+
+        :raises
+            ValueError: If the packages do not fit on the trucks or a constraint cannot be met
+        """
+        if not trucks:
+            raise ValueError('No trucks available for assignment')
+        if len(packages) > sum(truck.m_capacity for truck in trucks):
+            raise ValueError(f'{len(packages)} packages do not fit on the trucks')
+
+        groups = self._build_groups(packages)
+        allowed = {id(group): self._get_allowed_trucks(group, trucks) for group in groups}
+        target = math.ceil(len(packages) / len(trucks))
+
+        medoids = self._initial_medoids(groups, len(trucks))
+        loads: Dict[int, List[PackageGroup]] = {}
+        for iteration in range(self.m_max_iterations):
+            new_loads = self._assign_groups(groups, trucks, allowed, medoids, target)
+            if new_loads == loads:
+                break
+            loads = new_loads
+            medoids = [self._medoid(loads[index]) if loads[index] else medoids[index] for index in range(len(trucks))]
+
+        for index, truck in enumerate(trucks):
+            truck.m_packages = sorted(package.m_ID for group in loads[index] for package in group.m_packages)
+            m_logger.info('Assigned %s packages to truck %s', len(truck.m_packages), truck.m_truck_number)
+
+    @staticmethod
+    def m_check_departures(packages: List[Package], trucks: List[Truck]) -> List[Package]:
+        """
+        Checks, once the trucks are routed, that no delayed package left on a truck before it arrived at the hub.
+
+        The assignment only lets trucks that depend on other trucks carry delayed packages, because they leave late,
+        but how late is only known once the trucks they wait for are back. Each violation is logged.
+
+        :arg
+            packages (List[Package]): The assigned packages
+            trucks (List[Truck]): The routed trucks, 'm_departure_time' is their real departure
+
+        :returns
+            List[Package]: The packages whose truck departed before they arrived
+        """
+        departures = {truck.m_truck_number: truck.m_departure_time for truck in trucks}
+        early = []
+        for package in packages:
+            available = m_parse_available_time(package.m_notes)
+            departure = departures.get(package.m_truck)
+            if available is not None and departure is not None and departure < available:
+                m_logger.warning('Truck %s departed at %s before package %s arrived at %s', package.m_truck, departure,
+                                 package.m_ID, available)
+                early.append(package)
+        return early
+
+    @staticmethod
+    def _build_groups(packages: List[Package]) -> List[PackageGroup]:
+        """
+        Joins packages connected by 'Must be delivered with' notes into groups using union-find.
+
+        :arg
+            packages (List[Package]): The packages to group
+
+        :returns
+            List[PackageGroup]: The groups, ordered by their lowest package position
+        """
+        parent = list(range(len(packages)))
+        position = {package.m_ID: index for index, package in enumerate(packages)}
+
+        def find(index: int) -> int:
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        for index, package in enumerate(packages):
+            match = M_GROUPED_NOTE.search(package.m_notes)
+            if not match:
+                continue
+            for other in re.findall(r'\d+', match.group(1)):
+                if int(other) not in position:
+                    m_logger.warning('Package %s must be delivered with unknown package %s', package.m_ID, other)
+                    continue
+                parent[find(position[int(other)])] = find(index)
+
+        members: Dict[int, List[Package]] = {}
+        for index, package in enumerate(packages):
+            members.setdefault(find(index), []).append(package)
+        return [PackageGroup(group) for group in members.values()]
+
+    @staticmethod
+    def _get_allowed_trucks(group: PackageGroup, trucks: List[Truck]) -> List[List[int]]:
+        """
+        Finds the trucks a group may be loaded on, split into tiers of preference.
+
+        A truck that depends on other trucks leaves later than its configured departure time, so it is the only kind
+        of truck that can carry delayed packages or packages waiting for an address correction. Groups with a deadline
+        prefer the trucks that leave first, but may use the others when those are full.
+
+        :arg
+            group (PackageGroup): The group to load
+            trucks (List[Truck]): The trucks available for delivery
+
+        :returns
+            List[List[int]]: The positions of the allowed trucks, one list per tier with the preferred tier first
+
+        :raises
+            ValueError: If no truck satisfies the group's constraints
+        """
+        allowed = []
+        for index, truck in enumerate(trucks):
+            if group.m_truck_number is not None and truck.m_truck_number != group.m_truck_number:
+                continue
+            leaves_late = bool(truck.m_depends_on)
+            if group.m_needs_late_truck and not leaves_late:
+                continue
+            if group.m_available_time is not None and not leaves_late and \
+                    truck.m_departure_time < group.m_available_time:
+                continue
+            allowed.append(index)
+
+        if not allowed:
+            raise ValueError(f'No truck can carry packages {[package.m_ID for package in group.m_packages]}')
+        if group.m_has_deadline:
+            tiers = [[index for index in allowed if not trucks[index].m_depends_on],
+                     [index for index in allowed if trucks[index].m_depends_on]]
+            return [tier for tier in tiers if tier]
+        return [allowed]
+
+    def _group_cost(self, group: PackageGroup, medoid: int) -> float:
+        """Returns the average distance from the group's packages to a cluster medoid."""
+        row = self.m_distance_matrix[medoid]
+        return sum(row[package.m_vertex] for package in group.m_packages) / len(group.m_packages)
+
+    def _initial_medoids(self, groups: List[PackageGroup], count: int) -> List[int]:
+        """
+        Picks the starting medoids with farthest-first traversal, starting with the vertex farthest from the hub.
+
+        :arg
+            groups (List[PackageGroup]): The groups being assigned
+            count (int): The number of medoids (trucks)
+
+        :returns
+            List[int]: The vertex of every medoid
+        """
+        vertices = sorted({package.m_vertex for group in groups for package in group.m_packages})
+        if not vertices:
+            return [self.m_hub_vertex] * count
+
+        nearest = list(self.m_distance_matrix[self.m_hub_vertex][vertex] for vertex in vertices)
+        medoids = []
+        for _ in range(count):
+            pick = max(range(len(vertices)), key=nearest.__getitem__)
+            medoids.append(vertices[pick])
+            row = self.m_distance_matrix[vertices[pick]]
+            nearest = [min(distance, row[vertex]) for distance, vertex in zip(nearest, vertices)]
+        return medoids
+
+    def _assign_groups(self, groups: List[PackageGroup], trucks: List[Truck], allowed: Dict[int, List[List[int]]],
+                       medoids: List[int], target: int) -> Dict[int, List[PackageGroup]]:
+        """
+        Assigns every group to the nearest allowed truck cluster that has room for it.
+
+        The most constrained groups are placed first, followed by the groups that lose the most by not getting their
+        nearest cluster. A group goes to its most preferred tier of trucks whenever it fits there.
+
+        :returns
+            Dict[int, List[PackageGroup]]: The groups loaded on each truck position
+
+        :raises
+            ValueError: If a group does not fit on any of its allowed trucks
+        """
+        def regret(group: PackageGroup) -> float:
+            costs = sorted(self._group_cost(group, medoids[index]) for index in allowed[id(group)][0])
+            return costs[1] - costs[0] if len(costs) > 1 else math.inf
+
+        ordered = sorted(groups, key=lambda group: (sum(map(len, allowed[id(group)])), -regret(group)))
+        loads: Dict[int, List[PackageGroup]] = {index: [] for index in range(len(trucks))}
+        counts = [0] * len(trucks)
+
+        for group in ordered:
+            size = len(group.m_packages)
+            choice = None
+            for tier in allowed[id(group)]:
+                # Stay within an even share of the packages when possible, otherwise use the full capacity
+                for limit in (target, math.inf):
+                    fitting = [index for index in tier
+                               if counts[index] + size <= min(trucks[index].m_capacity, limit)]
+                    if fitting:
+                        choice = min(fitting, key=lambda index: self._group_cost(group, medoids[index]))
+                        break
+                if choice is not None:
+                    break
+            if choice is None:
+                raise ValueError(f'Packages {[package.m_ID for package in group.m_packages]} do not fit on any '
+                                 f'allowed truck')
+            loads[choice].append(group)
+            counts[choice] += size
+        return loads
+
+    def _medoid(self, groups: List[PackageGroup]) -> int:
+        """Returns the package vertex of a cluster with the smallest total distance to the cluster's packages."""
+        vertices = [package.m_vertex for group in groups for package in group.m_packages]
+        candidates: Set[int] = set(vertices)
+        return min(sorted(candidates), key=lambda vertex: sum(self.m_distance_matrix[vertex][other]
+                                                              for other in vertices))
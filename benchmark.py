@@ -0,0 +1,271 @@
+# benchmark.py
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from HashTable import HashTable
+from Truck import Truck
+from assignment import PackageAssigner
+from delivery_service import DeliveryService
+from main import m_load_package_data
+from routing import m_plan_route
+from spatial import m_project, m_straight_line_deficit
+from synthetic import M_DEFAULT_SEED, m_default_address_count, m_generate_dataset
+from utils import DataManager
+from config import (M_TRUCK_CAPACITY, M_TRUCK_SPEED, M_HUB_ADDRESS, M_STARTING_MILEAGE, M_STARTING_TIME,
+                    M_AUTO_ASSIGNMENT, M_SPATIAL_CANDIDATES)
+
+M_DEFAULT_SIZES = (1000, 10000, 100000)
+M_DEFAULT_ROUTE_SIZES = (16, 128, 1024)  # packages on the single truck of each 'routing_one_truck' phase
+M_STATUS_QUERY_COUNT = 10000
+M_RESULTS_VERSION = 1  # bump when the layout of the results file changes
+
+
+def m_timed(phases: Dict[str, float], name: str, function: Callable, *args):
+    """Runs a function and keeps the fastest time seen for the phase.
+
+    :arg
+        phases (Dict[str, float]): The fastest time of each phase in seconds, updated in place
+        name (str): The phase
+        function (Callable): The work to time
+        args: The arguments passed to the function
+
+    :returns
+        object: The function's result"""
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    phases[name] = min(phases.get(name, elapsed), elapsed)
+    return result
+
+
+def m_build_trucks(package_hash_table: HashTable, capacity: int = M_TRUCK_CAPACITY) -> List[Truck]:
+    """Splits the packages into full trucks leaving the hub at the starting time, grouped by delivery address.
+
+    :arg
+        package_hash_table (HashTable): The loaded packages
+        capacity (int, optional): The number of packages per truck
+
+    :returns
+        List[Truck]: The trucks"""
+    items = sorted(package_hash_table.m_items(), key=lambda item: (item[1].m_vertex, item[0]))
+    package_ids = [pID for pID, _ in items]
+    return [m_build_truck(package_ids[start:start + capacity], capacity, number)
+            for number, start in enumerate(range(0, len(package_ids), capacity), 1)]
+
+
+def m_build_truck(package_ids: List[int], capacity: int, number: int = 1) -> Truck:
+    """Builds a truck leaving the hub at the starting time.
+
+    :arg
+        package_ids (List[int]): The packages on the truck
+        capacity (int): The truck's capacity
+        number (int, optional): The truck number
+
+    :returns
+        Truck: The truck"""
+    return Truck(capacity, M_TRUCK_SPEED, list(package_ids), M_STARTING_MILEAGE, M_HUB_ADDRESS,
+                 datetime.timedelta(hours=M_STARTING_TIME), None, number)
+
+
+def m_route_one_truck(package_hash_table: HashTable, data_manager: DataManager, package_ids: List[int]) -> Truck:
+    """Routes a single truck carrying the given packages, so routing can be timed against the number of stops.
+
+    :arg
+        package_hash_table (HashTable): The loaded packages
+        data_manager (DataManager): The distances and addresses
+        package_ids (List[int]): The packages on the truck
+
+    :returns
+        Truck: The routed truck"""
+    truck = m_build_truck(package_ids, len(package_ids))
+    DeliveryService([truck], package_hash_table, data_manager, address_corrections=[]).m_deliver_packages()
+    return truck
+
+
+def m_plan_large_route(data_manager: DataManager, start_vertex: int, vertices: List[int], points: dict = None,
+                       slack: float = 0.0) -> float:
+    """Plans one truck's nearest neighbor route with a full scan, or with the spatial index when 'points' is given.
+
+    :arg
+        data_manager (DataManager): The distances
+        start_vertex (int): The vertex the truck starts at
+        vertices (List[int]): The delivery vertex of every package on the truck
+        points (dict, optional): The (x, y) position in miles of the start and every stop
+        slack (float, optional): How much shorter than the straight line a road distance may be, in miles
+
+    :returns
+        float: The length of the route in miles, to check that both plans agree"""
+    matrix = data_manager.m_distance_matrix
+    stops, order = m_plan_route(start_vertex, vertices, points=points, candidate_count=M_SPATIAL_CANDIDATES,
+                                slack=slack, distance_matrix=matrix)
+    length, current = 0.0, start_vertex
+    for index in order:
+        vertex = vertices[stops[index][0]]
+        length += matrix[current][vertex]
+        current = vertex
+    return length
+
+
+def m_run_pipeline(files: tuple, phases: Dict[str, float], seed: int, route_sizes: List[int] = M_DEFAULT_ROUTE_SIZES,
+                   assignment: bool = M_AUTO_ASSIGNMENT) -> Dict[str, object]:
+    """Runs every phase of the pipeline once on a dataset, timing each phase separately.
+
+    The 'routing' phase routes the whole dataset on full trucks, so it grows with the number of trucks. Each
+    'routing_one_truck_<n>' phase routes a single truck with the first n packages, so it grows with the number of
+    stops per truck. When every address has coordinates, the largest of those trucks (at most every package) is also
+    planned with a full scan ('route_large_truck_scan') and with the spatial index ('route_large_truck_indexed'),
+    whatever M_SPATIAL_INDEX_MIN_STOPS is.
+
+    :arg
+        files (tuple): The package, distance and address files
+        phases (Dict[str, float]): The fastest time of each phase in seconds, updated in place
+        seed (int): Seeds the random status queries
+        route_sizes (List[int], optional): The package counts of the single truck routes, larger than the dataset
+            are skipped
+        assignment (bool, optional): Whether to time assigning the packages to the trucks with PackageAssigner
+
+    :returns
+        Dict[str, object]: Facts about the run that should not change between versions, e.g. the total mileage"""
+    package_file, distance_file, address_file = files
+    data_manager = m_timed(phases, 'load_distances_and_addresses', DataManager, distance_file, address_file)
+    package_hash_table = HashTable()
+    package_ids = m_timed(phases, 'load_packages', m_load_package_data, package_file, package_hash_table, data_manager)
+
+    items = list(package_hash_table.m_items())
+    missing_ids = [pID + len(package_ids) + 1 for pID in package_ids]
+
+    def insert_each():
+        table = HashTable()
+        for pID, package in items:
+            table.m_insert(pID, package)
+        return table
+
+    table = m_timed(phases, 'hash_insert', insert_each)
+    m_timed(phases, 'hash_bulk_insert', HashTable.m_from_items, items)
+    m_timed(phases, 'hash_lookup_hit', lambda: [table.m_look_up(pID) for pID in package_ids])
+    m_timed(phases, 'hash_lookup_miss', lambda: [table.m_look_up(pID) for pID in missing_ids])
+
+    trucks = m_build_trucks(package_hash_table)
+    if assignment:
+        hub_vertex = data_manager.m_extract_address(M_HUB_ADDRESS)
+        packages = [package for _, package in items]
+        matrix = data_manager.m_distance_block([hub_vertex] + [package.m_vertex for package in packages])
+        assigner = PackageAssigner(matrix, hub_vertex)
+        m_timed(phases, 'assignment', assigner.m_assign, packages, trucks)
+    delivery_service = DeliveryService(trucks, package_hash_table, data_manager, address_corrections=[])
+    m_timed(phases, 'routing', delivery_service.m_deliver_packages)
+
+    snapshot = m_timed(phases, 'status_snapshot_build', delivery_service.m_get_fleet_snapshot)
+    times = [datetime.timedelta(minutes=minutes) for minutes in range(8 * 60, 18 * 60 + 1, 120)]
+    m_timed(phases, 'status_all_packages', lambda: [sum(1 for _ in snapshot.m_iter_rows(t)) for t in times])
+    m_timed(phases, 'status_counts', lambda: [snapshot.m_counts_at(t) for t in times])
+
+    rng = random.Random(seed)
+    queries = [(package_hash_table.m_look_up(rng.choice(package_ids)),
+                datetime.timedelta(seconds=rng.randrange(8 * 3600, 18 * 3600)))
+               for _ in range(M_STATUS_QUERY_COUNT)]
+    m_timed(phases, 'status_single_package', lambda: [package.m_status_at(t) for package, t in queries])
+
+    # Last, as these re-route packages that the status phases above read
+    route_mileage = {}
+    for route_size in route_sizes:
+        if route_size <= len(package_ids):
+            truck = m_timed(phases, f'routing_one_truck_{route_size}', m_route_one_truck, package_hash_table,
+                            data_manager, package_ids[:route_size])
+            route_mileage[str(route_size)] = round(truck.m_mileage, 1)
+
+    large_route = {}
+    route_size = min(max(route_sizes, default=0), len(package_ids))
+    located = m_project(data_manager.m_coordinates)
+    hub_vertex = data_manager.m_extract_address(M_HUB_ADDRESS)
+    vertices = [package_hash_table.m_look_up(pID).m_vertex for pID in package_ids[:route_size]]
+    if vertices and all(located[vertex] for vertex in vertices + [hub_vertex]):
+        points = {vertex: located[vertex] for vertex in [hub_vertex] + vertices}
+        slack = m_straight_line_deficit(points, data_manager.m_distance_matrix)
+        scan = m_timed(phases, 'route_large_truck_scan', m_plan_large_route, data_manager, hub_vertex, vertices)
+        indexed = m_timed(phases, 'route_large_truck_indexed', m_plan_large_route, data_manager, hub_vertex, vertices,
+                          points, slack)
+        large_route = {'packages': route_size, 'stops': len(set(vertices)), 'slack': round(slack, 3),
+                       'scan_mileage': round(scan, 1), 'indexed_mileage': round(indexed, 1)}
+
+    return {
+        'packages': len(package_ids),
+        'trucks': len(trucks),
+        'total_mileage': round(delivery_service.m_get_total_mileage(), 1),
+        'completion_time': str(delivery_service.m_get_completion_time()),
+        'one_truck_mileage': route_mileage,
+        'large_route': large_route,
+    }
+
+
+def m_run_benchmarks(sizes: List[int], seed: int = M_DEFAULT_SEED, repeat: int = 1,
+                     data_directory: str = None, route_sizes: List[int] = M_DEFAULT_ROUTE_SIZES,
+                     assignment: bool = M_AUTO_ASSIGNMENT) -> dict:
+    """Generates a dataset for each size and benchmarks the pipeline on it.
+
+    :arg
+        sizes (List[int]): The package counts to benchmark
+        seed (int, optional): The random seed of the datasets and queries
+        repeat (int, optional): The number of runs per size, the fastest time of each phase is kept
+        data_directory (str, optional): Where the datasets are written, a temporary directory by default
+        route_sizes (List[int], optional): The package counts of the single truck routes
+        assignment (bool, optional): Whether to time the automatic assignment
+
+    :returns
+        dict: The results, see the module's command line help"""
+    results = []
+    with tempfile.TemporaryDirectory() as temporary:
+        for size in sizes:
+            directory = os.path.join(data_directory or temporary, f'packages_{size}')
+            files = m_generate_dataset(directory, size, seed)
+            phases: Dict[str, float] = {}
+            facts = {}
+            for _ in range(repeat):
+                facts = m_run_pipeline(files, phases, seed, route_sizes, assignment)
+            results.append({'size': size, 'addresses': m_default_address_count(size), **facts,
+                            'seconds': {name: round(seconds, 6) for name, seconds in phases.items()}})
+            print(f'{size:>7} packages: ' + ', '.join(f'{name} {seconds:.3f}s' for name, seconds in phases.items()),
+                  file=sys.stderr)
+    return {
+        'version': M_RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'route_sizes': list(route_sizes),
+        'assignment': assignment,
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmarks loading, the hash table, routing and status queries on synthetic datasets. Results '
+                    'are written as JSON with the fastest time of each phase in seconds for each size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(M_DEFAULT_SIZES), help='package counts')
+    parser.add_argument('--route-sizes', type=int, nargs='*', default=list(M_DEFAULT_ROUTE_SIZES),
+                        help='packages on the single truck of each routing_one_truck phase')
+    parser.add_argument('--assignment', action=argparse.BooleanOptionalAction, default=M_AUTO_ASSIGNMENT,
+                        help='time the automatic package assignment, defaults to M_AUTO_ASSIGNMENT')
+    parser.add_argument('--seed', type=int, default=M_DEFAULT_SEED, help='random seed')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per size, the fastest time is kept')
+    parser.add_argument('--data-dir', default=None, help='keep the generated datasets in this directory')
+    parser.add_argument('--output', default='benchmark_results.json', help='results file, "-" for stdout')
+    arguments = parser.parse_args()
+
+    report = m_run_benchmarks(arguments.sizes, arguments.seed, max(1, arguments.repeat), arguments.data_dir,
+                              arguments.route_sizes, arguments.assignment)
+    if arguments.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(arguments.output, 'w') as output:
+            json.dump(report, output, indent=2)
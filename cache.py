@@ -0,0 +1,205 @@
+# cache.py
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import pickle
+import re
+import sys
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+m_logger = logging.getLogger('delivery.cache')
+
+M_CACHE_FORMAT_VERSION = 1  # bump when the layout of the cached files or the meaning of a plan changes
+M_CHUNK_SIZE = 1 << 20
+# Names of the files this cache writes, nothing else in the directory is ever removed
+M_CACHE_FILE_PATTERN = re.compile(r'([0-9a-f]{64})\.(matrix|index\.json|coordinates\.json|plan\.pickle)')
+
+
+class InputCache:
+    """
+    An on-disk cache of the parsed inputs and the simulated plan, keyed by a content hash of the inputs.
+
+    The key is a SHA-256 over the bytes of every input file and the settings that change the result, so any change to
+    them selects a different set of files and the stale ones are removed on the next store. Four files are kept per
+    key:
+
+    - '<key>.matrix': the distance matrix as raw native doubles, row after row, loaded with mmap so rows are read
+      straight from the page cache without parsing or copying
+    - '<key>.index.json': the address index
+    - '<key>.coordinates.json': the latitude and longitude of every vertex, null where unknown
+    - '<key>.plan.pickle': the state of every truck and package after the delivery simulation
+
+    Files are written to a temporary name and renamed, so a reader never sees a partial file.
+
+    Attributes:
+        m_directory (str): The directory holding the cache files
+        m_key (str): The content hash of the inputs and settings
+    """
+
+    def __init__(self, directory: str, input_files: Iterable[str], settings: object) -> None:
+        """
+        Initializes the cache and computes its key.
+
+        :arg
+            directory (str): The directory holding the cache files, created when something is stored
+            input_files (Iterable[str]): The files the cached data is built from
+            settings (object): The settings that change the cached data, hashed through repr()
+
+        :raises
+            FileNotFoundError: If an input file is not found
+        """
+        self.m_directory = directory
+        self.m_key = self.m_compute_key(input_files, settings)
+        self._m_maps: List[mmap.mmap] = []  # kept open for as long as the matrix rows are in use
+
+    @staticmethod
+    def m_compute_key(input_files: Iterable[str], settings: object) -> str:
+        """
+        Hashes the contents of the input files and the settings.
+
+        :arg
+            input_files (Iterable[str]): The files to hash
+            settings (object): The settings to hash, through repr()
+
+        :returns
+            str: The hex digest
+        """
+        digest = hashlib.sha256(f'{M_CACHE_FORMAT_VERSION}:{sys.byteorder}'.encode())
+        for filename in input_files:
+            digest.update(os.path.basename(filename).encode() + b'\0')
+            with open(filename, 'rb') as file:
+                for chunk in iter(lambda: file.read(M_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            digest.update(b'\0')
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def _path(self, suffix: str) -> str:
+        """Returns the path of the cache file with the given suffix for the current key."""
+        return os.path.join(self.m_directory, f'{self.m_key}.{suffix}')
+
+    def _write(self, suffix: str, chunks: Iterable[bytes]) -> None:
+        """Writes a cache file atomically, then removes the files left by other keys."""
+        os.makedirs(self.m_directory, exist_ok=True)
+        path = self._path(suffix)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        os.replace(temporary, path)
+        self.m_prune()
+
+    def m_prune(self) -> None:
+        """Removes the cache files of every other key, they can never be hit again.
+
+        Only files named like the ones this class writes are removed, other files in the directory are left alone.
+        The directory is meant for one configuration, caches of other settings sharing it are pruned as well."""
+        for filename in os.listdir(self.m_directory):
+            match = M_CACHE_FILE_PATTERN.fullmatch(filename)
+            if match and match.group(1) != self.m_key:
+                os.remove(os.path.join(self.m_directory, filename))
+                m_logger.debug('Removed stale cache file %s', filename)
+
+    def m_load_distance_matrix(self) -> Optional[List[memoryview]]:
+        """
+        Maps the cached distance matrix into memory.
+
+        :returns
+            List[memoryview]: One read-only row of doubles per vertex, or None on a cache miss
+        """
+        try:
+            with open(self._path('matrix'), 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size == 0:
+                    return []
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+        count = math.isqrt(size // 8)
+        if count * count * 8 != size:
+            m_logger.warning('Ignoring corrupt cached distance matrix %s', self._path('matrix'))
+            mapped.close()
+            return None
+        values = memoryview(mapped).cast('d')
+        self._m_maps.append(mapped)
+        m_logger.info('Mapped cached %dx%d distance matrix', count, count)
+        return [values[i * count:(i + 1) * count] for i in range(count)]
+
+    def m_store_distance_matrix(self, matrix: Sequence[Sequence[float]]) -> None:
+        """
+        Stores a square distance matrix.
+
+        :arg
+            matrix (Sequence[Sequence[float]]): The rows, array('d') or memoryview rows of doubles
+        """
+        self._write('matrix', (row.tobytes() for row in matrix))
+
+    def m_load_address_index(self) -> Optional[Dict[str, int]]:
+        """
+        Loads the cached address index.
+
+        :returns
+            Dict[str, int]: The address index, or None on a cache miss
+        """
+        try:
+            with open(self._path('index.json'), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def m_store_address_index(self, index: Dict[str, int]) -> None:
+        """
+        Stores the address index.
+
+        :arg
+            index (Dict[str, int]): The address index
+        """
+        self._write('index.json', [json.dumps(index).encode()])
+
+    def m_load_coordinates(self) -> Optional[List[Optional[Tuple[float, float]]]]:
+        """
+        Loads the cached vertex coordinates.
+
+        :returns
+            List[Optional[Tuple[float, float]]]: The (latitude, longitude) of every vertex, or None on a cache miss
+        """
+        try:
+            with open(self._path('coordinates.json'), 'r') as file:
+                return [tuple(point) if point else None for point in json.load(file)]
+        except FileNotFoundError:
+            return None
+
+    def m_store_coordinates(self, coordinates: List[Optional[Tuple[float, float]]]) -> None:
+        """
+        Stores the vertex coordinates.
+
+        :arg
+            coordinates (List[Optional[Tuple[float, float]]]): The (latitude, longitude) of every vertex
+        """
+        self._write('coordinates.json', [json.dumps(coordinates).encode()])
+
+    def m_load_plan(self) -> Optional[dict]:
+        """
+        Loads the cached plan.
+
+        :returns
+            dict: The plan exported by 'DeliveryService.m_export_plan', or None on a cache miss
+        """
+        try:
+            with open(self._path('plan.pickle'), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def m_store_plan(self, plan: dict) -> None:
+        """
+        Stores a plan.
+
+        :arg
+            plan (dict): The plan exported by 'DeliveryService.m_export_plan'
+        """
+        self._write('plan.pickle', [pickle.dumps(plan, pickle.HIGHEST_PROTOCOL)])
@@ -16,6 +16,77 @@ M_STARTING_MILEAGE = 0.0
 M_STARTING_TIME = 8
 M_INITIAL_LOAD = None
 
+# Route improvement (2-opt / Or-opt) applied after the nearest neighbor pass
+M_ROUTE_IMPROVEMENT = False
+M_ROUTE_IMPROVEMENT_TIME_BUDGET = 0.5  # seconds allowed per truck
+M_ROUTE_NEIGHBOR_COUNT = 8  # nearest stops considered for each move
+
+# Automatic package assignment, replaces the "packages" lists below with clusters built from the package notes
+M_AUTO_ASSIGNMENT = False
+
+# Routing mode, 'distance' visits the nearest stop, 'deadline' also makes sure the most urgent deadline stays reachable
+M_ROUTING_MODE = 'distance'
+
+# Spatial index, trucks with at least this many stops pick their next stop from the stops nearest in a straight line,
+# when the address file gives the latitude and longitude of every stop
+M_SPATIAL_INDEX_MIN_STOPS = 256  # below this a full scan of the stops is faster
+M_SPATIAL_CANDIDATES = 8  # least number of stops checked against the distance matrix at each step
+
+# Parallel routing, trucks that do not depend on each other are routed in a process pool
+M_PARALLEL_ROUTING = False
+M_ROUTING_WORKERS = None  # defaults to the number of CPUs
+
+# Input cache, keeps the distance matrix, address index and simulated plan on disk keyed by a hash of the inputs
+M_INPUT_CACHE = False
+M_CACHE_DIRECTORY = '.cache'
+
+# Shortest path closure, treats the distance file as a road graph: missing distances are filled with the shortest path
+# and direct distances longer than a path through other addresses are shortened before routing
+M_SHORTEST_PATHS = False
+
+# Distance cache, the number of vertex pairs kept by a CachedDistanceProvider in front of a slow distance source
+M_DISTANCE_CACHE_SIZE = 100000
+
+# Instrumentation, phase timers, call counts, hash probe lengths and peak memory, also turned on with --profile or the
+# DELIVERY_PROFILE environment variable
+M_PROFILE = False
+M_PROFILE_REPORT = None  # path of the JSON report, None to only print the summary
+# Traces peak memory as well, also turned on with --profile-memory. Tracing slows every allocation down, so phase
+# timings and call times taken in the same run are inflated
+M_PROFILE_MEMORY = False
+
+# Status query server (server.py), only listens locally by default
+M_SERVER_HOST = '127.0.0.1'
+M_SERVER_PORT = 8080
+
+# Address corrections received during the day, applied as events by the delivery simulation
+M_ADDRESS_CORRECTIONS = [
+    {
+        "package_id": 9,
+        "time": datetime.timedelta(hours=10, minutes=20),
+        "address": "410 S State St",
+        "city": "Salt Lake City",
+        "state": "UT",
+        "zip": "84111"
+    }
+]
+
+# Log level of each subsystem, can be overridden with the DELIVERY_LOG_LEVELS environment variable
+M_LOG_LEVELS = {
+    'delivery': 'WARNING',
+    'delivery.main': 'WARNING',
+    'delivery.data': 'WARNING',
+    'delivery.package': 'WARNING',
+    'delivery.assignment': 'WARNING',
+    'delivery.service': 'WARNING',
+    'delivery.simulation': 'WARNING',
+    'delivery.snapshot': 'WARNING',
+    'delivery.server': 'WARNING',
+    'delivery.cache': 'WARNING',
+    'delivery.distance': 'WARNING',
+    'delivery.instrumentation': 'WARNING',
+}
+
 # File paths
 M_PACKAGE_FILE = 'CSV/Package_File.csv'
 M_DISTANCE_FILE = 'CSV/Distance_File.csv'
@@ -36,7 +107,7 @@ M_TRUCK_CONFIGS = [
     {
         "capacity": M_TRUCK_CAPACITY,
         "speed": M_TRUCK_SPEED,
-        "packages": [3, 6, 12, 17, 18, 19, 21, 22, 23, 24, 26, 27, 35, 36, 38, 39],
+        "packages": [3, 12, 17, 18, 19, 21, 22, 23, 24, 26, 27, 35, 36, 38, 39],
         "mileage": M_STARTING_MILEAGE,
         "address": M_HUB_ADDRESS,
         "depart_time": datetime.timedelta(hours=M_STARTING_TIME),
@@ -51,6 +122,7 @@ M_TRUCK_CONFIGS = [
         "address": M_HUB_ADDRESS,
         "depart_time": datetime.timedelta(hours=M_STARTING_TIME),
         "load": M_INITIAL_LOAD,
-        "truck_number": 3
+        "truck_number": 3,
+        "depends_on": [1, 2]  # only 2 drivers, so truck 3 leaves once truck 1 or 2 returns
     }
 ]
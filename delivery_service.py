@@ -2,17 +2,33 @@
 
 import datetime
 import logging
-from typing import List, Tuple
+import math
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 from HashTable import HashTable
 from Package import Package
 from Truck import Truck
 from utils import DataManager
-from config import M_HUB_ADDRESS
+from snapshot import FleetSnapshot
+from assignment import m_parse_available_time
+from simulation import (EventScheduler, M_PRIORITY_PACKAGE_ARRIVAL, M_PRIORITY_ADDRESS_CORRECTION,
+                        M_PRIORITY_TRUCK_DEPARTURE, M_PRIORITY_TRUCK_RETURN)
+from routing import RouteImprover, m_plan_route, m_share_distance_matrix
+from spatial import m_project, m_straight_line_deficit
+from config import (M_HUB_ADDRESS, M_ROUTE_IMPROVEMENT, M_ROUTE_IMPROVEMENT_TIME_BUDGET, M_ROUTE_NEIGHBOR_COUNT,
+                    M_PARALLEL_ROUTING, M_ROUTING_WORKERS, M_ROUTING_MODE, M_ADDRESS_CORRECTIONS,
+                    M_SPATIAL_INDEX_MIN_STOPS, M_SPATIAL_CANDIDATES)
+
+m_logger = logging.getLogger('delivery.service')
 
 
 class DeliveryService:
-    def __init__(self, trucks: List[Truck], package_hash_table: HashTable, data_manager: DataManager) -> None:
+    def __init__(self, trucks: List[Truck], package_hash_table: HashTable, data_manager: DataManager,
+                 address_corrections: List[dict] = None) -> None:
         """
         Initializes the DeliveryService object.
 
@@ -20,6 +36,8 @@ class DeliveryService:
             trucks (List[Truck]): A list of truck objects representing the delivery vehicles
             package_hash_table (HashTable): A HashTable used for efficient lookup by ID
             data_manager (DataManager): A DataManager object is used for loading and distance calculations
+            address_corrections (List[dict], optional): The address corrections to schedule, as keyword arguments of
+                'm_schedule_address_correction', defaults to M_ADDRESS_CORRECTIONS
 
         :raises
             :TypeError
@@ -31,181 +49,679 @@ class DeliveryService:
         self.m_trucks = trucks
         self.m_package_hash_table = package_hash_table
         self.m_data_manager = data_manager
+        self.m_hub_vertex = data_manager.m_extract_address(M_HUB_ADDRESS)
+        self.m_points = m_project(data_manager.m_coordinates)  # planar position of every vertex, for routing
+        self._m_spatial_slack: Optional[float] = None
+        self.m_mileage_saved = 0.0  # mileage removed by the route improvement stage
+        self.m_address_corrections = []  # (package ID, time, address, city, state, zip) applied during delivery
+        self.m_scheduler: Optional[EventScheduler] = None
+        self._m_executor: Optional[ProcessPoolExecutor] = None
+        self._m_timelines_built = False
+        self._m_snapshot: Optional[FleetSnapshot] = None
+        self._m_returns: Dict[int, datetime.timedelta] = {}  # truck number -> time of its pending return event
+        self._m_released: Dict[int, Tuple[int, datetime.timedelta]] = {}  # truck number -> (truck it freed, time)
+
+        for correction in M_ADDRESS_CORRECTIONS if address_corrections is None else address_corrections:
+            self.m_schedule_address_correction(**correction)
+
+        # Resolve each truck's starting address once so routing only works with vertex IDs
+        for truck in self.m_trucks:
+            if truck.m_vertex is None:
+                truck.m_vertex = data_manager.m_extract_address(truck.m_address)
+
+    def _get_package_vertex(self, package: Package) -> int:
+        """Returns the cached vertex ID of a package, resolving and caching it if it has not been set.
+
+        :arg
+            package (Package): The package whose delivery address vertex is needed
 
-    def update_package_9_address(self, current_time: datetime.timedelta) -> None:
-        """Updates the address of package 9 if the current time is after the update time.
+        :returns
+            int: The vertex ID of the package's delivery address"""
+        if package.m_vertex is None:
+            package.m_vertex = self.m_data_manager.m_extract_address(package.m_address)
+        return package.m_vertex
 
-        This method checks if the current time has reached or passed the time when package 9's
-        address should be updated. If so, it updates the package's address, city, state, and zip code.
-        It also resets the package status to "At Hub" for redelivery.
+    def m_schedule_address_correction(self, package_id: int, time: datetime.timedelta, address: str, city: str,
+                                      state: str, zip: str) -> None:
+        """Schedules a correction of a package's delivery address.
+
+        Corrections are applied as events during 'm_deliver_packages' through 'm_change_address'.
 
         :arg
-            current_time (datetime.timedelta): The current time in the simulation
-        """
-        package_9: Package = self.m_package_hash_table.m_look_up(9)
-        package_9.update_address("410 S State St", "Salt Lake City", "UT", "84111", current_time)
-        package_9.m_status = "At Hub"  # Reset status for redelivery
-        logging.info(f'Updated address at package #9 at {current_time}')
+            package_id (int): The ID of the package being corrected
+            time (datetime.timedelta): The time the correction becomes known
+            address (str): The corrected street address
+            city (str): The corrected city
+            state (str): The corrected state
+            zip (str): The corrected zip code"""
+        self.m_address_corrections.append((package_id, time, address, city, state, zip))
+
+    def m_change_address(self, package_id: int, time: datetime.timedelta, address: str, city: str, state: str,
+                         zip: str) -> None:
+        """Changes a package's delivery address at the given time and re-routes only what is affected.
+
+        - If the package's truck has not departed, only the address is changed, and the package is routed to it.
+        - If the truck is still on its way to the package, the truck keeps every delivery made before 'time' and the
+          leg it is currently driving, then the rest of its stops are planned again from that stop and clock.
+        - If the package was already delivered (or is on the leg being driven), the truck finishes its route, returns
+          to the hub to pick the package up and delivers it to the corrected address.
+
+        Other trucks are never re-routed. When the truck's return time changes during the simulation its return event
+        is moved, so trucks waiting on its driver leave at the new time. If a truck already left with its driver, it
+        cannot be moved back, and the conflict is logged as a warning.
 
-    def _handle_package_9_update(self):
-        """
-        Handles the update and redelivery process for package 9.
+        :arg
+            package_id (int): The ID of the package being corrected
+            time (datetime.timedelta): The time of the correction
+            address (str): The corrected street address
+            city (str): The corrected city
+            state (str): The corrected state
+            zip (str): The corrected zip code
 
-        This private method manages the special case of package 9, which requires an address update
-        and redelivery. It updates the package's address at a specific time, adjusts the truck's time
-        if necessary, and initiates the redelivery process.
-        """
-        package_9: Package = self.m_package_hash_table.m_look_up(9)
-        update_time = datetime.timedelta(hours=10, minutes=20)
+        :raises
+            KeyError: If the package is not in the hash table
+            ValueError: If the corrected address is not found"""
+        package: Package = self.m_package_hash_table.m_look_up(package_id)
+        if package is None:
+            m_logger.error('Cannot correct the address of unknown package %s', package_id)
+            raise KeyError(f'Package {package_id} not found')
+        new_vertex = self.m_data_manager.m_extract_address(address)
+
+        truck = next((truck for truck in self.m_trucks if truck.m_truck_number == package.m_truck), None)
+        if truck is None or package.m_delivery_time is None:
+            package.update_address(address, city, state, zip, time, new_vertex)
+            m_logger.info('Updated address at package #%s at %s before departure', package_id, time)
+            self._refresh_timelines(truck, package)
+            return
+
+        pending = self._rewind_truck(truck, time)
+        if package in pending:
+            if truck.m_departure_time <= time:  # keep that it was on the truck before the correction
+                package.m_original_departure_time = truck.m_departure_time
+            package.update_address(address, city, state, zip, time, new_vertex)
+            m_logger.info('Updated address at package #%s at %s, re-routing truck %s', package_id, time,
+                          truck.m_truck_number)
+            self._reroute_remaining(truck, pending)
+            self._on_return_changed(truck)
+            self._refresh_timelines(truck, package)
+            return
+
+        if pending:
+            self._reroute_remaining(truck, pending)  # the rewind only dropped stops after the current leg
+
+        # Keep what happened before the correction for status queries at earlier times
+        package.m_original_delivery_time = package.m_delivery_time
+        package.m_original_departure_time = truck.m_departure_time
+        package.update_address(address, city, state, zip, time, new_vertex)
+        package.m_status = "At Hub"  # Reset status for redelivery
+        m_logger.info('Updated address at package #%s at %s', package_id, time)
+
+        if truck.m_time < time:
+            truck.m_time = time
+        self._redeliver_package(truck, package)
+        self._on_return_changed(truck)
+        self._refresh_timelines(truck, package)
+
+    def _rewind_truck(self, truck: Truck, time: datetime.timedelta) -> List[Package]:
+        """Rolls a truck back to the stop it is driving to at the given time.
+
+        Every stop reached before 'time', and the stop the truck is driving to at 'time', is kept. The truck's
+        mileage, clock and location are restored to the last kept stop, and the packages of the dropped stops are
+        returned in the order they were planned.
+
+        :arg
+            truck (Truck): The truck to roll back
+            time (datetime.timedelta): The time of the change
 
-        if self.m_trucks[2].m_time < update_time:
-            self.m_trucks[2].m_time = update_time
+        :returns
+            List[Package]: The packages that still need to be delivered"""
+        itinerary = truck.m_itinerary
+        if not itinerary:
+            return []
+
+        keep = len(itinerary)
+        if time < truck.m_departure_time:
+            keep = 1  # only the starting point, the truck has not left yet
+        else:
+            for index in range(1, len(itinerary)):
+                if itinerary[index][0] > time:
+                    keep = index + 1  # finish the leg being driven
+                    break
+
+        dropped = itinerary[keep:]
+        del itinerary[keep:]
+        truck.m_time, truck.m_mileage, truck.m_vertex, truck.m_address, _, _ = itinerary[-1]
+
+        pending: List[Package] = []
+        for _, _, _, _, package_ids, is_stop in dropped:
+            for pID in package_ids:
+                package: Package = self.m_package_hash_table.m_look_up(pID)
+                if package not in pending:
+                    pending.append(package)
+                if is_stop:
+                    truck.m_packages.remove(pID)
+        for package in pending:
+            package.m_delivery_time = None
+        return pending
+
+    def _reroute_remaining(self, truck: Truck, packages: List[Package]) -> None:
+        """Plans and drives the remaining stops of a truck from its current location and clock.
+
+        :arg
+            truck (Truck): The truck to re-route
+            packages (List[Package]): The packages left to deliver"""
+        for package in packages:
+            self._get_package_vertex(package)
+
+        matrix = self._get_distance_matrix(truck, packages)
+        stops, order = m_plan_route(*self._get_route_arguments(truck, packages), distance_matrix=matrix)
+        last_delivery_time = truck.m_itinerary[-1][0] if len(truck.m_itinerary) > 1 else truck.m_departure_time
+        self._apply_route(truck, packages, stops, order, matrix, last_delivery_time)
 
-        self.update_package_9_address(update_time)
-        self._redeliver_package_9()
+    def _on_address_correction(self, package_id: int, time: datetime.timedelta, address: str, city: str, state: str,
+                               zip: str) -> None:
+        """Applies an address correction event.
+
+        :arg
+            package_id (int): The ID of the package being corrected
+            time (datetime.timedelta): The time of the correction
+            address (str): The corrected street address
+            city (str): The corrected city
+            state (str): The corrected state
+            zip (str): The corrected zip code"""
+        try:
+            self.m_change_address(package_id, time, address, city, state, zip)
+        except (KeyError, ValueError) as e:
+            m_logger.error('Could not apply address correction for package %s: %s', package_id, e)
 
-    def _redeliver_package_9(self):
+    def _redeliver_package(self, truck: Truck, package: Package) -> None:
         """
-        Manages the redelivery process for package 9 after its address update.
+        Manages the redelivery process for a package after its address update.
 
-        This method simulates the process of the truck returning to the hub, picking up package 9 from the incorrect
+        This method simulates the process of the truck returning to the hub, picking up the package from the incorrect
         address, then drops it off to the updated address. It updates the truck's (status, time, mileage, current
         address) and the package's information (departure time, delivery time, and status) respectively.
-        """
-        package_9: Package = self.m_package_hash_table.m_look_up(9)  # look up hashitem
-        truck = self.m_trucks[2]  # reuse truck 3
 
+        :arg
+            truck (Truck): The truck that carried the package
+            package (Package): The package with its corrected address
+        """
         # Calculate time to return to hub
-        distance_to_hub = self.m_data_manager.m_calculate_distance(truck.m_address, M_HUB_ADDRESS)
+        distance_to_hub = self.m_data_manager.m_distance_between(truck.m_vertex, self.m_hub_vertex)
         time_to_hub = datetime.timedelta(hours=distance_to_hub / truck.m_speed)
 
         # Update truck status
         truck.m_time += time_to_hub
         truck.m_mileage += distance_to_hub
         truck.m_address = M_HUB_ADDRESS
+        truck.m_vertex = self.m_hub_vertex
+        truck.m_itinerary.append((truck.m_time, truck.m_mileage, truck.m_vertex, truck.m_address, [package.m_ID],
+                                  False))
 
-        # Redeliver package 9
-        distance_to_new_address = self.m_data_manager.m_calculate_distance(truck.m_address, package_9.m_address)
+        # Redeliver package
+        distance_to_new_address = self.m_data_manager.m_distance_between(truck.m_vertex,
+                                                                         self._get_package_vertex(package))
         time_to_new_address = datetime.timedelta(hours=distance_to_new_address / truck.m_speed)
 
         # Update truck and package status
         truck.m_time += time_to_new_address
         truck.m_mileage += distance_to_new_address
-        truck.m_address = package_9.m_address
-        package_9.m_departure_time = truck.m_time - time_to_new_address
-        package_9.m_delivery_time = truck.m_time
-        package_9.m_status = "Delivered"
+        truck.m_address = package.m_address
+        truck.m_vertex = package.m_vertex
+        package.m_departure_time = truck.m_time - time_to_new_address
+        package.m_delivery_time = truck.m_time
+        package.m_status = "Delivered"
+        truck.m_itinerary.append((truck.m_time, truck.m_mileage, truck.m_vertex, truck.m_address, [package.m_ID],
+                                  False))
 
-        logging.info(f'Redelivered package 9 to correct address at {truck.m_time}')
+        m_logger.info('Redelivered package %s to correct address at %s', package.m_ID, truck.m_time)
 
-    def m_deliver_packages(self) -> None:
+    def m_deliver_packages(self, parallel: bool = M_PARALLEL_ROUTING) -> None:
         """
         Delivers all pending packages using the Nearest Neighbor Algorithm for each truck.
-        This function iterates through the list of trucks calling the "_deliver_packages_for_truck() method' for each
-        truck, keeping in mind that there are only 2 drives and 3 trucks, and optimizes a solution for that predicament.
+        This function runs a discrete-event simulation of the day. Trucks without dependencies depart at their
+        departure time, and a truck with dependencies ('m_depends_on') departs when the first truck it depends on
+        returns, keeping in mind that there are only 2 drivers and 3 trucks. Delayed packages arriving at the hub and
+        address corrections are events as well. Trucks departing at the same time are routed together, and in parallel
+        mode they are routed at the same time in a process pool. Results are always applied in truck order, so both
+        modes produce the same plan.
+
+        :arg
+            parallel (bool, optional): Route trucks that depart at the same time in a process pool
 
         :raises
             IndexError:
                 - If the list of trucks is empty
+            ValueError:
+                - If the truck dependencies refer to an unknown truck or form a cycle
         """
-        logging.info(f'Starting delivery for all trucks')
+        m_logger.info('Starting delivery for all trucks')
 
         if not self.m_trucks:
-            logging.error('No trucks found for delivery. Please ensure trucks are available.')
+            m_logger.error('No trucks found for delivery. Please ensure trucks are available.')
             raise IndexError('No trucks available for delivery')
 
-        self._deliver_packages_for_truck(self.m_trucks[0])
-        self._deliver_packages_for_truck(self.m_trucks[1])
+        numbers = {truck.m_truck_number for truck in self.m_trucks}
+        for truck in self.m_trucks:
+            unknown = set(truck.m_depends_on) - numbers
+            if unknown:
+                raise ValueError(f'Truck {truck.m_truck_number} depends on unknown trucks {sorted(unknown)}')
+
+        self.m_scheduler = EventScheduler(min(truck.m_departure_time for truck in self.m_trucks))
+        self._m_parallel = parallel
+        self._m_departures = {}
+        self._m_departed = set()
+        self._m_arrived = set()
+        self._m_returns = {}
+        self._m_released = {}
+
+        for truck in self.m_trucks:
+            for pID in truck.m_packages:
+                package: Package = self.m_package_hash_table.m_look_up(pID)
+                available_time = m_parse_available_time(package.m_notes) if package else None
+                if available_time is not None:
+                    self.m_scheduler.m_schedule(available_time, M_PRIORITY_PACKAGE_ARRIVAL, self._on_package_arrival,
+                                                package)
+            if not truck.m_depends_on:
+                self._schedule_departure(truck, truck.m_departure_time)
+        for correction in self.m_address_corrections:
+            self.m_scheduler.m_schedule(correction[1], M_PRIORITY_ADDRESS_CORRECTION, self._on_address_correction,
+                                        *correction)
 
-        # Set the departure time for the 3rd truck
-        self.m_trucks[2].m_departure_time = min(self.m_trucks[0].m_time, self.m_trucks[1].m_time)
-        self._deliver_packages_for_truck(self.m_trucks[2])  # deliver packages for 3rd truck
-        self._handle_package_9_update()
+        try:
+            self.m_scheduler.m_run()
+        finally:
+            if self._m_executor is not None:
+                self._m_executor.shutdown()
+                self._m_executor = None
+                m_share_distance_matrix(None)
 
-        logging.info(f'Completed delivery for all trucks')
+        if len(self._m_departed) < len(self.m_trucks):
+            raise ValueError('Truck dependencies form a cycle')
+
+        self.m_build_status_timelines()
+        m_logger.info('Completed delivery for all trucks')
+
+    def m_export_plan(self) -> dict:
+        """Captures the state of every truck and package after the delivery simulation, so it can be cached.
+
+        :returns
+            dict: The plan, restored with 'm_import_plan'"""
+        skipped = ('m_timeline', 'm_timeline_times')  # rebuilt from the other fields
+        return {
+            'trucks': {truck.m_truck_number: dict(vars(truck)) for truck in self.m_trucks},
+            'packages': {pID: {name: value for name, value in vars(package).items() if name not in skipped}
+                         for pID, package in self.m_package_hash_table.m_items()},
+            'mileage_saved': self.m_mileage_saved,
+            'released': dict(self._m_released),
+        }
+
+    def m_import_plan(self, plan: dict) -> bool:
+        """Restores a plan captured by 'm_export_plan' instead of running the delivery simulation.
+
+        :arg
+            plan (dict): The plan
+
+        :returns
+            bool: False, leaving everything unchanged, if the plan does not cover exactly these trucks and packages"""
+        if (set(plan['trucks']) != {truck.m_truck_number for truck in self.m_trucks} or
+                set(plan['packages']) != set(self.m_package_hash_table.m_keys())):
+            m_logger.warning('Ignoring a cached plan made for different trucks or packages')
+            return False
+        for truck in self.m_trucks:
+            vars(truck).update(plan['trucks'][truck.m_truck_number])
+        for pID, package in self.m_package_hash_table.m_items():
+            vars(package).update(plan['packages'][pID])
+        self.m_mileage_saved = plan['mileage_saved']
+        self._m_released = dict(plan.get('released', {}))
+        self.m_build_status_timelines()
+        return True
+
+    def m_build_status_timelines(self) -> None:
+        """Precomputes the status timeline of every package once the delivery times are final, so status queries at
+        any time are answered without updating the packages."""
+        for _, package in self.m_package_hash_table.m_items():
+            package.m_build_timeline()
+        self._m_timelines_built = True
+        self._m_snapshot = None
+
+    def m_get_fleet_snapshot(self) -> FleetSnapshot:
+        """Returns the index answering status queries for all packages at once, built on first use.
+
+        :returns
+            FleetSnapshot: The index over every package's status timeline
+
+        :raises
+            ValueError: If the packages have not been delivered yet"""
+        if not self._m_timelines_built:
+            raise ValueError('Packages have not been delivered yet')
+        if self._m_snapshot is None:
+            self._m_snapshot = FleetSnapshot(package for _, package in self.m_package_hash_table.m_items())
+        return self._m_snapshot
+
+    def _refresh_timelines(self, truck: Optional[Truck], package: Package) -> None:
+        """Rebuilds the timelines changed by an address correction made after the simulation has finished."""
+        if not self._m_timelines_built:
+            return
+        self._m_snapshot = None
+        package.m_build_timeline()
+        if truck is not None:
+            for pID in truck.m_packages:
+                self.m_package_hash_table.m_look_up(pID).m_build_timeline()
+
+    def _schedule_departure(self, truck: Truck, time: datetime.timedelta) -> None:
+        """Schedules a truck to depart, grouping it with the other trucks departing at the same time.
+
+        :arg
+            truck (Truck): The truck departing
+            time (datetime.timedelta): The departure time"""
+        if time not in self._m_departures:
+            self._m_departures[time] = []
+            self.m_scheduler.m_schedule(time, M_PRIORITY_TRUCK_DEPARTURE, self._on_departures, time)
+        self._m_departures[time].append(truck)
+        self._m_departed.add(truck.m_truck_number)
+
+    def _on_package_arrival(self, package: Package) -> None:
+        """Records that a delayed package has arrived at the hub.
+
+        :arg
+            package (Package): The package that arrived"""
+        self._m_arrived.add(package.m_ID)
+        m_logger.info('Package %s arrived at the hub at %s', package.m_ID, self.m_scheduler.m_now)
+
+    def _on_departures(self, time: datetime.timedelta) -> None:
+        """Routes every truck departing at the given time and schedules their returns.
+
+        :arg
+            time (datetime.timedelta): The departure time"""
+        wave = sorted(self._m_departures.pop(time), key=self.m_trucks.index)
+        for truck in wave:
+            truck.m_time = max(truck.m_time, time)  # a truck waiting on a driver leaves when the driver is back
+            for pID in truck.m_packages:
+                package: Package = self.m_package_hash_table.m_look_up(pID)
+                available_time = m_parse_available_time(package.m_notes) if package else None
+                if available_time is not None and pID not in self._m_arrived:
+                    m_logger.warning('Truck %s departs at %s before package %s arrives at %s', truck.m_truck_number,
+                                     time, pID, available_time)
+
+        self._route_wave(wave, self._get_executor(len(wave)))
+        for truck in wave:
+            self._schedule_return(truck)
+
+    def _schedule_return(self, truck: Truck) -> None:
+        """Schedules a truck's return at the end of its route, replacing the return scheduled before.
+
+        :arg
+            truck (Truck): The truck on its route"""
+        self._m_returns[truck.m_truck_number] = truck.m_time
+        self.m_scheduler.m_schedule(truck.m_time, M_PRIORITY_TRUCK_RETURN, self._on_truck_return, truck, truck.m_time)
+
+    def _on_return_changed(self, truck: Truck) -> None:
+        """Moves a truck's return event after an address correction changed its route.
+
+        A truck whose return was already processed may have freed its driver for a waiting truck, which has left
+        since. That truck cannot be moved, so a return later than its departure is logged instead.
+
+        :arg
+            truck (Truck): The truck whose route changed"""
+        scheduled = self._m_returns.get(truck.m_truck_number)
+        if scheduled is not None and scheduled != truck.m_time:
+            self._schedule_return(truck)  # the old event is skipped by '_on_truck_return'
+        released = self._m_released.get(truck.m_truck_number)
+        if released is not None and truck.m_time > released[1]:
+            m_logger.warning('Truck %s now returns at %s, but truck %s already left with its driver at %s',
+                             truck.m_truck_number, truck.m_time, *released)
+
+    def _on_truck_return(self, truck: Truck, time: datetime.timedelta) -> None:
+        """Frees the driver of a truck, so the trucks waiting on it can depart.
+
+        :arg
+            truck (Truck): The truck that finished its route
+            time (datetime.timedelta): The return time the event was scheduled for"""
+        if self._m_returns.get(truck.m_truck_number) != time:
+            return  # replaced by a later '_schedule_return'
+        del self._m_returns[truck.m_truck_number]
+        time = self.m_scheduler.m_now
+        for waiting in self.m_trucks:
+            if truck.m_truck_number in waiting.m_depends_on and waiting.m_truck_number not in self._m_departed:
+                # A driver is free once the first of the trucks it depends on has returned
+                waiting.m_departure_time = time
+                self._schedule_departure(waiting, time)
+                self._m_released[truck.m_truck_number] = (waiting.m_truck_number, time)
+
+    def _get_executor(self, wave_size: int) -> Optional[ProcessPoolExecutor]:
+        """Returns the process pool for a wave of trucks, creating it the first time it is needed.
+
+        :arg
+            wave_size (int): The number of trucks departing together
+
+        :returns
+            ProcessPoolExecutor: The process pool, or None when the wave is routed in this process"""
+        if not self._m_parallel or wave_size < 2:
+            return None
+        if self._m_executor is None:
+            m_share_distance_matrix(self.m_data_manager.m_distance_provider.m_as_matrix())
+            self._m_executor = self._create_process_pool(len(self.m_trucks))
+        return self._m_executor
+
+    def _create_process_pool(self, max_workers: int) -> ProcessPoolExecutor:
+        """Creates the process pool used by the parallel mode.
+
+        Where fork is available the workers inherit the shared distance matrix, otherwise it is sent to each worker
+        once through the pool initializer instead of with every task. Rows mapped from the input cache cannot be
+        pickled, so they are sent as arrays. A distance provider without a matrix shares nothing, each task carries
+        its truck's block instead.
+
+        :arg
+            max_workers (int): The largest number of trucks routed at the same time
+
+        :returns
+            ProcessPoolExecutor: The process pool"""
+        workers = min(max_workers, M_ROUTING_WORKERS or os.cpu_count() or 1)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        matrix = self.m_data_manager.m_distance_provider.m_as_matrix()
+        return ProcessPoolExecutor(workers, initializer=m_share_distance_matrix,
+                                   initargs=(None if matrix is None else [array('d', row) for row in matrix],))
+
+    def _route_wave(self, wave: List[Truck], executor: Optional[ProcessPoolExecutor]) -> None:
+        """Routes a wave of independent trucks and applies the routes in truck order.
+
+        :arg
+            wave (List[Truck]): The trucks to route
+            executor (ProcessPoolExecutor): The pool to plan the routes in, or None to plan them in this process"""
+        if executor is None:
+            for truck in wave:
+                self._deliver_packages_for_truck(truck)
+            return
+
+        prepared = []
+        for truck in wave:
+            packages = self._prepare_truck(truck)
+            prepared.append((truck, packages, self._get_distance_matrix(truck, packages)))
+        shared = self.m_data_manager.m_distance_provider.m_as_matrix()
+        # The shared matrix is already in the workers, a block fetched from another provider is sent with the task
+        futures = [executor.submit(m_plan_route, *self._get_route_arguments(truck, packages),
+                                   distance_matrix=None if matrix is shared else matrix)
+                   for truck, packages, matrix in prepared]
+        for (truck, packages, matrix), future in zip(prepared, futures):
+            stops, order = future.result()
+            self._apply_route(truck, packages, stops, order, matrix)
+
+    def _prepare_truck(self, truck: Truck) -> List[Package]:
+        """Loads the packages of a truck from the hash table and clears its package list for routing.
+
+        :arg
+            truck (Truck): The truck object with packages to be delivered
+
+        :returns
+            List[Package]: The packages on the truck in load order"""
+        m_logger.info('Starting delivery for the truck')
+        m_pending_packages: List[Package] = [self.m_package_hash_table.m_look_up(pID) for pID in truck.m_packages]
+        # Assign truck number in list
+        for pID in m_pending_packages:
+            pID.m_truck = truck.m_truck_number
+            self._get_package_vertex(pID)
+        truck.m_packages.clear()  # We want to insert packages according to the most efficient path so clear it
+        return m_pending_packages
+
+    def _get_distance_matrix(self, truck: Truck, packages: List[Package]):
+        """Returns the distances a truck is routed with.
+
+        This is 'DataManager.m_distance_block' over the truck's location and its stops, so without a full matrix the
+        routing loop only reads a local block and never calls the provider.
+
+        :arg
+            truck (Truck): The truck being routed
+            packages (List[Package]): The packages on the truck, with their vertices resolved
+
+        :returns
+            The distance matrix, or a block indexed the same way by the truck's vertices"""
+        return self.m_data_manager.m_distance_block([truck.m_vertex] + [package.m_vertex for package in packages])
+
+    def _get_route_arguments(self, truck: Truck, packages: List[Package]) -> tuple:
+        """Builds the arguments of 'm_plan_route' for a truck.
+
+        Each package with a deadline is limited to the distance the truck can cover from its start before that
+        deadline. The deadline routing mode uses these limits to pick stops, and the improvement stage uses them so it
+        cannot make a package late that was on time. Trucks with at least M_SPATIAL_INDEX_MIN_STOPS stops that all
+        have coordinates get their positions, so the router picks stops with a spatial index, and the slack from
+        '_get_spatial_slack' that keeps its picks the same as a full scan.
+
+        :arg
+            truck (Truck): The truck being routed
+            packages (List[Package]): The packages on the truck in load order
+
+        :returns
+            tuple: The positional arguments for 'm_plan_route', without the distance matrix"""
+        limits = []
+        for package in packages:
+            deadline = package.m_deadline_time
+            limits.append((deadline - truck.m_time).total_seconds() / 3600 * truck.m_speed if deadline is not None
+                          else math.inf)
+        vertices = [package.m_vertex for package in packages]
+        points = {vertex: self.m_points[vertex] for vertex in [truck.m_vertex] + vertices if self.m_points[vertex]}
+        slack = 0.0
+        if len(set(vertices)) < M_SPATIAL_INDEX_MIN_STOPS or not all(vertex in points for vertex in vertices):
+            points = None
+        else:
+            slack = self._get_spatial_slack(points)
+        return (truck.m_vertex, vertices, limits, M_ROUTE_IMPROVEMENT, M_ROUTE_NEIGHBOR_COUNT,
+                M_ROUTE_IMPROVEMENT_TIME_BUDGET, M_ROUTING_MODE, points, M_SPATIAL_CANDIDATES, slack)
+
+    def _get_spatial_slack(self, points: dict) -> float:
+        """Returns how much shorter than the straight line a road between the given vertices can be.
+
+        With a full distance matrix it is measured once over every located vertex and kept. Otherwise it is measured
+        over the truck's own vertices, from the block '_get_distance_matrix' fetches next anyway.
+
+        :arg
+            points (dict): The (x, y) position in miles of the truck's vertices
+
+        :returns
+            float: The slack in miles"""
+        provider = self.m_data_manager.m_distance_provider
+        matrix = provider.m_as_matrix()
+        if matrix is None:
+            return m_straight_line_deficit(points, provider.m_block(points))
+        if self._m_spatial_slack is None:
+            located = {vertex: point for vertex, point in enumerate(self.m_points) if point}
+            self._m_spatial_slack = m_straight_line_deficit(located, matrix)
+            if self._m_spatial_slack:
+                m_logger.info('Road distances are up to %.3f miles shorter than the straight line',
+                              self._m_spatial_slack)
+        return self._m_spatial_slack
 
     def _deliver_packages_for_truck(self, truck: Truck) -> None:
         """Delivers all pending packages using the Nearest Neighbor Algorithm.
 
-        This function uses an iterative approach to find the nearest undelivered package with respect to the truck's
-        current location. In addition, it will update the truck's status such as its mileage, address, delivery and
-         departure times, along with the package's deliver information. Then the packages are delivered optimizing the
-         truck's delivery route.
+        This function uses 'm_plan_route' to visit the nearest undelivered stop with respect to the truck's current
+        location, delivering packages that share a stop together, then optionally improves the order with 2-opt and
+        Or-opt moves. In addition, it will update the truck's status such as its mileage, address, delivery and
+        departure times, along with the package's deliver information.
 
          :arg
             truck (Truck): The truck object with packages to be delivered
 
-        :raises
-            ValueError: If there are no pending packages in the truck.
-
         Algorithm:
-            1. Create a list of pending packages from the truck's package IDs.
+            1. Create a list of pending packages from the truck's package IDs and group them by stop.
             2. Clear the truck's current package list.
-            3. While there are pending packages.
-                a. Find the nearest undelivered package
-                b. Add the package to the truck's delivery list
+            3. While there are pending stops.
+                a. Find the nearest unvisited stop
+                b. Add the stop's packages to the truck's delivery list
                 c. Update the truck's mileage, address and time
                 d. Update package's delivery and departure time.
 
         Note: This function assumes the global m_package_hash_table is available
             """
+        packages = self._prepare_truck(truck)
+        matrix = self._get_distance_matrix(truck, packages)
+        stops, order = m_plan_route(*self._get_route_arguments(truck, packages), distance_matrix=matrix)
+        self._apply_route(truck, packages, stops, order, matrix)
 
+    def _apply_route(self, truck: Truck, packages: List[Package], stops: List[List[int]], order: List[int], matrix,
+                     last_delivery_time: datetime.timedelta = None) -> None:
+        """Drives a planned route, updating the truck and its packages.
+
+        :arg
+            truck (Truck): The truck being routed
+            packages (List[Package]): The packages on the truck in load order
+            stops (List[List[int]]): The package positions of every stop in nearest neighbor order
+            order (List[int]): The order the stops are visited in
+            matrix: The distances the route was planned with, from '_get_distance_matrix'
+            last_delivery_time (datetime.timedelta, optional): The time of the truck's previous delivery, defaults to
+                its departure time"""
         try:
-            # load pending packages yet to be delivered
-            logging.info(f'Starting delivery for the truck')
-            m_pending_packages: List[Package] = [self.m_package_hash_table.m_look_up(pID) for pID in truck.m_packages]
-            # Assign truck number in list
-            for pID in m_pending_packages:
-                pID.m_truck = truck.m_truck_number
-            truck.m_packages.clear()  # We want to insert packages according to the most efficient path so clear it
-
-            last_delivery_time = truck.m_departure_time
-
-            while m_pending_packages:
-                self.update_package_9_address(truck.m_time)
-                nearest_package, distance = self._find_nearest_package(truck, m_pending_packages)
-                nearest_package.m_departure_time = last_delivery_time
-                self._update_truck_status(truck, nearest_package, distance)
-                last_delivery_time = nearest_package.m_delivery_time
-                m_pending_packages.remove(nearest_package)
-
-                logging.info(f'Delivered package {nearest_package.m_ID} to {nearest_package.m_address}')
-
-            logging.info(f'Successfully completed delivery for truck')
+            if order != list(range(len(stops))):
+                improver = RouteImprover(matrix, M_ROUTE_NEIGHBOR_COUNT, M_ROUTE_IMPROVEMENT_TIME_BUDGET)
+                stop_vertices = [packages[positions[0]].m_vertex for positions in stops]
+                saved = (improver.m_route_length(truck.m_vertex, stop_vertices) -
+                         improver.m_route_length(truck.m_vertex, [stop_vertices[index] for index in order]))
+                self.m_mileage_saved += saved
+                m_logger.info('Route improvement saved %.2f miles for truck %s', saved, truck.m_truck_number)
+
+            if not truck.m_itinerary:
+                truck.m_itinerary.append((truck.m_time, truck.m_mileage, truck.m_vertex, truck.m_address, [], False))
+            if last_delivery_time is None:
+                last_delivery_time = truck.m_departure_time
+            for index in order:
+                stop_packages = [packages[position] for position in stops[index]]
+                distance = matrix[truck.m_vertex][stop_packages[0].m_vertex]
+                last_delivery_time = self._deliver_stop(truck, stop_packages, distance, last_delivery_time)
+
+            m_logger.info('Successfully completed delivery for truck')
         except ValueError as e:
-            logging.error(f'No pending packages found for the truck: {e}')
-
-    def _find_nearest_package(self, truck: Truck, pending_packages: List[Package]) -> Tuple[Package, float]:
-        """Find the nearest package in the list of packages relative to the truck's location.
+            m_logger.error('No pending packages found for the truck: %s', e)
 
-            The function uses the m_calculate_distance() method used to find the distance between the truck's current
-            address (truck.m_address) and each pending package's stored in (pending_packages). The min function is used
-            with a custom key to find the package with minimum distance.
+    def _deliver_stop(self, truck: Truck, packages: List[Package], distance: float,
+                      last_delivery_time: datetime.timedelta) -> datetime.timedelta:
+        """Drives the truck to a stop and delivers every package for that stop.
 
-            :arg
-                truck (Truck): The truck object used to deliver the nearest package
-                pending_packages (List[Package]): A list of package objects representing packages pending to be delivered.
+        :arg
+            truck (Truck): The truck making the delivery
+            packages (List[Package]): The packages delivered at the stop
+            distance (float): The distance from the truck's current location to the stop
+            last_delivery_time (datetime.timedelta): The time of the truck's previous delivery
 
-            :returns
-                Tuple[Package, float]: A tuple containing the nearest package and the corresponding distance.
+        :returns
+            datetime.timedelta: The time of the last delivery made at the stop"""
+        for package in packages:
+            package.m_departure_time = last_delivery_time
+            self._update_truck_status(truck, package, distance)
+            last_delivery_time = package.m_delivery_time
+            distance = 0.0  # the rest of the stop's packages are delivered without moving
 
-            :raises
-                ValueError: If there are no pending packages in the provided list"""
+            m_logger.info('Delivered package %s to %s', package.m_ID, package.m_address)
+        truck.m_itinerary.append((truck.m_time, truck.m_mileage, truck.m_vertex, truck.m_address,
+                                  [package.m_ID for package in packages], True))
+        return last_delivery_time
 
-        if not pending_packages:
-            logging.error('No pending packages to search for the nearest one.')
-            raise ValueError('No pending packages available for delivery')
+    def m_get_mileage_saved(self) -> float:
+        """Returns the total mileage removed by the route improvement stage across all trucks.
 
-        try:
-            # Find nearest package using distance calculation and min function
-            return min(
-                ((package, self.m_data_manager.m_calculate_distance(truck.m_address, package.m_address))
-                 for package in pending_packages),
-                key=lambda x: x[1]  # the shortest distance
-            )
-        except Exception as e:
-            logging.error(f'Error finding nearest package for truck: {e}')
-            raise
+        :returns
+            float: The mileage saved, 0.0 when the stage is disabled"""
+        return self.m_mileage_saved
 
     def _update_truck_status(self, truck: Truck, package: Package, distance: float) -> None:
         """Update the truck's status after delivering a package by updating the package's attributes in the truck and the
@@ -225,19 +741,27 @@ class DeliveryService:
             truck.m_packages.append(package.m_ID)
             truck.m_mileage += distance
             truck.m_address = package.m_address
+            truck.m_vertex = package.m_vertex
             truck.m_time += datetime.timedelta(hours=distance / truck.m_speed)
 
-            # Set the original times if they haven't been set
-            if package.m_original_delivery_time is None and package.m_ID == 9:
-                package.m_original_delivery_time = truck.m_time
-            if package.m_original_departure_time is None and package.m_ID == 9:
-                package.m_original_departure_time = truck.m_departure_time
-
             package.m_delivery_time = truck.m_time
         except (AttributeError, IndexError) as e:
-            logging.error(f'Error updating truck status: {e}')
+            m_logger.error('Error updating truck status: %s', e)
             raise
 
+    def m_get_deadline_violations(self) -> List[Package]:
+        """Finds every package delivered after its deadline.
+
+        :returns
+            List[Package]: The late packages ordered by ID"""
+        late = {}
+        for truck in self.m_trucks:
+            for pID in truck.m_packages:
+                package: Package = self.m_package_hash_table.m_look_up(pID)
+                if package.m_is_late():
+                    late[package.m_ID] = package
+        return [late[pID] for pID in sorted(late)]
+
     def m_get_total_mileage(self) -> float:
         """Calculates the total mileage driven by all trucks.
 
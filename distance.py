@@ -0,0 +1,346 @@
+# distance.py
+import heapq
+import logging
+import math
+from array import array
+from collections import OrderedDict
+from operator import sub
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import M_DISTANCE_CACHE_SIZE
+
+m_logger = logging.getLogger('delivery.distance')
+
+# Below this share of known vertex pairs the closure runs Dijkstra from every vertex instead of Floyd-Warshall, both
+# take about as long near 0.4
+M_SPARSE_DENSITY = 0.4
+
+
+class DistanceProvider:
+    """
+    The interface the DataManager gets its distances from.
+
+    Distances are symmetric, so a provider only has to answer each unordered pair once, and a missing distance is
+    returned as NaN. Subclasses implement 'm_vertex_count' and 'm_distance'. A provider whose distances are expensive
+    to produce (a routing service, a road graph search) should also override 'm_distances' so a whole batch of pairs
+    is answered in one request.
+    """
+
+    def m_vertex_count(self) -> int:
+        """
+        Returns the number of vertices distances are known for.
+
+        :returns
+            int: The vertex count, vertices are numbered from 0
+        """
+        raise NotImplementedError
+
+    def m_distance(self, x_value: int, y_value: int) -> float:
+        """
+        Returns the distance between two vertices.
+
+        :arg
+            x_value (int): The first vertex
+            y_value (int): The second vertex
+
+        :returns
+            float: The distance, NaN if it is not known
+        """
+        raise NotImplementedError
+
+    def m_distances(self, pairs: Sequence[Tuple[int, int]]) -> List[float]:
+        """
+        Returns the distances of a batch of vertex pairs.
+
+        :arg
+            pairs (Sequence[Tuple[int, int]]): The (x, y) vertex pairs
+
+        :returns
+            List[float]: The distance of every pair, in the same order
+        """
+        return [self.m_distance(x, y) for x, y in pairs]
+
+    def m_as_matrix(self) -> Optional[Sequence[Sequence[float]]]:
+        """
+        Returns the full distance matrix if the provider holds one, so routing can index it directly.
+
+        :returns
+            Sequence[Sequence[float]]: The rows of the matrix, or None if distances are produced on demand
+        """
+        return None
+
+    def m_block(self, vertices: Iterable[int]) -> Dict[int, Dict[int, float]]:
+        """
+        Fetches every pairwise distance between a set of vertices in one batch.
+
+        The result is indexed like the distance matrix, block[x][y], but only for the given vertices, so routers can
+        use it in place of the matrix. Each unordered pair is requested once.
+
+        :arg
+            vertices (Iterable[int]): The vertices, duplicates are ignored
+
+        :returns
+            Dict[int, Dict[int, float]]: The distance between every two of the vertices
+        """
+        unique = list(dict.fromkeys(vertices))
+        pairs = [(x, y) for i, x in enumerate(unique) for y in unique[i:]]
+        block: Dict[int, Dict[int, float]] = {x: {} for x in unique}
+        for (x, y), distance in zip(pairs, self.m_distances(pairs)):
+            block[x][y] = block[y][x] = distance
+        return block
+
+
+class MatrixDistanceProvider(DistanceProvider):
+    """
+    Answers distances from a symmetric distance matrix held in memory, the default provider.
+
+    Attributes:
+        m_distance_matrix (Sequence[Sequence[float]]): One row of distances per vertex, NaN for missing distances
+    """
+
+    def __init__(self, distance_matrix: Sequence[Sequence[float]]) -> None:
+        """
+        Initializes the provider.
+
+        :arg
+            distance_matrix (Sequence[Sequence[float]]): The array('d') or memoryview rows of the matrix
+        """
+        self.m_distance_matrix = distance_matrix
+
+    def m_vertex_count(self) -> int:
+        return len(self.m_distance_matrix)
+
+    def m_distance(self, x_value: int, y_value: int) -> float:
+        return self.m_distance_matrix[x_value][y_value]
+
+    def m_as_matrix(self) -> Sequence[Sequence[float]]:
+        return self.m_distance_matrix
+
+
+class CachedDistanceProvider(DistanceProvider):
+    """
+    A bounded least recently used cache in front of another provider.
+
+    Entries are keyed on the unordered vertex pair (min, max), so (x, y) and (y, x) share one entry. Misses inside a
+    batch are forwarded to the wrapped provider as a single 'm_distances' call. 'm_prefetch' loads a whole truck's
+    pairwise block before it is routed, after which the router reads it without going back to the provider.
+
+    Attributes:
+        m_provider (DistanceProvider): The provider misses are forwarded to
+        m_max_size (int): The largest number of pairs kept
+        m_hits (int): The number of distances answered from the cache
+        m_misses (int): The number of distances requested from the wrapped provider
+        m_evictions (int): The number of pairs dropped to stay within 'm_max_size'
+    """
+
+    def __init__(self, provider: DistanceProvider, max_size: int = M_DISTANCE_CACHE_SIZE) -> None:
+        """
+        Initializes the cache.
+
+        :arg
+            provider (DistanceProvider): The provider misses are forwarded to
+            max_size (int, optional): The largest number of pairs kept, defaults to M_DISTANCE_CACHE_SIZE
+
+        :raises
+            ValueError: If max_size is not positive
+        """
+        if max_size < 1:
+            raise ValueError('The distance cache must hold at least one pair')
+        self.m_provider = provider
+        self.m_max_size = max_size
+        self.m_hits = 0
+        self.m_misses = 0
+        self.m_evictions = 0
+        self._m_entries: 'OrderedDict[Tuple[int, int], float]' = OrderedDict()
+
+    def __len__(self) -> int:
+        """Returns the number of cached pairs."""
+        return len(self._m_entries)
+
+    def _store(self, key: Tuple[int, int], distance: float) -> None:
+        """Adds a pair as the most recently used one, evicting the least recently used pairs when full."""
+        entries = self._m_entries
+        entries[key] = distance
+        if len(entries) > self.m_max_size:
+            entries.popitem(last=False)
+            self.m_evictions += 1
+
+    def m_vertex_count(self) -> int:
+        return self.m_provider.m_vertex_count()
+
+    def m_distance(self, x_value: int, y_value: int) -> float:
+        key = (x_value, y_value) if x_value <= y_value else (y_value, x_value)
+        entries = self._m_entries
+        distance = entries.get(key)
+        if distance is not None:
+            entries.move_to_end(key)
+            self.m_hits += 1
+            return distance
+        self.m_misses += 1
+        distance = self.m_provider.m_distance(*key)
+        self._store(key, distance)
+        return distance
+
+    def m_distances(self, pairs: Sequence[Tuple[int, int]]) -> List[float]:
+        entries = self._m_entries
+        keys = [(x, y) if x <= y else (y, x) for x, y in pairs]
+        found: Dict[Tuple[int, int], float] = {}
+        missing: List[Tuple[int, int]] = []
+        for key in keys:
+            if key in found:
+                continue
+            distance = entries.get(key)
+            if distance is None:
+                missing.append(key)
+            else:
+                entries.move_to_end(key)
+                self.m_hits += 1
+            found[key] = distance
+
+        if missing:
+            self.m_misses += len(missing)
+            for key, distance in zip(missing, self.m_provider.m_distances(missing)):
+                found[key] = distance
+                self._store(key, distance)
+            m_logger.debug('Fetched %d distances, %d pairs cached', len(missing), len(entries))
+        return [found[key] for key in keys]
+
+    def m_prefetch(self, vertices: Iterable[int]) -> None:
+        """
+        Loads every pairwise distance between a set of vertices, e.g. a truck's stops, in one batch.
+
+        :arg
+            vertices (Iterable[int]): The vertices
+        """
+        unique = list(dict.fromkeys(vertices))
+        self.m_distances([(x, y) for i, x in enumerate(unique) for y in unique[i:]])
+
+    def m_as_matrix(self) -> Optional[Sequence[Sequence[float]]]:
+        # A matrix behind the cache is faster to index than the cache itself
+        return self.m_provider.m_as_matrix()
+
+    def m_stats(self) -> Dict[str, int]:
+        """
+        Returns the cache counters.
+
+        :returns
+            Dict[str, int]: The hits, misses, evictions, cached pairs and capacity
+        """
+        return {'hits': self.m_hits, 'misses': self.m_misses, 'evictions': self.m_evictions,
+                'size': len(self._m_entries), 'max_size': self.m_max_size}
+
+
+def m_floyd_warshall(matrix: Sequence[Sequence[float]]) -> List[array]:
+    """
+    Computes the shortest distance between every two vertices of a dense, symmetric graph.
+
+    For each intermediate vertex k, the part of each row right of the diagonal is checked in one pass for a cell that a
+    path through k would shorten, with max(map(sub, row_x, row_k)) > d(x, k), which runs in C. Only rows where it
+    finds one are updated cell by cell, together with their mirrored cells. Rows of vertices that cannot reach k are
+    skipped.
+
+    :arg
+        matrix (Sequence[Sequence[float]]): The symmetric edge lengths, math.inf where there is no edge and 0 on the
+            diagonal
+
+    :returns
+        List[array]: One array('d') row of shortest distances per vertex, math.inf where there is no path
+    """
+    distances = [list(row) for row in matrix]
+    size = len(distances)
+    for k, row_k in enumerate(distances):
+        for x in range(size - 1):
+            through_k = row_k[x]
+            if x == k or through_k == math.inf:
+                continue
+            row_x = distances[x]
+            # inf - inf gives NaN, which max only returns when it comes first, and then the row is checked in full
+            if max(map(sub, row_x[x + 1:], row_k[x + 1:])) <= through_k:
+                continue
+            for y in range(x + 1, size):
+                via = through_k + row_k[y]
+                if via < row_x[y]:
+                    row_x[y] = distances[y][x] = via
+    return [array('d', row) for row in distances]
+
+
+def m_dijkstra_all_pairs(matrix: Sequence[Sequence[float]]) -> List[array]:
+    """
+    Computes the shortest distance between every two vertices of a sparse graph with Dijkstra from each vertex.
+
+    :arg
+        matrix (Sequence[Sequence[float]]): The edge lengths, math.inf where there is no edge and 0 on the diagonal
+
+    :returns
+        List[array]: One array('d') row of shortest distances per vertex, math.inf where there is no path
+    """
+    size = len(matrix)
+    neighbors = [[(y, length) for y, length in enumerate(row) if length != math.inf and y != x]
+                 for x, row in enumerate(matrix)]
+    distances = []
+    for source in range(size):
+        row = array('d', [math.inf]) * size
+        row[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            distance, x = heapq.heappop(heap)
+            if distance > row[x]:
+                continue  # a shorter path to x was already settled
+            for y, length in neighbors[x]:
+                candidate = distance + length
+                if candidate < row[y]:
+                    row[y] = candidate
+                    heapq.heappush(heap, (candidate, y))
+        distances.append(row)
+    return distances
+
+
+def m_shortest_path_closure(matrix: Sequence[Sequence[float]]) -> List[array]:
+    """
+    Replaces every distance with the length of the shortest path through the table.
+
+    The table is treated as an undirected weighted graph, where two cells that disagree give the shorter length.
+    Missing distances (NaN) become the shortest path between the two vertices when one exists, and direct distances
+    longer than a path through other vertices are shortened, so the result obeys the triangle inequality. Vertices
+    that cannot reach each other keep a NaN distance. Dense tables use 'm_floyd_warshall' and tables with fewer than
+    M_SPARSE_DENSITY of their pairs known use 'm_dijkstra_all_pairs'. The input is not modified.
+
+    :arg
+        matrix (Sequence[Sequence[float]]): The distance matrix from 'DataManager.m_build_distance_matrix'
+
+    :returns
+        List[array]: One array('d') row of shortest distances per vertex
+
+    :raises
+        ValueError: If a distance is negative
+    """
+    size = len(matrix)
+    graph = []
+    for x, row in enumerate(matrix):
+        lengths = array('d', (math.inf if math.isnan(length) else length for length in row))
+        if min(lengths, default=0.0) < 0:
+            raise ValueError(f'Negative distance on row {x + 1}, shortest paths need non-negative distances')
+        lengths[x] = 0.0
+        graph.append(lengths)
+    for x in range(size):
+        for y in range(x):
+            graph[x][y] = graph[y][x] = min(graph[x][y], graph[y][x])
+    edges = sum(size - 1 - row.count(math.inf) for row in graph)
+
+    density = edges / (size * (size - 1)) if size > 1 else 1.0
+    sparse = density < M_SPARSE_DENSITY
+    closure = m_dijkstra_all_pairs(graph) if sparse else m_floyd_warshall(graph)
+
+    filled = shortened = 0
+    for x in range(size):
+        row, original = closure[x], matrix[x]
+        for y in range(size):
+            if row[y] == math.inf:
+                row[y] = math.nan
+            elif x != y and math.isnan(original[y]):
+                filled += 1
+            elif row[y] < original[y]:
+                shortened += 1
+    m_logger.info('Shortest path closure of %d vertices with %s (%.1f%% of pairs known): %d distances filled, '
+                  '%d shortened', size, 'Dijkstra' if sparse else 'Floyd-Warshall', density * 100, filled, shortened)
+    return closure
@@ -0,0 +1,248 @@
+# instrumentation.py
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from HashTable import HashTable
+from routing import DeadlineRouter, NearestNeighborRouter, RouteImprover
+from utils import DataManager
+from config import M_PROFILE, M_PROFILE_REPORT, M_PROFILE_MEMORY
+
+m_logger = logging.getLogger('delivery.instrumentation')
+
+# Environment variable turning instrumentation on, '1' prints the summary, any other value is also a report path
+M_PROFILE_ENV = 'DELIVERY_PROFILE'
+
+# Methods whose calls are counted and timed while instrumentation is on. Routing reads its distances in one block per
+# truck, so the block fetch and the router steps show where routing time goes, apart from address lookups. Trucks
+# routed in a process pool are not counted.
+M_COUNTED_METHODS = (
+    (DataManager, 'm_distance_block'),
+    (DataManager, 'm_distance_between'),
+    (DataManager, 'm_extract_address'),
+    (NearestNeighborRouter, 'm_next_stop'),
+    (DeadlineRouter, 'm_next_deadline_stop'),
+    (RouteImprover, 'm_improve'),
+    (HashTable, 'm_insert'),
+    (HashTable, 'm_look_up'),
+)
+
+
+class Instrumentation:
+    """
+    Opt-in timing and counting of the hot paths, with a summary report.
+
+    When it is off every method is a no-op, so the instrumented code runs exactly as before. When it is on it records:
+
+    - the wall time of each phase marked with 'm_phase'
+    - the number of calls and the time spent in the methods of M_COUNTED_METHODS, through wrappers installed by
+      'm_start' and removed by 'm_stop', so nothing is counted while it is off
+    - the probe length histogram of the hash tables passed to 'm_watch_table'
+    - the peak memory allocated by Python, through tracemalloc, only when 'm_trace_memory' is set since tracing slows
+      the timed code down. Timings and peak memory are best taken in separate runs.
+
+    Attributes:
+        m_enabled (bool): Whether anything is recorded
+        m_report_path (str): Where the JSON report is written, None to only print the summary
+        m_trace_memory (bool): Whether peak memory is traced, the report notes that its timings include the overhead
+        m_phases (Dict[str, float]): The seconds spent in each phase, in the order the phases first ran
+        m_calls (Dict[str, List[float]]): The [call count, seconds] of each counted method
+        m_peak_memory (int): The peak traced memory in bytes, set by 'm_stop'
+    """
+
+    def __init__(self, enabled: bool = False, report_path: str = None, trace_memory: bool = False) -> None:
+        """
+        Initializes the instrumentation.
+
+        :arg
+            enabled (bool, optional): Whether anything is recorded
+            report_path (str, optional): Where the JSON report is written
+            trace_memory (bool, optional): Whether peak memory is traced
+        """
+        self.m_enabled = enabled
+        self.m_report_path = report_path
+        self.m_trace_memory = trace_memory
+        self.m_phases: Dict[str, float] = {}
+        self.m_calls: Dict[str, List[float]] = {}
+        self.m_peak_memory = 0
+        self._m_tables: List[Tuple[str, HashTable]] = []
+        self._m_originals: List[Tuple[type, str, object]] = []
+
+    @classmethod
+    def m_from_settings(cls, flag: Optional[str] = None, memory: bool = False) -> 'Instrumentation':
+        """
+        Creates the instrumentation from the command line flag, the DELIVERY_PROFILE environment variable and
+        M_PROFILE / M_PROFILE_REPORT in config.py, in that order of precedence.
+
+        :arg
+            flag (str, optional): The value of the --profile flag, '' when given without a file, None when not given
+            memory (bool, optional): The --profile-memory flag, traces memory as well as M_PROFILE_MEMORY does
+
+        :returns
+            Instrumentation: The instrumentation, off unless one of the settings turns it on
+        """
+        environment = os.environ.get(M_PROFILE_ENV, '').strip()
+        trace_memory = memory or M_PROFILE_MEMORY
+        if flag is not None:
+            return cls(True, flag or M_PROFILE_REPORT, trace_memory)
+        if environment and environment.lower() not in ('0', 'false', 'no'):
+            return cls(True, M_PROFILE_REPORT if environment.lower() in ('1', 'true', 'yes') else environment,
+                       trace_memory)
+        return cls(M_PROFILE or memory, M_PROFILE_REPORT, trace_memory)
+
+    def m_start(self) -> None:
+        """Starts tracing memory and counting calls, if enabled."""
+        if not self.m_enabled or self._m_originals:
+            return
+        if self.m_trace_memory:
+            tracemalloc.start()
+        for owner, name in M_COUNTED_METHODS:
+            original = getattr(owner, name)
+            self._m_originals.append((owner, name, original))
+            setattr(owner, name, self._count_calls(f'{owner.__name__}.{name}', original))
+
+    def _count_calls(self, label: str, method):
+        """Wraps a method so its calls are counted and timed under 'label'."""
+        totals = self.m_calls.setdefault(label, [0, 0.0])
+
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                totals[0] += 1
+                totals[1] += time.perf_counter() - start
+        return counted
+
+    def m_stop(self) -> None:
+        """Stops tracing memory and restores the counted methods."""
+        for owner, name, original in reversed(self._m_originals):
+            setattr(owner, name, original)
+        self._m_originals.clear()
+        if tracemalloc.is_tracing():
+            self.m_peak_memory = max(self.m_peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def m_recording(self) -> Iterator['Instrumentation']:
+        """
+        Records the with block, from 'm_start' to 'm_finish', restoring the counted methods even if the block raises.
+
+        :returns
+            Iterator[Instrumentation]: This instrumentation
+        """
+        self.m_start()
+        try:
+            yield self
+        finally:
+            self.m_finish()
+
+    @contextlib.contextmanager
+    def m_phase(self, name: str) -> Iterator[None]:
+        """
+        Times the code in the with block as a phase, adding to the phase's time if it runs more than once.
+
+        :arg
+            name (str): The phase, e.g. 'routing'
+        """
+        if not self.m_enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.m_phases[name] = self.m_phases.get(name, 0.0) + time.perf_counter() - start
+
+    def m_watch_table(self, name: str, table: HashTable) -> None:
+        """
+        Adds a hash table's probe length histogram to the report.
+
+        :arg
+            name (str): The name of the table in the report
+            table (HashTable): The table
+        """
+        if self.m_enabled:
+            self._m_tables.append((name, table))
+
+    def m_report(self) -> dict:
+        """
+        Builds the report.
+
+        :returns
+            dict: The phases, counted calls, hash tables and peak memory
+        """
+        tables = {}
+        for name, table in self._m_tables:
+            histogram = table.m_probe_lengths()
+            total = sum(histogram.values())
+            tables[name] = {
+                'entries': len(table),
+                'capacity': table.m_capacity,
+                'tombstones': table.m_tombstones,
+                'mean_probe_length': round(sum(length * count for length, count in histogram.items()) / total, 3)
+                if total else 0.0,
+                'probe_lengths': {str(length): count for length, count in sorted(histogram.items())},
+            }
+        return {
+            'phases': {name: round(seconds, 6) for name, seconds in self.m_phases.items()},
+            'calls': {label: {'count': count, 'seconds': round(seconds, 6)}
+                      for label, (count, seconds) in self.m_calls.items()},
+            'hash_tables': tables,
+            'peak_memory_bytes': self.m_peak_memory if self.m_trace_memory else None,
+            'timings_include_memory_tracing': self.m_trace_memory,
+        }
+
+    def m_format_report(self, report: dict) -> str:
+        """
+        Formats the report as a human-readable summary.
+
+        :arg
+            report (dict): The report from 'm_report'
+
+        :returns
+            str: The summary
+        """
+        lines = ['Instrumentation summary', '  Phases:']
+        total = sum(report['phases'].values()) or 1.0
+        for name, seconds in report['phases'].items():
+            lines.append(f'    {name:<36} {seconds * 1000:>10.2f} ms {seconds / total:>6.1%}')
+        lines.append('  Calls:')
+        for label, calls in report['calls'].items():
+            lines.append(f'    {label:<36} {calls["count"]:>10} calls {calls["seconds"] * 1000:>10.2f} ms')
+        for name, table in report['hash_tables'].items():
+            lines.append(f'  Hash table {name}: {table["entries"]} entries in {table["capacity"]} buckets, '
+                         f'mean probe length {table["mean_probe_length"]}')
+            lines.append('    probe length: ' + ', '.join(f'{length}: {count}'
+                                                         for length, count in table['probe_lengths'].items()))
+        if report['peak_memory_bytes'] is None:
+            lines.append('  Peak traced memory: not traced, use --profile-memory in a separate run')
+        else:
+            lines.append(f'  Peak traced memory: {report["peak_memory_bytes"] / (1 << 20):.2f} MiB '
+                         f'(timings above are slowed down by the tracing)')
+        return '\n'.join(lines)
+
+    def m_finish(self) -> Optional[dict]:
+        """
+        Stops recording, prints the summary to stderr and writes the JSON report if a path was given.
+
+        :returns
+            dict: The report, or None when instrumentation is off
+        """
+        if not self.m_enabled:
+            return None
+        self.m_stop()
+        report = self.m_report()
+        print(self.m_format_report(report), file=sys.stderr)
+        if self.m_report_path:
+            with open(self.m_report_path, 'w') as output:
+                json.dump(report, output, indent=2)
+            m_logger.info('Wrote the instrumentation report to %s', self.m_report_path)
+        return report
@@ -1,57 +1,132 @@
 # Author: Ignacio-Manuel Atilano
 # ID: 010260310
 
+import argparse
 import csv
 import datetime
+import json
 import logging
+import sys
+from typing import IO, Iterable, Iterator, List, Tuple
 
 
 from Truck import Truck
 from HashTable import HashTable
 from Package import Package
-from config import M_TRUCK_CONFIGS, M_PACKAGE_FILE, M_DISTANCE_FILE, M_ADDRESS_FILE
-from utils import DataManager
+from config import (M_TRUCK_CONFIGS, M_PACKAGE_FILE, M_DISTANCE_FILE, M_ADDRESS_FILE, M_ROUTE_IMPROVEMENT,
+                    M_AUTO_ASSIGNMENT, M_HUB_ADDRESS, M_LOG_LEVELS, M_INPUT_CACHE, M_CACHE_DIRECTORY,
+                    M_ROUTE_IMPROVEMENT_TIME_BUDGET, M_ROUTE_NEIGHBOR_COUNT, M_ROUTING_MODE, M_ADDRESS_CORRECTIONS,
+                    M_SHORTEST_PATHS)
+from utils import DataManager, m_parse_deadline, m_parse_time_of_day, m_configure_logging
 from delivery_service import DeliveryService
+from assignment import PackageAssigner
+from snapshot import FleetSnapshot
+from cache import InputCache
+from instrumentation import Instrumentation
 
+m_logger = logging.getLogger('delivery.main')
+
+# Taken at import, before any truck is routed, so the input cache key does not depend on how many plans were built
+M_TRUCK_SETTINGS = repr(M_TRUCK_CONFIGS)
+
+
+def m_iter_packages(filename: str, data_manager: DataManager = None) -> Iterator[Package]:
+    """Streams the package file, converting each row into a Package object as it is read.
+
+    Invalid rows are logged with their line number and skipped: rows with fewer than 7 columns, a non-integer or
+    repeated ID, an empty address, an unknown deadline format or, when a data manager is given, an unknown address.
 
-def m_load_package_data(filename: str, hash_table: HashTable) -> None:
-    """The m_load_package_data will load in package information for each package opening
     :arg
-        filename (str): The file being passed
-        hash_table (HashTable): The hash table data structure being used
+        filename (str): The path of the package CSV file
+        data_manager (DataManager, optional): Used to resolve each package's address to a vertex ID once at load time
 
     :returns
-        Nothing, just loads data into the truck
+        Iterator[Package]: The valid packages, in file order
 
     :raises
         FileNotFoundError: If the specified CSV file is not found
-        ValueError: If there are errors parsing the CSV data (e.g., invalid data types)
-
     """
+    seen_ids = set()
     try:
-        with open(filename) as package_info:
+        with open(filename, newline='') as package_info:
             package_data = csv.reader(package_info)
             for p in package_data:
                 try:
+                    if len(p) < 7:
+                        raise ValueError(f'expected at least 7 columns, found {len(p)}')
                     pID = int(p[0])
+                    if pID in seen_ids:
+                        raise ValueError(f'package {pID} is listed more than once')
                     pAddress = p[1]
+                    if not pAddress.strip():
+                        raise ValueError('the address is empty')
                     pCity = p[2]
                     pState = p[3]
                     pZip = p[4]
                     pDeadline = p[5]
+                    pDeadlineTime = m_parse_deadline(pDeadline)
                     pWeight = p[6]
                     pStatus = "At Hub"
-
-                    # Create package object
-                    p_obj = Package(pID, pAddress, pCity, pState, pZip, pDeadline, pWeight, pStatus)
-                    hash_table.m_insert(pID, p_obj)  # insert p_object
+                    pVertex = data_manager.m_extract_address(pAddress) if data_manager else None
+                    # The notes are quoted but may contain commas, so they can span the remaining columns
+                    pNotes = ','.join(p[7:]).rstrip(',').strip().strip("'")
                 except (ValueError, TypeError) as e:
-                    logging.error(f'Error parsing row in {filename}: {p}. Exception {e}')
+                    m_logger.error('Error parsing %s line %d: %s', filename, package_data.line_num, e)
+                    continue
+
+                seen_ids.add(pID)
+                yield Package(pID, pAddress, pCity, pState, pZip, pDeadline, pWeight, pStatus, pVertex, pNotes,
+                              pDeadlineTime)
     except FileNotFoundError as e:
-        logging.error(f'File not found {filename}: Exception {e}')
+        m_logger.error('File not found %s: Exception %s', filename, e)
         raise
 
 
+def m_count_lines(filename: str) -> int:
+    """Counts the lines of a file by reading it in binary chunks, without parsing it.
+
+    :arg
+        filename (str): The file to count
+
+    :returns
+        int: The number of lines, 0 if the file is not found"""
+    try:
+        with open(filename, 'rb') as file:
+            return sum(chunk.count(b'\n') for chunk in iter(lambda: file.read(1 << 20), b'')) + 1
+    except FileNotFoundError:
+        return 0
+
+
+def m_load_package_data(filename: str, hash_table: HashTable, data_manager: DataManager = None) -> List[int]:
+    """The m_load_package_data will load in package information for each package, streaming the parsed packages into
+    the hash table's bulk insert, so the file is never held in memory.
+
+    The table is sized once from a line count of the file, which is cheap next to parsing it. Rows spanning several
+    lines only make the size a little too large, and the bulk insert still resizes if it turns out too small.
+
+    :arg
+        filename (str): The file being passed
+        hash_table (HashTable): The hash table data structure being used
+        data_manager (DataManager, optional): Used to resolve each package's address to a vertex ID once at load time
+
+    :returns
+        List[int]: The IDs of the packages loaded, in file order
+
+    :raises
+        FileNotFoundError: If the specified CSV file is not found
+
+    """
+    package_ids = []
+
+    def items() -> Iterator[Tuple[int, Package]]:
+        for package in m_iter_packages(filename, data_manager):
+            package_ids.append(package.m_ID)
+            yield package.m_ID, package
+
+    hash_table.m_bulk_insert(items(), m_count_lines(filename))
+    return package_ids
+
+
 def m_get_user_time() -> datetime.timedelta:
     """Prompt the user to enter a specific time in HH:MM format to check the status of a package (or packages).
 
@@ -68,11 +143,9 @@ def m_get_user_time() -> datetime.timedelta:
     while True:
         user_time = input("Enter time to check the status of a package in HH:MM format: ")
         try:
-            (h, m) = map(int, user_time.split(':'))  # specify data type then iterable which is the split string
-            # Validate hours and minutes
-            if not 0 <= h <= 23 or not 0 <= m <= 59:
-                raise ValueError('Invalid time entered. Hours are between 0-23 and minutes between 0-59.')
-            return datetime.timedelta(hours=int(h), minutes=int(m))
+            if user_time.count(':') != 1:
+                raise ValueError('Invalid time format.')
+            return m_parse_time_of_day(user_time)  # Validates hours and minutes
         except ValueError:
             print("Invalid time format. Please try again (HH:MM).")  # prompt user to re-enter value correctly
 
@@ -99,53 +172,231 @@ def m_get_package_selection():
             print(f'Invalid input: {e}. Please enter 1, 2, or 3.')  # More informative error message
 
 
-def m_display_all_package_status(package_hash_table: HashTable, completion_time: datetime.timedelta):
+def m_display_all_package_status(snapshot: FleetSnapshot, completion_time: datetime.timedelta):
     """
     Displays the status of all packages at the completion time of deliveries.
 
-    This function iterates through all package IDs (1 to 40), retrieves each package
-    from the hash table, updates its status based on the completion time, and prints
-    the status information for each package.
+    This function streams the status row of every package ordered by ID at the completion time
+    from the fleet snapshot index, and prints each one.
 
     :arg
-        package_hash_table (HashTable): The hash table containing all the package objects.
+        snapshot (FleetSnapshot): The index over the status timelines of all the package objects.
         completion_time (datetime.timedelta): The time when all the deliveries are completed
 
     :raises
-        TypeError: If package_hash_table is not a HashTable instance.
         ValueError: If completion_time is negative.
+    """
+    for row in snapshot.m_iter_rows(completion_time):
+        print(row)
+
 
-    Note: This function will assume that package's IDs range from 1 to 40. If a package
-    is not found in the hash table, then it will print a "Not Found" message for that ID.
+def m_create_input_cache() -> InputCache:
+    """Creates the input cache for the current CSV files and the settings that change the simulated plan.
+
+    :returns
+        InputCache: The cache
     """
-    for package_id in range(1, 41):
-        package: Package = package_hash_table.m_look_up(package_id)
-        if package:
-            package.m_update_status(completion_time)
-            print(package.m_get_status_string(completion_time))
-        else:
-            print(f'Package {package_id}: Not Found')
+    settings = (M_TRUCK_SETTINGS, M_HUB_ADDRESS, M_ROUTE_IMPROVEMENT, M_ROUTE_IMPROVEMENT_TIME_BUDGET,
+                M_ROUTE_NEIGHBOR_COUNT, M_AUTO_ASSIGNMENT, M_ROUTING_MODE, M_ADDRESS_CORRECTIONS, M_SHORTEST_PATHS)
+    return InputCache(M_CACHE_DIRECTORY, (M_PACKAGE_FILE, M_DISTANCE_FILE, M_ADDRESS_FILE), settings)
+
+
+def m_build_trucks() -> List[Truck]:
+    """Creates the trucks from M_TRUCK_CONFIGS.
+
+    Routing rewrites a truck's package list in place, so each truck gets its own copy of the configured lists and the
+    configuration stays the same for the next plan built in this process.
+
+    :returns
+        List[Truck]: The trucks, in configuration order
+    """
+    return [Truck(**dict(config, packages=list(config['packages']), depends_on=list(config.get('depends_on', []))))
+            for config in M_TRUCK_CONFIGS]
+
+
+def m_build_delivery_service(instrumentation: Instrumentation = None) -> Tuple[DeliveryService, HashTable]:
+    """Loads the CSV files, assigns the packages when automatic assignment is on and runs the delivery simulation.
 
+    With the input cache on, the distance matrix, address index and simulated plan are loaded from the cache when the
+    inputs have not changed, and stored in it when they have.
 
-def main():
+    :arg
+        instrumentation (Instrumentation, optional): Times each phase when it is enabled
+
+    :returns
+        Tuple[DeliveryService, HashTable]: The delivery service holding the simulated plan and the package hash table
+
+    :raises
+        FileNotFoundError: If one of the CSV files is not found
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.m_phase('hash_inputs'):
+        cache = m_create_input_cache() if M_INPUT_CACHE else None
+    with instrumentation.m_phase('load_distances_and_addresses'):
+        data_manager = DataManager(M_DISTANCE_FILE, M_ADDRESS_FILE, cache, shortest_paths=M_SHORTEST_PATHS)
+    trucks = m_build_trucks()  # initialize trucks
+    package_hash_table = HashTable()  # Initialize package hash map
+    instrumentation.m_watch_table('packages', package_hash_table)
+    with instrumentation.m_phase('load_packages'):
+        package_ids = m_load_package_data(M_PACKAGE_FILE, package_hash_table, data_manager)  # Load into hash table
+    delivery_service = DeliveryService(trucks, package_hash_table, data_manager)  # Initialize delivery service
+
+    with instrumentation.m_phase('load_cached_plan'):
+        plan = cache.m_load_plan() if cache else None
+        if plan is not None and delivery_service.m_import_plan(plan):
+            m_logger.info('Loaded the delivery plan from the cache')
+            return delivery_service, package_hash_table
+
+    if M_AUTO_ASSIGNMENT:  # Replace the configured package lists with an automatic assignment
+        with instrumentation.m_phase('assignment'):
+            hub_vertex = data_manager.m_extract_address(M_HUB_ADDRESS)
+            packages = [package_hash_table.m_look_up(pID) for pID in package_ids]
+            matrix = data_manager.m_distance_block([hub_vertex] + [package.m_vertex for package in packages])
+            assigner = PackageAssigner(matrix, hub_vertex)
+            assigner.m_assign(packages, trucks)
+    with instrumentation.m_phase('routing'):
+        delivery_service.m_deliver_packages()  # Deliver packages
+    if M_AUTO_ASSIGNMENT:  # A waiting truck's departure is only known once it is routed
+        PackageAssigner.m_check_departures(packages, trucks)
+    if cache:
+        with instrumentation.m_phase('store_cached_plan'):
+            cache.m_store_plan(delivery_service.m_export_plan())
+    return delivery_service, package_hash_table
+
+
+def m_answer_query(delivery_service: DeliveryService, package_hash_table: HashTable, query: dict) -> dict:
+    """Answers one status query against the simulated plan.
+
+    A query with a 'package_id' returns that package's status at 'time', a query without one returns the number of
+    packages in each status at 'time'.
+
+    :arg
+        delivery_service (DeliveryService): The delivery service holding the simulated plan
+        package_hash_table (HashTable): The package hash table
+        query (dict): {"time": "HH:MM"} with an optional "package_id"
+
+    :returns
+        dict: The package's details and status, or the counts by status
+
+    :raises
+        KeyError: If the package is not found
+        ValueError: If the query is malformed
+    """
+    if not isinstance(query, dict) or not isinstance(query.get('time'), str):
+        raise ValueError('Query must be an object with a "time" in HH:MM format')
+    time = m_parse_time_of_day(query['time'])
+
+    if query.get('package_id') is None:
+        return {'time': str(time), 'counts': delivery_service.m_get_fleet_snapshot().m_counts_at(time)}
+
+    package_id = query['package_id']
+    if isinstance(package_id, bool) or not isinstance(package_id, (int, str)):
+        raise ValueError('"package_id" must be an integer')
+    package = package_hash_table.m_look_up(int(package_id))
+    if package is None:
+        raise KeyError(f'Package {package_id} not found')
+    result = package.m_state_to_dict(package.m_status_at(time))
+    result['time'] = str(time)
+    return result
+
+
+def m_run_batch(delivery_service: DeliveryService, package_hash_table: HashTable, lines: Iterable[str],
+                output: IO[str]) -> int:
+    """Answers (package ID, time) queries read as JSON lines, writing one JSON line per query as soon as it is answered.
+
+    Blank lines are skipped. A query that cannot be answered produces {"line": n, "error": message} and the batch
+    carries on.
+
+    :arg
+        delivery_service (DeliveryService): The delivery service holding the simulated plan
+        package_hash_table (HashTable): The package hash table
+        lines (Iterable[str]): The queries, one JSON object per line, e.g. {"package_id": 9, "time": "10:25"}
+        output (IO[str]): Where the results are written
+
+    :returns
+        int: The number of queries that failed
+    """
+    errors = 0
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            result = m_answer_query(delivery_service, package_hash_table, json.loads(line))
+        except (KeyError, ValueError) as e:
+            errors += 1
+            message = e.args[0] if isinstance(e, KeyError) and e.args else str(e)
+            m_logger.warning('Query on line %d failed: %s', line_number, message)
+            result = {'line': line_number, 'error': message}
+        output.write(json.dumps(result) + '\n')
+        output.flush()  # stream each answer to whoever is reading the other end of a pipe
+    return errors
+
+
+def m_parse_arguments(argv: List[str] = None) -> argparse.Namespace:
+    """Parses the command line.
+
+    :arg
+        argv (List[str], optional): The arguments, defaults to sys.argv
+
+    :returns
+        argparse.Namespace: The parsed arguments"""
+    parser = argparse.ArgumentParser(description='Western Governors University Parcel Service')
+    parser.add_argument('--batch', nargs='?', const='-', metavar='FILE',
+                        help='answer JSON line queries such as {"package_id": 9, "time": "10:25"} from FILE '
+                             '(or stdin when FILE is omitted or "-") instead of prompting')
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help='print phase timings, call counts, hash probe lengths and peak memory to stderr, and '
+                             'write them as JSON to FILE if given')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='trace peak memory as well, which slows the timed code down, so time it in another run')
+    return parser.parse_args(argv)
+
+
+def m_batch_main(queries: str, instrumentation: Instrumentation = None) -> int:
+    """Simulates the day once, then answers every query in the batch.
+
+    :arg
+        queries (str): The query file, or '-' for stdin
+        instrumentation (Instrumentation, optional): Reports where the time went once the batch is done
+
+    :returns
+        int: The exit status, 1 if any query failed"""
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.m_recording():
+        delivery_service, package_hash_table = m_build_delivery_service(instrumentation)
+        with instrumentation.m_phase('queries'):
+            if queries == '-':
+                errors = m_run_batch(delivery_service, package_hash_table, sys.stdin, sys.stdout)
+            else:
+                with open(queries) as query_file:
+                    errors = m_run_batch(delivery_service, package_hash_table, query_file, sys.stdout)
+    return 1 if errors else 0
+
+
+def main(instrumentation: Instrumentation = None):
     """Entry point for the Western Governors University Parcel Service program.
 
     It displays as the program's starting point, showing total miles and a welcoming message. The user will be provided
     options to check the delivery status of 1 or all packages depending on their selection.
 
+    :arg
+        instrumentation (Instrumentation, optional): Reports where the time went before the user is prompted
+
     :raises
         ValueError: If invalid user input is encountered during the time conversion or package ID lookup.
     """
 
-    data_manager = DataManager(M_PACKAGE_FILE, M_DISTANCE_FILE, M_ADDRESS_FILE)  # Initialize data manager
-    trucks = [Truck(**config) for config in M_TRUCK_CONFIGS]  # initialize trucks
-    package_hash_table = HashTable()  # Initialize package hash map
-    m_load_package_data(M_PACKAGE_FILE, package_hash_table)  # Load data into hash table
-    delivery_service = DeliveryService(trucks, package_hash_table, data_manager)  # Initialize delivery service
-    delivery_service.m_deliver_packages()  # Deliver packages
+    m_configure_logging(M_LOG_LEVELS)  # Set the log level of each subsystem
+    instrumentation = instrumentation or Instrumentation.m_from_settings()
+    with instrumentation.m_recording():
+        delivery_service, package_hash_table = m_build_delivery_service(instrumentation)
 
     print("Western Governors University Parcel Service")  # Show delivery service name, title
     print(f'Total miles: {delivery_service.m_get_total_mileage():.2f} miles') # total miles for all the trucks
+    if M_ROUTE_IMPROVEMENT:
+        print(f'Miles saved by route improvement: {delivery_service.m_get_mileage_saved():.2f} miles')
+    for package in delivery_service.m_get_deadline_violations():  # report any package delivered late
+        print(f'Deadline missed: package {package.m_ID} due {package.m_deadline}, delivered {package.m_delivery_time}')
 
     while True:
         text = input("To start please type 's' for start: ")
@@ -159,23 +410,21 @@ def main():
                         convert_timedelta = m_get_user_time()
                         one_input = input("Enter package ID: ")  # Get id
                         package = package_hash_table.m_look_up(int(one_input))  # lookup ID
-                        package.m_update_status(convert_timedelta)
-                        print(package.m_get_status_string(convert_timedelta))  # print the package info in string format
+                        print(package.m_get_status_string_at(convert_timedelta))  # print the package info at that time
                         break  # break from the loop
                     except ValueError:
                         print('Invalid package ID. Closing program.')  # prompt user invalid datatype was entered
                         exit()  # exit the program
                 elif selection == 2:  # This option selects all packages to be displayed.
                     convert_timedelta = m_get_user_time()
-                    for x in range(1, 41):  # all packages
-                        package: Package = package_hash_table.m_look_up(x)  # look up packages
-                        package.m_update_status(convert_timedelta)  # update status for each package to be printed
-                        print(package.m_get_status_string(convert_timedelta))  # print package information
+                    for row in delivery_service.m_get_fleet_snapshot().m_iter_rows(convert_timedelta):  # by ID
+                        print(row)  # print package information
                     break
                 elif selection == 3:  # This option displays the completion status of all packages
                     # get completion time when all packages are delivered
                     completion_time = delivery_service.m_get_completion_time()
-                    m_display_all_package_status(package_hash_table, completion_time)  # display status for completion
+                    # display every package at completion
+                    m_display_all_package_status(delivery_service.m_get_fleet_snapshot(), completion_time)
                     break  # break
                 else:  # if it's not 1 or 2, exit
                     exit()
@@ -188,4 +437,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    arguments = m_parse_arguments()
+    if arguments.batch is not None:
+        m_configure_logging(M_LOG_LEVELS)
+        sys.exit(m_batch_main(arguments.batch, Instrumentation.m_from_settings(arguments.profile,
+                                                                               arguments.profile_memory)))
+    main(Instrumentation.m_from_settings(arguments.profile, arguments.profile_memory))
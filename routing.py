@@ -0,0 +1,443 @@
+# routing.py
+import heapq
+import math
+import time
+from array import array
+from itertools import compress
+from typing import Dict, List, Optional, Tuple
+
+from spatial import KDTree
+
+# Distance matrix shared with routing worker processes, set before the workers are started
+_m_shared_distance_matrix: Optional[List[array]] = None
+
+
+class NearestNeighborRouter:
+    """
+    Keeps track of the remaining stops of a truck and picks the nearest one with a single scan of a distance row.
+
+    Packages that share a delivery vertex are grouped into one stop so they are delivered together. Stops are kept in
+    the order their first package appears in the truck's load, which gives the same tie-breaking as running 'min' over
+    the pending package list. Packages are referred to by their position in the truck's load.
+
+    When the positions of the stops are given, the pending stops are kept in a KDTree instead of being scanned. Each
+    step visits stops in increasing straight line distance, checking at least 'candidate_count' of them against the
+    distance matrix and stopping once the next one is further in a straight line than the best road distance found
+    plus 'slack'. The stop picked is the same as with a full scan only if no road distance is shorter than the straight
+    line by more than 'slack', 'spatial.m_straight_line_deficit' measures the slack that guarantees it.
+
+    Attributes:
+        m_distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+        m_stops (List[int]): The vertex ID of every stop
+        m_stop_packages (List[List[int]]): The positions of the packages delivered at each stop, in load order
+        m_pending (bytearray): A mask holding 1 for every stop that has not been visited yet
+        m_remaining (int): The number of stops that have not been visited yet
+        m_points (Dict[int, Tuple[float, float]]): The (x, y) position in miles of every vertex, None without an index
+        m_candidate_count (int): The least number of stops checked against the distance matrix at each step
+        m_slack (float): How much shorter than the straight line a road distance may be, in miles
+    """
+
+    M_EPSILON = 1e-9  # keeps stops whose straight line distance only exceeds the best road distance by rounding
+
+    def __init__(self, distance_matrix: List[array], vertices: List[int],
+                 points: Dict[int, Tuple[float, float]] = None, candidate_count: int = 8, slack: float = 0.0) -> None:
+        """
+        Initializes the router by grouping the packages by their delivery vertex.
+
+        :arg
+            distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+            vertices (List[int]): The delivery vertex of every package on the truck, in load order
+            points (Dict[int, Tuple[float, float]], optional): The (x, y) position in miles of the start and every
+                stop, see 'spatial.m_project', to pick stops with a spatial index
+            candidate_count (int, optional): The least number of stops checked at each step with a spatial index
+            slack (float, optional): How much shorter than the straight line a road distance may be, in miles
+        """
+        self.m_distance_matrix = distance_matrix
+        self.m_stops: List[int] = []
+        self.m_stop_packages: List[List[int]] = []
+
+        stop_lookup: Dict[int, int] = {}
+        for position, vertex in enumerate(vertices):
+            stop = stop_lookup.get(vertex)
+            if stop is None:
+                stop = stop_lookup[vertex] = len(self.m_stops)
+                self.m_stops.append(vertex)
+                self.m_stop_packages.append([])
+            self.m_stop_packages[stop].append(position)
+
+        self.m_stop_range = range(len(self.m_stops))
+        self.m_pending = bytearray(b'\x01') * len(self.m_stops)
+        self.m_remaining = len(self.m_stops)
+        self.m_points = points
+        self.m_candidate_count = candidate_count
+        self.m_slack = slack
+        self._m_tree = KDTree([points[vertex] for vertex in self.m_stops]) if points else None
+
+    def __bool__(self) -> bool:
+        """Returns True while there are stops left to visit."""
+        return self.m_remaining > 0
+
+    def m_next_stop(self, current_vertex: int) -> Tuple[int, float]:
+        """
+        Finds the nearest pending stop from the given vertex.
+
+        :arg
+            current_vertex (int): The vertex the truck is currently at
+
+        :returns
+            Tuple[int, float]: The index of the nearest stop and the distance to it
+
+        :raises
+            ValueError: If there are no pending stops
+        """
+        if not self.m_remaining:
+            raise ValueError('No pending stops available for delivery')
+        if self._m_tree is not None and current_vertex in self.m_points:
+            return self._nearest_indexed_stop(current_vertex)
+
+        row = self.m_distance_matrix[current_vertex]
+        distances = array('d', map(row.__getitem__, self.m_stops))
+        stop = min(compress(self.m_stop_range, self.m_pending), key=distances.__getitem__)
+        return stop, distances[stop]
+
+    def _nearest_indexed_stop(self, current_vertex: int) -> Tuple[int, float]:
+        """Finds the nearest pending stop by checking the stops nearest in a straight line first, ties go to the stop
+        that comes first in the load like in 'm_next_stop'."""
+        row = self.m_distance_matrix[current_vertex]
+        stops = self.m_stops
+        best, best_distance = -1, math.inf
+        checked = 0
+        for straight, stop in self._m_tree.m_iter_nearest(*self.m_points[current_vertex]):
+            if checked >= self.m_candidate_count and straight > best_distance + self.m_slack + self.M_EPSILON:
+                break
+            distance = row[stops[stop]]
+            if best < 0 or distance < best_distance or (distance == best_distance and stop < best):
+                best, best_distance = stop, distance
+            checked += 1
+        return best, best_distance
+
+    def m_pop_stop(self, stop: int) -> List[int]:
+        """
+        Marks a stop as visited and returns the packages delivered there.
+
+        :arg
+            stop (int): The index of the stop returned by 'm_next_stop'
+
+        :returns
+            List[int]: The positions of the packages to deliver at the stop, in load order
+        """
+        self.m_pending[stop] = 0
+        self.m_remaining -= 1
+        if self._m_tree is not None:
+            self._m_tree.m_remove(stop)
+        return self.m_stop_packages[stop]
+
+
+class DeadlineRouter(NearestNeighborRouter):
+    """
+    A nearest neighbor router that also keeps the most urgent deadline reachable.
+
+    Stops with a deadline are kept in a heap keyed on their limit, the furthest distance from the truck's start the
+    stop can be reached at. Before driving to the nearest stop, the router checks whether the detour would use up the
+    slack of the most urgent stop, and if so goes to that stop first. Each step costs one distance-row scan plus
+    O(log n) heap work.
+
+    Attributes:
+        m_limits (List[float]): The limit of every stop, math.inf for stops without a deadline
+        m_deadline_heap (List[Tuple[float, int]]): (limit, stop) for every unvisited stop with a deadline
+    """
+
+    def __init__(self, distance_matrix: List[array], vertices: List[int], limits: List[float],
+                 points: Dict[int, Tuple[float, float]] = None, candidate_count: int = 8, slack: float = 0.0) -> None:
+        """
+        Initializes the router by grouping the packages by their delivery vertex.
+
+        :arg
+            distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+            vertices (List[int]): The delivery vertex of every package on the truck, in load order
+            limits (List[float]): The furthest distance from the start each package may be delivered at
+            points (Dict[int, Tuple[float, float]], optional): The positions used by the spatial index
+            candidate_count (int, optional): The least number of stops checked at each step with a spatial index
+            slack (float, optional): How much shorter than the straight line a road distance may be, in miles
+        """
+        super().__init__(distance_matrix, vertices, points, candidate_count, slack)
+        self.m_limits = [min(limits[position] for position in positions) for positions in self.m_stop_packages]
+        self.m_deadline_heap = [(limit, stop) for stop, limit in enumerate(self.m_limits) if limit != math.inf]
+        heapq.heapify(self.m_deadline_heap)
+
+    def m_next_deadline_stop(self, current_vertex: int, travelled: float) -> Tuple[int, float]:
+        """
+        Finds the nearest pending stop, unless going there would make the most urgent stop miss its deadline.
+
+        :arg
+            current_vertex (int): The vertex the truck is currently at
+            travelled (float): The distance the truck has driven since its start
+
+        :returns
+            Tuple[int, float]: The index of the next stop and the distance to it
+
+        :raises
+            ValueError: If there are no pending stops
+        """
+        stop, distance = self.m_next_stop(current_vertex)
+
+        heap = self.m_deadline_heap
+        while heap and not self.m_pending[heap[0][1]]:
+            heapq.heappop(heap)  # drop stops that were already visited
+        if not heap or heap[0][1] == stop:
+            return stop, distance
+
+        limit, urgent = heap[0]
+        matrix = self.m_distance_matrix
+        urgent_vertex = self.m_stops[urgent]
+        direct = matrix[current_vertex][urgent_vertex]
+        slack = limit - travelled - direct
+        detour = distance + matrix[self.m_stops[stop]][urgent_vertex] - direct
+        if detour > slack:
+            return urgent, direct
+        return stop, distance
+
+
+class RouteImprover:
+    """
+    Shortens a truck's route with 2-opt and Or-opt moves, starting from the order found by the nearest neighbor pass.
+
+    The route is an open path: it starts at the truck's vertex and ends at its last stop. Moves are only tried between
+    a stop and its nearest neighbors, and a move is only kept if it shortens the route without making any stop miss a
+    limit it met before. The search stops at a local optimum or when the time budget runs out.
+
+    Attributes:
+        m_distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+        m_neighbor_count (int): The number of nearest stops considered for each move
+        m_time_budget (float): The number of seconds the search may run
+    """
+
+    M_EPSILON = 1e-9
+
+    def __init__(self, distance_matrix: List[array], neighbor_count: int, time_budget: float) -> None:
+        """
+        Initializes the route improver.
+
+        :arg
+            distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+            neighbor_count (int): The number of nearest stops considered for each move
+            time_budget (float): The number of seconds the search may run
+
+        :raises
+            ValueError: If the neighbor count is not positive or the time budget is negative
+        """
+        if neighbor_count <= 0:
+            raise ValueError('Neighbor count must be a positive integer.')
+        if time_budget < 0:
+            raise ValueError('Time budget cannot be negative.')
+
+        self.m_distance_matrix = distance_matrix
+        self.m_neighbor_count = neighbor_count
+        self.m_time_budget = time_budget
+
+    def m_route_length(self, start_vertex: int, stops: List[int]) -> float:
+        """
+        Calculates the length of the open path from the start vertex through the stops in order.
+
+        :arg
+            start_vertex (int): The vertex the route starts at
+            stops (List[int]): The vertex of every stop in visiting order
+
+        :returns
+            float: The total distance of the route
+        """
+        matrix = self.m_distance_matrix
+        total = 0.0
+        previous = start_vertex
+        for vertex in stops:
+            total += matrix[previous][vertex]
+            previous = vertex
+        return total
+
+    def m_improve(self, start_vertex: int, stops: List[int], limits: List[float] = None) -> List[int]:
+        """
+        Improves the visiting order of the stops.
+
+        :arg
+            start_vertex (int): The vertex the route starts at
+            stops (List[int]): The vertex of every stop in the current visiting order
+            limits (List[float], optional): The furthest distance from the start each stop may be reached at, use
+                math.inf for stops without a limit. Stops already past their limit in the current order are not held
+                to it.
+
+        :returns
+            List[int]: The positions in 'stops' in the improved visiting order
+        """
+        if len(stops) < 2:
+            return list(range(len(stops)))
+
+        # Node 0 is the start, node i + 1 is stops[i]
+        vertices = [start_vertex] + list(stops)
+        matrix = self.m_distance_matrix
+        size = len(vertices)
+        distance = [[matrix[a][b] for b in vertices] for a in vertices]
+        path = list(range(size))
+
+        limit = [math.inf] + (list(limits) if limits is not None else [math.inf] * len(stops))
+        travelled = 0.0
+        for node in range(1, size):
+            travelled += distance[node - 1][node]
+            if travelled > limit[node] + self.M_EPSILON:
+                limit[node] = math.inf  # already late, do not hold the stop to its limit
+
+        count = min(self.m_neighbor_count, size - 2)
+        neighbors = [sorted((other for other in range(1, size) if other != node),
+                            key=distance[node].__getitem__)[:count]
+                     for node in range(size)]
+
+        def feasible(candidate: List[int]) -> bool:
+            reached = 0.0
+            for index in range(1, size):
+                reached += distance[candidate[index - 1]][candidate[index]]
+                if reached > limit[candidate[index]] + self.M_EPSILON:
+                    return False
+            return True
+
+        deadline = time.perf_counter() + self.m_time_budget
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = self._two_opt(path, distance, neighbors, feasible) or \
+                self._or_opt(path, distance, neighbors, feasible)
+
+        return [node - 1 for node in path[1:]]
+
+    def _two_opt(self, path: List[int], distance: List[List[float]], neighbors: List[List[int]], feasible) -> bool:
+        """
+        Applies the first 2-opt move (reversing a segment of the path) that shortens the route.
+
+        :returns
+            bool: True if the path was changed in place
+        """
+        size = len(path)
+        position = {node: index for index, node in enumerate(path)}
+        for i in range(1, size):
+            a, b = path[i - 1], path[i]
+            for c in neighbors[a]:
+                j = position[c]
+                if j <= i:
+                    continue
+                delta = distance[a][c] - distance[a][b]
+                if j + 1 < size:
+                    e = path[j + 1]
+                    delta += distance[b][e] - distance[c][e]
+                if delta < -self.M_EPSILON:
+                    candidate = path[:i] + path[i:j + 1][::-1] + path[j + 1:]
+                    if feasible(candidate):
+                        path[:] = candidate
+                        return True
+        return False
+
+    def _or_opt(self, path: List[int], distance: List[List[float]], neighbors: List[List[int]], feasible) -> bool:
+        """
+        Applies the first Or-opt move (moving a run of up to three stops elsewhere in the path) that shortens the route.
+
+        :returns
+            bool: True if the path was changed in place
+        """
+        size = len(path)
+        for length in (1, 2, 3):
+            for i in range(1, size - length + 1):
+                segment = path[i:i + length]
+                first, last = segment[0], segment[-1]
+                previous = path[i - 1]
+                removed = distance[previous][first]
+                if i + length < size:
+                    following = path[i + length]
+                    removed += distance[last][following] - distance[previous][following]
+
+                rest = path[:i] + path[i + length:]
+                position = {node: index for index, node in enumerate(rest)}
+                # Insert after a neighbor of the first stop or before a neighbor of the last stop
+                spots = {position[node] + 1 for node in neighbors[first] if node in position}
+                spots.update(position[node] for node in neighbors[last] if node in position and position[node] > 0)
+                for k in sorted(spots):
+                    if k == i:
+                        continue
+                    added = distance[rest[k - 1]][first]
+                    if k < len(rest):
+                        added += distance[last][rest[k]] - distance[rest[k - 1]][rest[k]]
+                    if added - removed < -self.M_EPSILON:
+                        candidate = rest[:k] + segment + rest[k:]
+                        if feasible(candidate):
+                            path[:] = candidate
+                            return True
+        return False
+
+
+def m_share_distance_matrix(distance_matrix: Optional[List[array]]) -> None:
+    """
+    Sets the distance matrix used by 'm_plan_route' when no matrix is passed to it.
+
+    Worker processes either inherit it through fork or receive it once as the pool initializer, so the matrix is never
+    sent along with each routing task.
+
+    :arg
+        distance_matrix (List[array]): The symmetric distance matrix from the DataManager
+    """
+    global _m_shared_distance_matrix
+    _m_shared_distance_matrix = distance_matrix
+
+
+def m_plan_route(start_vertex: int, vertices: List[int], limits: List[float] = None, improve: bool = False,
+                 neighbor_count: int = 8, time_budget: float = 0.5, mode: str = 'distance',
+                 points: Dict[int, Tuple[float, float]] = None, candidate_count: int = 8, slack: float = 0.0,
+                 distance_matrix: List[array] = None) -> Tuple[List[List[int]], List[int]]:
+    """
+    Plans the route of one truck without touching any Package or Truck objects, so it can run in a worker process.
+
+    :arg
+        start_vertex (int): The vertex the truck starts at
+        vertices (List[int]): The delivery vertex of every package on the truck, in load order
+        limits (List[float], optional): The furthest distance from the start each package may be delivered at, used by
+            the deadline mode and the improvement stage
+        improve (bool, optional): Whether to run the 2-opt / Or-opt improvement stage
+        neighbor_count (int, optional): The number of nearest stops considered by the improvement stage
+        time_budget (float, optional): The number of seconds the improvement stage may run
+        mode (str, optional): 'distance' for plain nearest neighbor, 'deadline' to route with DeadlineRouter
+        points (Dict[int, Tuple[float, float]], optional): The (x, y) position in miles of the start and every stop,
+            picks each stop with a spatial index instead of a full scan
+        candidate_count (int, optional): The least number of stops checked at each step with a spatial index
+        slack (float, optional): How much shorter than the straight line a road distance may be, in miles
+        distance_matrix (List[array], optional): The distance matrix, defaults to the one set by
+            'm_share_distance_matrix'
+
+    :returns
+        Tuple[List[List[int]], List[int]]: The package positions of every stop in the order the router visited them,
+            and the order the stops should be visited in
+
+    :raises
+        ValueError: If the mode is unknown
+    """
+    matrix = distance_matrix if distance_matrix is not None else _m_shared_distance_matrix
+    if mode not in ('distance', 'deadline'):
+        raise ValueError(f'Unknown routing mode {mode}')
+
+    stops: List[List[int]] = []
+    current_vertex = start_vertex
+    if mode == 'deadline':
+        router = DeadlineRouter(matrix, vertices, limits or [math.inf] * len(vertices), points, candidate_count, slack)
+        travelled = 0.0
+        while router:
+            stop, distance = router.m_next_deadline_stop(current_vertex, travelled)
+            stops.append(router.m_pop_stop(stop))
+            current_vertex = router.m_stops[stop]
+            travelled += distance
+    else:
+        router = NearestNeighborRouter(matrix, vertices, points, candidate_count, slack)
+        while router:
+            stop, _ = router.m_next_stop(current_vertex)
+            stops.append(router.m_pop_stop(stop))
+            current_vertex = router.m_stops[stop]
+
+    order = list(range(len(stops)))
+    if improve and len(stops) > 1:
+        stop_limits = [min(limits[position] for position in positions) if limits else math.inf
+                       for positions in stops]
+        improver = RouteImprover(matrix, neighbor_count, time_budget)
+        order = improver.m_improve(start_vertex, [vertices[positions[0]] for positions in stops], stop_limits)
+    return stops, order
@@ -0,0 +1,212 @@
+# server.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from HashTable import HashTable
+from delivery_service import DeliveryService
+from main import m_build_delivery_service, m_answer_query
+from config import M_PACKAGE_FILE, M_DISTANCE_FILE, M_ADDRESS_FILE, M_SERVER_HOST, M_SERVER_PORT, M_LOG_LEVELS
+from utils import m_configure_logging, m_parse_time_of_day
+
+m_logger = logging.getLogger('delivery.server')
+
+M_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+M_MAX_HEADER_LINES = 100
+
+
+class QueryServer:
+    """
+    A local HTTP server that loads and routes the day once, then answers status queries from memory.
+
+    Queries are answered on the event loop from the package timelines and the fleet snapshot index, so they never
+    re-run the simulation. A reload builds a new plan in a worker thread while queries keep being answered from the
+    current one, then swaps it in.
+
+    Endpoints (times are 'HH:MM', and default to the time the last delivery is completed):
+        GET /packages/<id>?time=HH:MM   the status of one package
+        GET /packages?time=HH:MM        the status of every package, ordered by ID
+        GET /summary?time=HH:MM         the counts by status, total mileage and completion time
+        POST /reload[?force=1]          reloads the plan if the CSV files changed since it was loaded
+
+    Attributes:
+        m_host (str): The address the server listens on
+        m_port (int): The port the server listens on
+        m_delivery_service (DeliveryService): The delivery service holding the current plan
+        m_package_hash_table (HashTable): The package hash table of the current plan
+        m_file_versions (Dict[str, float]): The modification time of each CSV file when the plan was loaded
+    """
+
+    def __init__(self, host: str = M_SERVER_HOST, port: int = M_SERVER_PORT) -> None:
+        """
+        Initializes the server, the plan is loaded by m_start.
+
+        :arg
+            host (str, optional): The address to listen on
+            port (int, optional): The port to listen on, 0 picks a free port
+        """
+        self.m_host = host
+        self.m_port = port
+        self.m_delivery_service: Optional[DeliveryService] = None
+        self.m_package_hash_table: Optional[HashTable] = None
+        self.m_file_versions: Dict[str, float] = {}
+        self._m_server: Optional[asyncio.AbstractServer] = None
+        self._m_reload_lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _get_file_versions() -> Dict[str, float]:
+        """Returns the modification time of each CSV file the plan is built from."""
+        return {filename: os.stat(filename).st_mtime for filename in (M_PACKAGE_FILE, M_DISTANCE_FILE, M_ADDRESS_FILE)}
+
+    async def m_start(self) -> None:
+        """Loads and routes the day, then starts listening."""
+        self._m_reload_lock = asyncio.Lock()
+        await self.m_reload(force=True)
+        self._m_server = await asyncio.start_server(self._handle_connection, self.m_host, self.m_port)
+        self.m_port = self._m_server.sockets[0].getsockname()[1]
+        m_logger.info('Serving status queries on %s:%d', self.m_host, self.m_port)
+
+    async def m_serve_forever(self) -> None:
+        """Starts the server and serves until it is cancelled."""
+        await self.m_start()
+        async with self._m_server:
+            await self._m_server.serve_forever()
+
+    async def m_close(self) -> None:
+        """Stops listening."""
+        if self._m_server is not None:
+            self._m_server.close()
+            await self._m_server.wait_closed()
+
+    async def m_reload(self, force: bool = False) -> bool:
+        """
+        Rebuilds the plan in a worker thread if the CSV files changed since it was loaded.
+
+        :arg
+            force (bool, optional): Rebuild even if the files did not change
+
+        :returns
+            bool: True if the plan was rebuilt
+        """
+        async with self._m_reload_lock:
+            versions = self._get_file_versions()
+            if not force and versions == self.m_file_versions:
+                return False
+            loop = asyncio.get_running_loop()
+            delivery_service, package_hash_table = await loop.run_in_executor(None, self._build_plan)
+            # Swap both at once so no query sees the service of one plan and the packages of another
+            self.m_delivery_service, self.m_package_hash_table = delivery_service, package_hash_table
+            self.m_file_versions = versions
+            m_logger.info('Loaded plan: %.2f miles, completed at %s', delivery_service.m_get_total_mileage(),
+                          delivery_service.m_get_completion_time())
+            return True
+
+    @staticmethod
+    def _build_plan() -> Tuple[DeliveryService, HashTable]:
+        """Builds a plan with its fleet snapshot index, so the first query does not pay for it."""
+        delivery_service, package_hash_table = m_build_delivery_service()
+        delivery_service.m_get_fleet_snapshot()
+        return delivery_service, package_hash_table
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers the requests sent on one connection, keeping it open between requests unless asked not to."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                for _ in range(M_MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0) or 0)
+                if length:
+                    await reader.readexactly(length)  # no endpoint takes a body
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, body = 400, {'error': 'Malformed request line'}
+                else:
+                    status, body = await self._dispatch(parts[0], parts[1])
+                keep_alive = (len(parts) == 3 and parts[2] == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+
+                payload = json.dumps(body).encode()
+                writer.write((f'HTTP/1.1 {status} {M_REASONS[status]}\r\n'
+                              f'Content-Type: application/json\r\n'
+                              f'Content-Length: {len(payload)}\r\n'
+                              f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            m_logger.debug('Dropped connection: %s', e)
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str) -> Tuple[int, object]:
+        """
+        Answers one request.
+
+        :arg
+            method (str): The HTTP method
+            target (str): The request path and query string
+
+        :returns
+            Tuple[int, object]: The HTTP status code and the JSON body
+        """
+        url = urlsplit(target)
+        parameters = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/')
+        try:
+            if path == '/reload':
+                if method != 'POST':
+                    return 405, {'error': 'Use POST to reload'}
+                reloaded = await self.m_reload(force=parameters.get('force') in ('1', 'true'))
+                return 200, {'reloaded': reloaded}
+            if method != 'GET':
+                return 405, {'error': f'Use GET for {path or "/"}'}
+
+            # Read the plan once so a reload finishing during this request cannot mix two plans
+            delivery_service, package_hash_table = self.m_delivery_service, self.m_package_hash_table
+            time = parameters.get('time') or str(delivery_service.m_get_completion_time())
+            if path.startswith('/packages/'):
+                query = {'package_id': path[len('/packages/'):], 'time': time}
+                return 200, m_answer_query(delivery_service, package_hash_table, query)
+            if path == '/packages':
+                time_of_day = m_parse_time_of_day(time)
+                states = delivery_service.m_get_fleet_snapshot().m_states_at(time_of_day)
+                return 200, {'time': str(time_of_day),
+                             'packages': [package.m_state_to_dict(state) for package, state in states]}
+            if path == '/summary':
+                summary = m_answer_query(delivery_service, package_hash_table, {'time': time})
+                summary['total_mileage'] = round(delivery_service.m_get_total_mileage(), 2)
+                summary['completion_time'] = str(delivery_service.m_get_completion_time())
+                return 200, summary
+            return 404, {'error': f'Unknown endpoint {path or "/"}'}
+        except KeyError as e:
+            return 404, {'error': e.args[0] if e.args else str(e)}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception:
+            m_logger.exception('Failed to answer %s %s', method, target)
+            return 500, {'error': 'Internal server error'}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serves package status queries over HTTP')
+    parser.add_argument('--host', default=M_SERVER_HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=M_SERVER_PORT, help='port to listen on')
+    arguments = parser.parse_args()
+    m_configure_logging(M_LOG_LEVELS)
+    try:
+        asyncio.run(QueryServer(arguments.host, arguments.port).m_serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,73 @@
+# simulation.py
+import datetime
+import heapq
+import logging
+from typing import Callable, List, Tuple
+
+m_logger = logging.getLogger('delivery.simulation')
+
+# Priorities for events that happen at the same time, lower runs first
+M_PRIORITY_PACKAGE_ARRIVAL = 0
+M_PRIORITY_ADDRESS_CORRECTION = 1
+M_PRIORITY_TRUCK_DEPARTURE = 2
+M_PRIORITY_TRUCK_RETURN = 3
+
+
+class EventScheduler:
+    """
+    A discrete-event scheduler built on a heap of timestamped events.
+
+    Each event is a handler and its arguments. Events run exactly once, in timestamp order, then by priority, then in
+    the order they were scheduled, so a run with E events costs O(E log E). Handlers may schedule further events. An
+    event scheduled before the current time runs next, at the current time, so the clock never moves backwards.
+
+    Attributes:
+        m_now (datetime.timedelta): The time of the event being processed, or of the last event processed
+        m_events (List[tuple]): The heap of (time, priority, sequence, handler, args) entries
+        m_processed (int): The number of events processed so far
+    """
+
+    def __init__(self, start_time: datetime.timedelta = datetime.timedelta(0)) -> None:
+        """
+        Initializes the scheduler.
+
+        :arg
+            start_time (datetime.timedelta, optional): The time the simulation starts at
+        """
+        self.m_now = start_time
+        self.m_events: List[Tuple[datetime.timedelta, int, int, Callable, tuple]] = []
+        self.m_sequence = 0
+        self.m_processed = 0
+
+    def __len__(self) -> int:
+        """Returns the number of events waiting to be processed."""
+        return len(self.m_events)
+
+    def m_schedule(self, time: datetime.timedelta, priority: int, handler: Callable, *args) -> None:
+        """
+        Schedules an event.
+
+        :arg
+            time (datetime.timedelta): The time the event happens at
+            priority (int): Orders events that happen at the same time, lower runs first
+            handler (Callable): Called with 'args' when the event is processed
+            args: The arguments passed to the handler
+        """
+        heapq.heappush(self.m_events, (max(time, self.m_now), priority, self.m_sequence, handler, args))
+        self.m_sequence += 1
+
+    def m_run(self, until: datetime.timedelta = None) -> None:
+        """
+        Processes events in order until none are left.
+
+        :arg
+            until (datetime.timedelta, optional): Stop before the first event that happens after this time
+        """
+        while self.m_events:
+            if until is not None and self.m_events[0][0] > until:
+                break
+            time, _, _, handler, args = heapq.heappop(self.m_events)
+            self.m_now = time
+            handler(*args)
+            self.m_processed += 1
+        m_logger.info('Processed %s events, simulation clock at %s', self.m_processed, self.m_now)
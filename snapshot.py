@@ -0,0 +1,122 @@
+# snapshot.py
+import bisect
+import datetime
+import logging
+from array import array
+from itertools import repeat
+from operator import add
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from Package import Package
+
+m_logger = logging.getLogger('delivery.snapshot')
+
+M_STATUSES = ('At Hub', 'En route', 'Delivered')
+M_NEVER = float('inf')  # start time of a timeline entry a package does not have
+
+
+class FleetSnapshot:
+    """
+    An index over the status timelines of every package, answering "all packages at time T" in one pass.
+
+    The timelines are stored as columns, column j holding the start time (in seconds) of each package's j-th timeline
+    entry. A package's entry at time T is the number of later columns that have started by T, so all packages are
+    resolved with one comparison per column instead of a search per package. Every status change in the fleet is also
+    kept in one sorted list with the running count of packages in each status, so counts at T take a single bisect.
+
+    Attributes:
+        m_packages (Tuple[Package]): The indexed packages ordered by ID
+        m_columns (List[array]): The start times of the j-th timeline entry of each package, inf if it has none
+        m_change_times (array): The sorted times (in seconds) at which a package changes status
+        m_counts (List[Dict[str, int]]): The number of packages in each status before the first change and after
+            each change
+    """
+
+    def __init__(self, packages: Iterable[Package]) -> None:
+        """
+        Builds the index from packages whose timelines have been built.
+
+        :arg
+            packages (Iterable[Package]): The packages to index
+
+        :raises
+            ValueError: If a package has no timeline
+        """
+        self.m_packages = tuple(sorted(packages, key=lambda package: package.m_ID))
+        for package in self.m_packages:
+            if package.m_timeline is None:
+                raise ValueError(f'Package {package.m_ID} has no status timeline, run the delivery simulation first')
+
+        length = max((len(package.m_timeline) for package in self.m_packages), default=1)
+        self.m_columns = [array('d', (package.m_timeline[j][0].total_seconds() if j < len(package.m_timeline)
+                                      else M_NEVER for package in self.m_packages))
+                          for j in range(1, length)]  # the first entry always applies
+
+        changes = []
+        counts = dict.fromkeys(M_STATUSES, 0)
+        for package in self.m_packages:
+            timeline = package.m_timeline
+            counts[timeline[0][1][0]] = counts.get(timeline[0][1][0], 0) + 1
+            for (_, before), (time, after) in zip(timeline, timeline[1:]):
+                if before[0] != after[0]:
+                    changes.append((time.total_seconds(), before[0], after[0]))
+        changes.sort()
+
+        self.m_change_times = array('d', (change[0] for change in changes))
+        self.m_counts = [dict(counts)]
+        for _, before, after in changes:
+            counts[before] -= 1
+            counts[after] = counts.get(after, 0) + 1
+            self.m_counts.append(dict(counts))
+        m_logger.debug('Indexed %d packages with %d status changes', len(self.m_packages), len(changes))
+
+    def __len__(self) -> int:
+        """Returns the number of indexed packages."""
+        return len(self.m_packages)
+
+    def _entry_indexes(self, time: datetime.timedelta) -> List[int]:
+        """Returns the index of each package's timeline entry at the given time."""
+        seconds = time.total_seconds()
+        indexes = list(repeat(0, len(self.m_packages)))
+        for column in self.m_columns:
+            indexes = list(map(add, indexes, map(seconds.__ge__, column)))
+        return indexes
+
+    def m_states_at(self, time: datetime.timedelta) -> List[Tuple[Package, tuple]]:
+        """
+        Returns the state of every package at the given time.
+
+        :arg
+            time (datetime.timedelta): The time of day
+
+        :returns
+            List[Tuple[Package, tuple]]: (package, state) pairs ordered by package ID, where each state is (status,
+                address, city, state, zip, departure time, delivery time)
+        """
+        return [(package, package.m_timeline[index][1])
+                for package, index in zip(self.m_packages, self._entry_indexes(time))]
+
+    def m_counts_at(self, time: datetime.timedelta) -> Dict[str, int]:
+        """
+        Returns the number of packages in each status at the given time.
+
+        :arg
+            time (datetime.timedelta): The time of day
+
+        :returns
+            Dict[str, int]: The number of packages per status
+        """
+        return dict(self.m_counts[bisect.bisect_right(self.m_change_times, time.total_seconds())])
+
+    def m_iter_rows(self, time: datetime.timedelta) -> Iterator[str]:
+        """
+        Streams the formatted status row of every package at the given time, formatting each row only when it is read.
+
+        :arg
+            time (datetime.timedelta): The time of day
+
+        :returns
+            Iterator[str]: The rows ordered by package ID
+        """
+        for package, index in zip(self.m_packages, self._entry_indexes(time)):
+            yield package.m_format_state(package.m_timeline[index][1])
@@ -0,0 +1,169 @@
+# spatial.py
+import heapq
+import math
+from operator import sub
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+M_EARTH_RADIUS_MILES = 3958.8
+M_MILES_PER_DEGREE = M_EARTH_RADIUS_MILES * math.pi / 180
+
+
+def m_project(coordinates: Sequence[Optional[Tuple[float, float]]]) -> List[Optional[Tuple[float, float]]]:
+    """
+    Projects latitude / longitude pairs onto a plane measured in miles, so straight line distances can be compared with
+    road distances.
+
+    The projection is equirectangular around the latitude of the first located vertex (the hub in the address file),
+    which is accurate to well under a percent across a city.
+
+    :arg
+        coordinates (Sequence[Optional[Tuple[float, float]]]): The (latitude, longitude) of every vertex, None where
+            it is not known
+
+    :returns
+        List[Optional[Tuple[float, float]]]: The (x, y) position of every vertex in miles, None where it is not known
+    """
+    reference = next((latitude for latitude, _ in filter(None, coordinates)), 0.0)
+    scale = math.cos(math.radians(reference))
+    projected = []
+    for point in coordinates:
+        if point is None:
+            projected.append(None)
+        else:
+            latitude, longitude = point
+            projected.append((longitude * scale * M_MILES_PER_DEGREE, latitude * M_MILES_PER_DEGREE))
+    return projected
+
+
+def m_straight_line_deficit(points: Dict[int, Tuple[float, float]], distance_matrix) -> float:
+    """
+    Measures how much shorter than the straight line the road distances between located vertices can be.
+
+    Routing with a spatial index relies on a road never being shorter than the straight line between its ends. Road
+    tables rounded to the nearest tenth of a mile, or coordinates that are slightly off, break that by a small amount,
+    and the router uses this measurement as its slack to stay exact.
+
+    :arg
+        points (Dict[int, Tuple[float, float]]): The (x, y) position in miles of each vertex to check
+        distance_matrix: The distances, indexed [x][y] for every vertex in 'points'
+
+    :returns
+        float: The largest straight line distance minus road distance over every pair, 0.0 when no road is shorter
+    """
+    vertices = list(points)
+    positions = [points[vertex] for vertex in vertices]
+    deficit = 0.0
+    for vertex, position in zip(vertices, positions):
+        row = distance_matrix[vertex]
+        straight = map(math.dist, [position] * len(positions), positions)
+        gaps = map(sub, straight, map(row.__getitem__, vertices))
+        deficit = max(deficit, max(filter((0.0).__lt__, gaps), default=0.0))  # NaN gaps are filtered out
+    return deficit
+
+
+class KDTree:
+    """
+    A 2-d tree over a fixed set of points that supports removing points and visiting the rest nearest first.
+
+    The tree is built once with median splits, then removed points are only marked. Each node keeps the bounding box
+    of its subtree and the number of points still in it, so empty subtrees are skipped and 'm_iter_nearest' can visit
+    points in increasing distance with a heap of boxes, touching O(log n) nodes for each point it yields.
+
+    Attributes:
+        m_points (List[Tuple[float, float]]): The (x, y) of every point, points are referred to by their index here
+    """
+
+    def __init__(self, points: Sequence[Tuple[float, float]]) -> None:
+        """
+        Builds the tree.
+
+        :arg
+            points (Sequence[Tuple[float, float]]): The (x, y) of every point
+        """
+        self.m_points = list(points)
+        size = len(self.m_points)
+        # Node i holds point _m_item[i], nodes are stored in the order they are built
+        self._m_item: List[int] = []
+        self._m_left: List[int] = []
+        self._m_right: List[int] = []
+        self._m_parent: List[int] = []
+        self._m_box: List[Tuple[float, float, float, float]] = []
+        self._m_alive: List[int] = []
+        self._m_node_of = [0] * size
+        self._m_removed = bytearray(size)
+        if size:
+            self._build(list(range(size)), 0, -1)
+
+    def _build(self, items: List[int], axis: int, parent: int) -> int:
+        """Builds the subtree over 'items' split on 'axis' and returns its node."""
+        points = self.m_points
+        items.sort(key=lambda item: points[item][axis])
+        middle = len(items) // 2
+        node = len(self._m_item)
+        self._m_item.append(items[middle])
+        self._m_left.append(-1)
+        self._m_right.append(-1)
+        self._m_parent.append(parent)
+        xs = [points[item][0] for item in items]
+        ys = [points[item][1] for item in items]
+        self._m_box.append((min(xs), min(ys), max(xs), max(ys)))
+        self._m_alive.append(len(items))
+        self._m_node_of[items[middle]] = node
+        if middle:
+            self._m_left[node] = self._build(items[:middle], 1 - axis, node)
+        if middle + 1 < len(items):
+            self._m_right[node] = self._build(items[middle + 1:], 1 - axis, node)
+        return node
+
+    def __len__(self) -> int:
+        """Returns the number of points not removed."""
+        return self._m_alive[0] if self._m_alive else 0
+
+    def m_remove(self, item: int) -> None:
+        """
+        Removes a point, it is no longer returned by 'm_iter_nearest'.
+
+        :arg
+            item (int): The index of the point
+        """
+        if self._m_removed[item]:
+            return
+        self._m_removed[item] = 1
+        node = self._m_node_of[item]
+        while node != -1:
+            self._m_alive[node] -= 1
+            node = self._m_parent[node]
+
+    def m_iter_nearest(self, x: float, y: float) -> Iterator[Tuple[float, int]]:
+        """
+        Yields the points not removed in increasing straight line distance from (x, y).
+
+        :arg
+            x (float): The x of the query position
+            y (float): The y of the query position
+
+        :returns
+            Iterator[Tuple[float, int]]: (distance, index) of each point, read lazily
+        """
+        if not len(self):
+            return
+        points, boxes, alive = self.m_points, self._m_box, self._m_alive
+
+        def box_distance(node: int) -> float:
+            min_x, min_y, max_x, max_y = boxes[node]
+            return math.hypot(max(min_x - x, 0.0, x - max_x), max(min_y - y, 0.0, y - max_y))
+
+        # Entries are (distance, 0, point) or (distance, 1, node), so a point is yielded before a box at its distance
+        heap = [(box_distance(0), 1, 0)]
+        while heap:
+            distance, is_node, index = heapq.heappop(heap)
+            if not is_node:
+                yield distance, index
+                continue
+            item = self._m_item[index]
+            if not self._m_removed[item]:
+                point = points[item]
+                heapq.heappush(heap, (math.hypot(point[0] - x, point[1] - y), 0, item))
+            for child in (self._m_left[index], self._m_right[index]):
+                if child != -1 and alive[child]:
+                    heapq.heappush(heap, (box_distance(child), 1, child))
@@ -0,0 +1,140 @@
+# synthetic.py
+import argparse
+import csv
+import math
+import os
+import random
+from typing import List, Tuple
+
+from spatial import M_MILES_PER_DEGREE
+from config import M_HUB_ADDRESS
+
+M_DEFAULT_SEED = 4001
+M_MIN_ADDRESSES = 27  # as many as the real address file
+M_MAX_ADDRESSES = 1000  # the distance file grows with the square of the address count
+M_AREA_MILES = 12.0  # width and height of the square the addresses are placed in
+M_HUB_LOCATION = (40.6853, -111.8708)  # latitude and longitude the square is centered on
+M_DEADLINES = ('EOD', 'EOD', 'EOD', '10:30 AM', '10:30 AM', '9:00 AM')
+M_STREETS = ('Oak', 'Maple', 'Cedar', 'Pine', 'Elm', 'Birch', 'Aspen', 'Willow', 'Spruce', 'Juniper')
+
+
+def m_default_address_count(package_count: int) -> int:
+    """Returns the number of addresses generated for a number of packages, about 10 packages per address.
+
+    :arg
+        package_count (int): The number of packages
+
+    :returns
+        int: The number of addresses, including the hub"""
+    return max(M_MIN_ADDRESSES, min(M_MAX_ADDRESSES, package_count // 10))
+
+
+def m_generate_points(address_count: int, rng: random.Random) -> List[Tuple[float, float]]:
+    """Places the hub in the middle of the area and the other addresses uniformly around it.
+
+    :arg
+        address_count (int): The number of addresses, including the hub
+        rng (random.Random): The seeded random generator
+
+    :returns
+        List[Tuple[float, float]]: The (x, y) position of each address in miles, the hub first"""
+    center = M_AREA_MILES / 2
+    return [(center, center)] + [(rng.uniform(0, M_AREA_MILES), rng.uniform(0, M_AREA_MILES))
+                                 for _ in range(address_count - 1)]
+
+
+def m_road_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Returns the straight line distance between two points rounded up to a tenth of a mile.
+
+    Rounding up keeps the triangle inequality: the rounded sum of two legs is already a multiple of a tenth and is at
+    least the true distance, so it is never below the rounded direct distance.
+
+    :arg
+        a (Tuple[float, float]): The first point
+        b (Tuple[float, float]): The second point
+
+    :returns
+        float: The distance in miles"""
+    return math.ceil(round(math.dist(a, b) * 10, 9)) / 10
+
+
+def m_location(point: Tuple[float, float]) -> Tuple[float, float]:
+    """Converts a point in miles to the latitude and longitude written to the address file, the inverse of
+    'spatial.m_project' with the hub as its reference.
+
+    :arg
+        point (Tuple[float, float]): The (x, y) position in miles
+
+    :returns
+        Tuple[float, float]: The (latitude, longitude)"""
+    center = M_AREA_MILES / 2
+    latitude, longitude = M_HUB_LOCATION
+    return (latitude + (point[1] - center) / M_MILES_PER_DEGREE,
+            longitude + (point[0] - center) / (M_MILES_PER_DEGREE * math.cos(math.radians(latitude))))
+
+
+def m_generate_dataset(directory: str, package_count: int, seed: int = M_DEFAULT_SEED,
+                       address_count: int = None) -> Tuple[str, str, str]:
+    """Writes a synthetic package, distance and address file in the formats of the files in CSV/.
+
+    The same seed and sizes always produce the same files. The first address is the hub. Distances are straight line
+    distances between random points rounded up to a tenth of a mile, so they are symmetric and metric, and are written
+    as a lower triangular table like Distance_File.csv. The address file also gives the latitude and longitude of each
+    point.
+
+    :arg
+        directory (str): The directory the files are written to, created if needed
+        package_count (int): The number of packages
+        seed (int, optional): The random seed
+        address_count (int, optional): The number of addresses including the hub, see 'm_default_address_count'
+
+    :returns
+        Tuple[str, str, str]: The paths of the package, distance and address files
+
+    :raises
+        ValueError: If there are fewer than 2 addresses or no packages
+    """
+    address_count = address_count or m_default_address_count(package_count)
+    if address_count < 2 or package_count < 1:
+        raise ValueError('A dataset needs at least 2 addresses and 1 package')
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    package_file = os.path.join(directory, 'Package_File.csv')
+    distance_file = os.path.join(directory, 'Distance_File.csv')
+    address_file = os.path.join(directory, 'Address_File.csv')
+
+    points = m_generate_points(address_count, rng)
+    addresses = [M_HUB_ADDRESS] + [f'{100 + vertex} {rng.choice(M_STREETS)} St'
+                                   for vertex in range(1, address_count)]
+    with open(address_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for vertex in range(address_count):
+            name = f'Location {vertex}' if vertex else 'Western Governors University'
+            latitude, longitude = m_location(points[vertex])
+            writer.writerow([vertex, name, addresses[vertex], f'{latitude:.9f}', f'{longitude:.9f}'])
+
+    with open(distance_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for x in range(address_count):
+            row = [f'{m_road_distance(points[x], points[y]):.1f}' for y in range(x)] + ['0']
+            writer.writerow(row + [''] * (address_count - x - 1))
+
+    with open(package_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for pID in range(1, package_count + 1):
+            vertex = rng.randrange(1, address_count)
+            writer.writerow([pID, addresses[vertex], 'Salt Lake City', 'UT', f'{84100 + vertex % 100}',
+                             rng.choice(M_DEADLINES), f'{rng.randint(1, 90)} Kilos', '', '', '', '', '', ''])
+
+    return package_file, distance_file, address_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Writes seeded synthetic package, distance and address CSV files')
+    parser.add_argument('directory', help='directory to write the files to')
+    parser.add_argument('--packages', type=int, default=1000, help='number of packages')
+    parser.add_argument('--addresses', type=int, default=None, help='number of addresses including the hub')
+    parser.add_argument('--seed', type=int, default=M_DEFAULT_SEED, help='random seed')
+    arguments = parser.parse_args()
+    for path in m_generate_dataset(arguments.directory, arguments.packages, arguments.seed, arguments.addresses):
+        print(path)
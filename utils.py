@@ -1,7 +1,107 @@
 # utils.py
 import csv
+import datetime
 import logging
-from typing import List
+import math
+import os
+import re
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from distance import MatrixDistanceProvider, m_shortest_path_closure
+
+m_logger = logging.getLogger('delivery.data')
+
+# Environment variable overriding log levels per subsystem, e.g. "delivery.service=INFO,delivery.routing=DEBUG"
+M_LOG_LEVELS_ENV = 'DELIVERY_LOG_LEVELS'
+
+# Street suffix and direction spellings folded to a single form when normalizing addresses
+M_ADDRESS_ABBREVIATIONS = {
+    'street': 'st',
+    'avenue': 'ave',
+    'boulevard': 'blvd',
+    'road': 'rd',
+    'drive': 'dr',
+    'lane': 'ln',
+    'court': 'ct',
+    'place': 'pl',
+    'parkway': 'pkwy',
+    'highway': 'hwy',
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+}
+
+
+def m_configure_logging(levels: Dict[str, str]) -> None:
+    """
+    Sets the log level of each subsystem logger ('delivery.data', 'delivery.service', ...).
+
+    The levels from the configuration are applied first, then any overrides from the DELIVERY_LOG_LEVELS environment
+    variable. Log calls in this project pass their values as arguments instead of pre-formatted strings, so a message
+    below its subsystem's level is never formatted.
+
+    :arg
+        levels (Dict[str, str]): Logger name to level name, e.g. {'delivery': 'WARNING'}
+
+    :raises
+        ValueError: If a level name is unknown or an override is not in the 'name=LEVEL' format
+    """
+    levels = dict(levels)
+    for override in filter(None, os.environ.get(M_LOG_LEVELS_ENV, '').split(',')):
+        name, separator, level = override.partition('=')
+        if not separator:
+            raise ValueError(f"Log level override '{override}' must be in the 'name=LEVEL' format")
+        levels[name.strip()] = level.strip()
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    for name, level in levels.items():
+        if not isinstance(logging.getLevelName(level.upper()), int):
+            raise ValueError(f'Unknown log level {level} for {name}')
+        logging.getLogger(name).setLevel(level.upper())
+
+
+def m_parse_deadline(deadline: str) -> Optional[datetime.timedelta]:
+    """
+    Converts a deadline from the package file (e.g. '10:30 AM' or 'EOD') into a time of day.
+
+    :arg
+        deadline (str): The deadline as written in the package file
+
+    :returns
+        datetime.timedelta: The deadline as a time of day, or None for an end of day deadline
+
+    :raises
+        ValueError: If the deadline is neither 'EOD' nor in the 'HH:MM AM/PM' format
+    """
+    if deadline.strip().upper() == 'EOD':
+        return None
+    parsed = datetime.datetime.strptime(deadline.strip(), '%I:%M %p')
+    return datetime.timedelta(hours=parsed.hour, minutes=parsed.minute)
+
+
+def m_parse_time_of_day(text: str) -> datetime.timedelta:
+    """
+    Converts a 24 hour time of day in the 'HH:MM' or 'HH:MM:SS' format into a timedelta.
+
+    :arg
+        text (str): The time of day
+
+    :returns
+        datetime.timedelta: The time of day
+
+    :raises
+        ValueError: If the text is not a valid time of day
+    """
+    parts = text.strip().split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f'Invalid time {text!r}, expected HH:MM')
+    (h, m, s) = map(int, parts + ['0'] * (3 - len(parts)))
+    if not 0 <= h <= 23 or not 0 <= m <= 59 or not 0 <= s <= 59:
+        raise ValueError('Invalid time entered. Hours are between 0-23 and minutes between 0-59.')
+    return datetime.timedelta(hours=h, minutes=m, seconds=s)
 
 
 class DataManager:
@@ -11,91 +111,293 @@ class DataManager:
     ID, a helper method to calculate the distance, then the actual method to calculate the distance.
 
     Attributes
-        m_package_file (List[List[str]]): A list of list containing package data loaded from the corresponding CSV file
-        m_distance_file (List[List[str]]): A list of list containing the adjacent matrix for distance calculations
-        m_address_file (List[List[str]]): A list of list containing address data used to extract the vertex's label or
-            ID
+        m_distance_matrix (List[array]): A symmetric matrix of float distances built once from the distance file, one
+            array('d') row per vertex. Missing distances are stored as NaN. With 'shortest_paths' every distance is
+            the shortest path through the table instead, and only vertices that cannot reach each other are NaN.
+            With a distance provider it is the provider's matrix, None if the provider has none.
+        m_address_index (Dict[str, int]): Maps exact and normalized addresses to their vertex ID
+        m_coordinates (List[Optional[Tuple[float, float]]]): The (latitude, longitude) of every vertex from the
+            optional 4th and 5th columns of the address file, None where they are not given
+        m_cache (InputCache): The cache the distance matrix and address index are loaded from, None if not cached
+        m_distance_provider (DistanceProvider): Where distances are read from, by default a MatrixDistanceProvider
+            over 'm_distance_matrix'
+
+    The CSV files are streamed, each row is converted as it is read and the raw rows are never kept. When a cache is
+    given and holds this input, the files are not read at all and the matrix rows are read-only memoryviews mapped
+    from the cache file. The package file is streamed separately by 'm_load_package_data' in main.py.
+
+    Distances are read through 'm_distance_provider', so another source (e.g. a road network service behind a
+    CachedDistanceProvider) can be plugged in without changing the callers.
     """
-    def __init__(self, package_file: str, distance_file: str, address_file: str):
+    def __init__(self, distance_file: Optional[str], address_file: str, cache=None, distance_provider=None,
+                 shortest_paths: bool = False):
         """Initializes a DataManager object.
 
-        This constructor loads data from three CSV files.
+        This constructor loads data from the distance and address CSV files. The distance file is not read when a
+        distance provider is given.
 
         :arg
-            m_package_file (List[List[str]]): A list of list containing package data loaded from the corresponding
-                CSV file 'Package_File.csv'
-            m_distance_file (List[List[str]]): A list of list containing the adjacent matrix for distance calculations
-                for the corresponding CSV file 'Distance_File.csv'
-            m_address_file (List[List[str]]): A list of list containing address data used to extract the vertex's label
-                or ID from the corresponding 'Address_File.csv'
+            distance_file (str): The path of the adjacent matrix for distance calculations, 'Distance_File.csv', None
+                with a distance provider
+            address_file (str): The path of the address data used to extract the vertex's label or ID,
+                'Address_File.csv'
+            cache (InputCache, optional): Loads the distance matrix and address index instead of parsing them, and
+                stores them after parsing on a cache miss
+            distance_provider (DistanceProvider, optional): Where distances are read from, defaults to the matrix
+                built from the distance file
+            shortest_paths (bool, optional): Replaces the distances from the distance file with their shortest path
+                closure, see 'm_shortest_path_closure'. A cache must be keyed on this setting, it stores the closed
+                matrix. Distances from a provider are used as they are.
+
+        :raises
+            ValueError: If neither a distance file nor a distance provider is given
         """
-        self.m_package_file = self.m_load_csv_file(package_file)
-        self.m_distance_file = self.m_load_csv_file(distance_file)
-        self.m_address_file = self.m_load_csv_file(address_file)
+        self.m_cache = cache
+
+        if distance_provider is not None:
+            self.m_distance_matrix = distance_provider.m_as_matrix()
+            if shortest_paths:
+                m_logger.warning('Shortest paths are only computed for the distance file, not a distance provider')
+        elif distance_file is None:
+            raise ValueError('A distance file or a distance provider is needed')
+        else:
+            self.m_distance_matrix = cache.m_load_distance_matrix() if cache else None
+            if self.m_distance_matrix is None:
+                self.m_distance_matrix = self.m_build_distance_matrix(self.m_iter_csv_file(distance_file))
+                if shortest_paths:
+                    self.m_distance_matrix = m_shortest_path_closure(self.m_distance_matrix)
+                if cache:
+                    cache.m_store_distance_matrix(self.m_distance_matrix)
+
+        self.m_address_index = cache.m_load_address_index() if cache else None
+        self.m_coordinates = cache.m_load_coordinates() if cache else None
+        if self.m_address_index is None or self.m_coordinates is None:
+            self.m_address_index, self.m_coordinates = self.m_build_address_data(self.m_iter_csv_file(address_file))
+            if cache:
+                cache.m_store_address_index(self.m_address_index)
+                cache.m_store_coordinates(self.m_coordinates)
+
+        # An empty CachedDistanceProvider is falsy, so it is compared with None
+        self.m_distance_provider = (distance_provider if distance_provider is not None
+                                    else MatrixDistanceProvider(self.m_distance_matrix))
 
     @staticmethod
-    def m_load_csv_file(filename: str) -> List[List[str]]:
+    def m_iter_csv_file(filename: str) -> Iterator[List[str]]:
         """
-        Loads a CSV file into a lists of lists
+        Streams the rows of a CSV file, one list of strings at a time.
 
         :arg
             filename: The path to the CSV file
 
         :returns
-            A lists of lists where each inner list represents a row from the CSV file.
+            Iterator[List[str]]: The rows, read only as they are consumed
 
         :raises
             FileNotFound: When a file is not found
             csv.Error parsing the CSV file sent
-            :exception
         """
         try:
-            with open(filename, 'r') as file:
-                return list(csv.reader(file))
+            with open(filename, 'r', newline='') as file:
+                reader = csv.reader(file)
+                try:
+                    yield from reader
+                except csv.Error as e:
+                    m_logger.error('CSV error in file %s line %d: %s', filename, reader.line_num, e)
+                    raise
         except FileNotFoundError:
-            logging.error(f'File not found {filename}')
+            m_logger.error('File not found %s', filename)
             raise
-        except csv.Error as e:
-            logging.error(f'CSV error in file {filename}: {e}')
-            raise
-        except Exception as e:
-            logging.error(f'Unexpected error when reading {filename}: {e}')
+
+    @staticmethod
+    def m_build_distance_matrix(distance_rows: Iterable[List[str]]) -> List[array]:
+        """
+        Builds a symmetric, fully populated matrix of floats from the raw lower triangular distance table.
+
+        Each row is parsed into an array('d') as it is read, so the raw strings are never kept. A non-empty cell keeps
+        its own value and an empty cell takes the value of the mirrored cell, and if both are empty the distance is
+        stored as NaN so 'm_distance_between' can report it.
+
+        :arg
+            distance_rows (Iterable[List[str]]): The raw rows of the distance CSV file
+
+        :returns
+            List[array]: One array('d') row per vertex where row[x][y] == row[y][x]
+
+        :raises
+            ValueError: If a cell cannot be converted to a float
+        """
+        matrix = []
+        for row_number, row in enumerate(distance_rows, 1):
+            try:
+                matrix.append(array('d', (float(cell) if cell != '' else math.nan for cell in row)))
+            except ValueError as e:
+                raise ValueError(f'Invalid distance on row {row_number}: {e}') from e
+
+        size = len(matrix)
+        for row in matrix:
+            if len(row) > size:
+                del row[size:]
+            elif len(row) < size:
+                row.extend(array('d', [math.nan]) * (size - len(row)))
+        for x in range(size):
+            row = matrix[x]
+            for y in range(x):  # fill each empty cell from its mirror, the lower triangle is usually the full one
+                if math.isnan(row[y]):
+                    row[y] = matrix[y][x]
+                elif math.isnan(matrix[y][x]):
+                    matrix[y][x] = row[y]
+        return matrix
+
+    def m_distance_row(self, x_value: int) -> array:
+        """
+        Returns every distance from one vertex, useful for scanning all candidates in a single pass.
+
+        :arg
+            x_value (int): Row index in the distance matrix
+
+        :returns
+            array: The array('d') row of distances from 'x_value' to every vertex
+        """
+        if self.m_distance_matrix is not None:
+            return self.m_distance_matrix[x_value]
+        provider = self.m_distance_provider
+        return array('d', provider.m_distances([(x_value, y) for y in range(provider.m_vertex_count())]))
+
+    def m_distance_block(self, vertices: Iterable[int]):
+        """
+        Returns the distances between a set of vertices, to index like the distance matrix.
+
+        When the distance provider holds a full matrix it is returned as is. Otherwise every pairwise distance between
+        the vertices is fetched in one batch with 'DistanceProvider.m_block'.
+
+        :arg
+            vertices (Iterable[int]): The vertices that will be looked up
+
+        :returns
+            The distance matrix, or a block indexed [x][y] by the given vertices
+        """
+        matrix = self.m_distance_provider.m_as_matrix()
+        if matrix is not None:
+            return matrix
+        return self.m_distance_provider.m_block(vertices)
+
+    @staticmethod
+    def m_normalize_address(address: str) -> str:
+        """
+        Normalizes an address so that small spelling differences map to the same key.
+
+        Case, punctuation and repeated whitespace are ignored, and street suffixes or directions are folded into their
+        abbreviations (e.g. 'South' -> 's', 'Street' -> 'st').
+
+        :arg
+            address (str): The address string to normalize
+
+        :returns
+            str: The normalized address
+        """
+        words = re.sub(r'[.,]', ' ', address.lower()).split()
+        return ' '.join(M_ADDRESS_ABBREVIATIONS.get(word, word) for word in words)
+
+    @classmethod
+    def m_build_address_data(cls, address_rows: Iterable[List[str]]) -> Tuple[Dict[str, int],
+                                                                              List[Optional[Tuple[float, float]]]]:
+        """
+        Builds the address index and reads the vertex coordinates in a single pass over the address rows.
+
+        The index maps both the exact and normalized form of every address to its vertex ID.
+
+        :arg
+            address_rows (Iterable[List[str]]): The raw rows of the address CSV file, 'vertex, name, address' followed
+                by 'latitude, longitude' when the location is known
+
+        :returns
+            Tuple[Dict[str, int], List[Optional[Tuple[float, float]]]]: The address index, and the (latitude,
+                longitude) of every vertex with None where a row has no coordinates
+
+        :raises
+            ValueError: If two different vertices share the same normalized address, a vertex ID is not an integer or
+                a coordinate is invalid
+        """
+        index = {}
+        coordinates: List[Optional[Tuple[float, float]]] = []
+        for row_number, row in enumerate(address_rows, 1):
+            vertex = int(row[0])
+            for key in (row[2], cls.m_normalize_address(row[2])):
+                if index.get(key, vertex) != vertex:
+                    raise ValueError(f"Address '{row[2]}' is listed for both vertex {index[key]} and {vertex}.")
+                index[key] = vertex
+            if vertex >= len(coordinates):
+                coordinates.extend([None] * (vertex + 1 - len(coordinates)))
+            coordinates[vertex] = cls.m_parse_coordinates(row, row_number)
+        return index, coordinates
+
+    @staticmethod
+    def m_parse_coordinates(row: List[str], row_number: int) -> Optional[Tuple[float, float]]:
+        """
+        Reads the optional latitude and longitude columns of an address row.
+
+        :arg
+            row (List[str]): The raw address row
+            row_number (int): The row's number in the file, for error messages
+
+        :returns
+            Tuple[float, float]: The (latitude, longitude), or None if the row has no coordinates
+
+        :raises
+            ValueError: If a coordinate is not a number or is out of range
+        """
+        if len(row) < 5 or not row[3].strip() or not row[4].strip():
+            return None
+        try:
+            latitude, longitude = float(row[3]), float(row[4])
+        except ValueError as e:
+            raise ValueError(f'Invalid coordinates on address row {row_number}: {e}') from e
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise ValueError(f'Coordinates on address row {row_number} are out of range')
+        return latitude, longitude
 
     def m_extract_address(self, address: str) -> int:
         """
         Provided the address, this will extract the label (vertex ID).
 
-        Assuming the 'm_address_file' holds the address data, this method will search for the row where the 'address'
-        field matches the provided 'address' argument. If a match is found, this will return the corresponding
-        vertex ID.
+        The address is first looked up as-is, then in its normalized form in 'm_address_index'. Only when both miss is
+        the address treated as a partial address, in which case it must be contained in exactly one known address. A
+        resolved partial address is added to the index so it is only searched for once.
 
         :arg
             address (str): The address string to search for
 
         :return
-            int: The vertex ID (label) associated with the address, or it will raise an exception if it's not found.
+            int: The vertex ID (label) associated with the address.
         :raises
-            ValueError: If the address data is not a list of a list OR if the vertex ID cannot be converted to an integer
+            ValueError: If the address is not found or if it partially matches more than one address
         """
+        vertex = self.m_address_index.get(address)
+        if vertex is not None:
+            return vertex
 
-        if not isinstance(self.m_address_file, list):
-            raise ValueError('Address data (m_address_file) must be a list of lists.')
-        try:
-            for row in self.m_address_file:
-                if address in row[2]:
-                    return int(row[0])
-            raise ValueError(f'Address {address} not found in address data.')
-        except (TypeError, ValueError) as e:
-            logging.error(f"Error extracting address label for '{address}': {e}")
+        normalized = self.m_normalize_address(address)
+        vertex = self.m_address_index.get(normalized)
+        if vertex is None:
+            matches = {v for key, v in self.m_address_index.items() if normalized and normalized in key}
+            if not matches:
+                m_logger.error("Error extracting address label for '%s': not found in address data", address)
+                raise ValueError(f'Address {address} not found in address data.')
+            if len(matches) > 1:
+                m_logger.error("Error extracting address label for '%s': matches vertices %s", address,
+                               sorted(matches))
+                raise ValueError(f'Address {address} is ambiguous, it matches vertices {sorted(matches)}.')
+            vertex = matches.pop()
+
+        self.m_address_index[address] = vertex
+        return vertex
 
     def m_distance_between(self, x_value: int, y_value: int) -> float:
         """
         Returns the distance between two locations given their indices in the adjacent matrix.
 
-        This function assumes that the adjacent matrix with weighted edges is stored in the 'm_distance_file' variable.
-        Then, it'll look up the x and y value, or the row and column value respectively within the matrix. However, if
-        that value is empty, it'll check the mirrored position, (col, row) or (y_value, x_value) respectively, to retrieve
-        the distance.
+        This function reads from 'm_distance_provider', which by default indexes 'm_distance_matrix'. Because the
+        matrix is already mirrored and converted to floats, the lookup is a plain indexed read of (x_value, y_value).
 
         :arg
             x_value (int): Row index in adjacent matrix
@@ -108,23 +410,21 @@ class DataManager:
         """
         try:
             # check for out of bounds
-            if x_value < 0 or x_value >= len(self.m_distance_file):
-                logging.error(f'x_value ({x_value}) is out of bounds for the distance matrix')
+            vertex_count = self.m_distance_provider.m_vertex_count()
+            if x_value < 0 or x_value >= vertex_count:
+                m_logger.error('x_value (%s) is out of bounds for the distance matrix', x_value)
                 raise IndexError(f'x_value ({x_value}) is out bounds for the distance matrix.')
-            if y_value < 0 or y_value >= len(self.m_distance_file):
-                logging.error(f'y_value ({y_value}) is out of bounds for the distance matrix')
+            if y_value < 0 or y_value >= vertex_count:
+                m_logger.error('y_value (%s) is out of bounds for the distance matrix', y_value)
                 raise IndexError(f'y_value ({y_value}) is out of bounds for the distance matrix')
 
-            # Access distance value and convert to float
-            distance = self.m_distance_file[x_value][y_value]
-            if distance == '':
-                distance = self.m_distance_file[y_value][x_value]
-                if distance == '':
-                    logging.error('Distance is not found between locations')
-                    raise ValueError('Distance is not found between locations')
-            return float(distance)
+            distance = self.m_distance_provider.m_distance(x_value, y_value)
+            if math.isnan(distance):
+                m_logger.error('Distance is not found between locations')
+                raise ValueError('Distance is not found between locations')
+            return distance
         except (IndexError, ValueError) as e:
-            logging.error(f'Error getting distance between {x_value} and {y_value}: {e}')
+            m_logger.error('Error getting distance between %s and %s: %s', x_value, y_value, e)
             raise
 
     def m_calculate_distance(self, address1: str, address2: str) -> float:
@@ -150,5 +450,5 @@ class DataManager:
             idx2 = self.m_extract_address(address2)
             return self.m_distance_between(idx1, idx2)  # Find distance using m_distance_between() method
         except ValueError as e:
-            logging.error(f'Error calculating distance: {e}')
+            m_logger.error('Error calculating distance: %s', e)
             raise